@@ -0,0 +1,342 @@
+"""Local columnar archive of trades and top of book snapshots, as Arrow IPC files partitioned by symbol and hour:
+
+    <root>/trades/symbol=XBTZAR/date=2023-01-12/hour=04/part-0000.arrow
+    <root>/book_snapshots/symbol=XBTZAR/date=2023-01-12/hour=04/part-0000.arrow
+
+Rows are buffered into column lists and written out as a record batch every batch_rows rows per partition, when
+max_buffered_rows are buffered across all partitions, and every flush_interval_secs. A partition's file is open as
+part-NNNN.arrow.partial while it's being written, and is closed, fsynced and renamed once a later hour arrives for
+its symbol, or the sink is closed, with a part-NNNN.arrow.index.json sidecar of its row count and min/max exchange
+timestamp written just before the rename, which trade_query uses to skip files. Timestamps are UTC epoch
+nanoseconds, prices and volumes are int64 scaled by 10**decimals, and trade counter volumes by
+10**counter_volume_decimals, both recorded in the schema metadata.
+
+A counter volume is price * volume, so can have as many decimal places as both together, which scaled into an int64
+would overflow above 922 units of the counter currency. It's rounded half even to counter_volume_decimals instead,
+which is recorded in the metadata too, and which must leave room for counter volumes up to MAX_COUNTER_VOLUME. A
+value that still doesn't fit an int64 rejects its row, rather than failing the batch it's written in.
+
+consume() forwards each message before archiving it, and a failure to archive or write is logged and counted, never
+allowed to end the loop, so a local disk problem can't hold up publishing. A batch that fails to write is dropped,
+rather than retried with every later one. pyarrow is an optional dependency, only needed here
+"""
+import json
+import os
+import queue
+import time
+from decimal import *
+from logging import getLogger
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from book_snapshots import BookSnapshot
+from numerics import parse_scaled
+from trade import Trade
+from utils.utils import LogLevelFlags, datetime_to_epoch_ns
+
+log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+TRADES = 'trades'
+BOOK_SNAPSHOTS = 'book_snapshots'
+ARCHIVE_DECIMALS = 8  # the Luno stream sends at most 8dp
+COUNTER_VOLUME_ROUNDING = ROUND_HALF_EVEN
+MAX_COUNTER_VOLUME = 10 ** 9  # units of the counter currency, far beyond any one trade
+INT64_MAX = 2 ** 63 - 1
+MAX_COUNTER_VOLUME_DECIMALS = len(str(INT64_MAX // MAX_COUNTER_VOLUME)) - 1
+PARTIAL_SUFFIX = '.partial'
+INDEX_SUFFIX = '.index.json'
+NS_PER_HOUR = 3600 * 1_000_000_000
+
+
+def trade_schema(decimals=ARCHIVE_DECIMALS, counter_volume_decimals=ARCHIVE_DECIMALS):
+    return pa.schema([('exchange_timestamp', pa.timestamp('ns', tz='UTC')),
+                      ('received_timestamp', pa.timestamp('ns', tz='UTC')),
+                      ('price', pa.int64()),
+                      ('volume', pa.int64()),
+                      ('counter_volume', pa.int64())],
+                     metadata={'kind': TRADES, 'decimals': str(decimals),
+                               'counter_volume_decimals': str(counter_volume_decimals),
+                               'counter_volume_rounding': COUNTER_VOLUME_ROUNDING})
+
+
+def book_snapshot_schema(decimals=ARCHIVE_DECIMALS):
+    levels = pa.list_(pa.int64())
+    return pa.schema([('exchange_timestamp', pa.timestamp('ns', tz='UTC')),
+                      ('received_timestamp', pa.timestamp('ns', tz='UTC')),
+                      ('sequence', pa.int64()),
+                      ('bid_prices', levels),
+                      ('bid_volumes', levels),
+                      ('ask_prices', levels),
+                      ('ask_volumes', levels)],
+                     metadata={'kind': BOOK_SNAPSHOTS, 'decimals': str(decimals)})
+
+
+def partition_dir(root, kind, symbol, hour_ns) -> str:
+    hour = time.gmtime(hour_ns // 1_000_000_000)
+    return os.path.join(root, kind, f"symbol={symbol}", f"date={time.strftime('%Y-%m-%d', hour)}",
+                        f"hour={hour.tm_hour:02d}")
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Partition:
+    """The buffered rows and open file for one kind, symbol and hour"""
+    def __init__(self, directory, schema, compression):
+        self.directory = directory
+        self.schema = schema
+        self.compression = compression
+        self.columns = [[] for _ in schema.names]
+        self.rows = 0
+        self.rows_written = 0
+        self.min_exchange_ns = self.max_exchange_ns = None
+        self.path = None
+        self._file = None
+        self._writer = None
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+        exchange_ns = row[0]
+        if self.min_exchange_ns is None or exchange_ns < self.min_exchange_ns:
+            self.min_exchange_ns = exchange_ns
+        if self.max_exchange_ns is None or exchange_ns > self.max_exchange_ns:
+            self.max_exchange_ns = exchange_ns
+
+    def flush(self) -> int:
+        """Writes the buffered rows, which are dropped if that fails"""
+        if not self.rows:
+            return 0
+        flushed = self.rows
+        try:
+            if self._writer is None:
+                self._open()
+            batch = pa.record_batch([pa.array(column, type=field.type)
+                                     for column, field in zip(self.columns, self.schema)], schema=self.schema)
+            self._writer.write_batch(batch)
+            self.rows_written += flushed
+        finally:
+            self.columns = [[] for _ in self.schema.names]
+            self.rows = 0
+        return flushed
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # a new part for each time the partition's opened, so a restart within the hour doesn't overwrite
+        existing = {name.split('.')[0] for name in os.listdir(self.directory) if name.startswith('part-')}
+        part = 0
+        while f"part-{part:04d}" in existing:
+            part += 1
+        self.path = os.path.join(self.directory, f"part-{part:04d}.arrow")
+        self._file = open(self.path + PARTIAL_SUFFIX, 'wb')
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        self._writer = pa.ipc.new_file(self._file, self.schema, options=options)
+
+    def close(self):
+        self.flush()
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._write_index()
+        os.replace(self.path + PARTIAL_SUFFIX, self.path)
+        _fsync_dir(self.directory)
+        self._writer = self._file = None
+
+    def _write_index(self):
+        # before the rename, so a complete file always has its index
+        index_path = self.path + INDEX_SUFFIX
+        with open(index_path + PARTIAL_SUFFIX, 'w') as f:
+            json.dump({'rows': self.rows_written, 'min_exchange_ns': self.min_exchange_ns,
+                       'max_exchange_ns': self.max_exchange_ns}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + PARTIAL_SUFFIX, index_path)
+
+
+class ArchiveSink:
+    """Archives Trade and BookSnapshot objects taken off a queue, see consume(). compression is any Arrow IPC
+    compression, 'zstd', 'lz4' or None"""
+    def __init__(self, root, batch_rows=10_000, max_buffered_rows=100_000, flush_interval_secs=5.0,
+                 compression='zstd', decimals=ARCHIVE_DECIMALS, counter_volume_decimals=ARCHIVE_DECIMALS):
+        if pa is None:
+            raise ValueError("pyarrow must be installed to archive trades")
+        if counter_volume_decimals > MAX_COUNTER_VOLUME_DECIMALS:
+            raise ValueError(f"counter_volume_decimals={counter_volume_decimals} can't hold counter volumes up to "
+                             f"{MAX_COUNTER_VOLUME} in an int64, use at most {MAX_COUNTER_VOLUME_DECIMALS}")
+        self.root = root
+        self.batch_rows = batch_rows
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_interval_secs = flush_interval_secs
+        self.compression = compression
+        self.decimals = decimals
+        self.counter_volume_decimals = counter_volume_decimals
+        self.schemas = {TRADES: trade_schema(decimals, counter_volume_decimals),
+                        BOOK_SNAPSHOTS: book_snapshot_schema(decimals)}
+        self.rows_archived = 0
+        self.rows_rejected = 0
+        self.counter_volumes_rounded = 0
+        self.rows_failed = 0  # accepted, but lost to a failure to write them
+        self.write_failures = 0
+        self.files_closed = 0
+        self._partitions = {}  # (kind, symbol, hour_ns) to _Partition
+        self._latest_hour = {}  # (kind, symbol) to the latest hour archived
+        self._buffered_rows = 0
+
+    def consume(self, source_queue, shutdown_event, forward_queue=None, forwarded_event=None):
+        """Archives everything on source_queue until shutdown_event is set and it's drained. With forward_queue,
+        each message is also put on it for a publisher to read, and forwarded_event is set once the last has been,
+        to be used as that publisher's shutdown_event"""
+        try:
+            next_flush = time.monotonic() + self.flush_interval_secs
+            while not shutdown_event.is_set() or source_queue.qsize() > 0:
+                try:
+                    message = source_queue.get(timeout=min(self.flush_interval_secs, 3))
+                except queue.Empty:
+                    message = None
+                if message is not None:
+                    # first, so publishing carries on whatever happens to the archive
+                    if forward_queue is not None:
+                        forward_queue.put(message)
+                    try:
+                        self.archive(message)
+                    except Exception as e:
+                        self.rows_failed += 1
+                        self._write_failed(f"Failed to archive {message}", e)
+                if time.monotonic() >= next_flush:
+                    self.flush()
+                    next_flush = time.monotonic() + self.flush_interval_secs
+        finally:
+            if forwarded_event is not None:
+                forwarded_event.set()
+            self.close()
+            log.info(f"ArchiveSink exiting, {self.metrics()}")
+
+    def archive(self, message):
+        try:
+            if isinstance(message, Trade):
+                kind, row = TRADES, self._trade_row(message)
+            elif isinstance(message, BookSnapshot):
+                kind, row = BOOK_SNAPSHOTS, self._book_snapshot_row(message)
+            else:
+                raise ValueError(f"Can't archive a {type(message).__name__}")
+        except ValueError as e:
+            self.rows_rejected += 1
+            log.error(f"Not archiving {message}: {e}")
+            return
+
+        hour_ns = row[0] - row[0] % NS_PER_HOUR
+        key = (kind, message.symbol, hour_ns)
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(partition_dir(self.root, *key), self.schemas[kind],
+                                                           self.compression)
+            if hour_ns > self._latest_hour.get(key[:2], hour_ns - 1):
+                self._rotate(kind, message.symbol, hour_ns)
+        partition.append(row)
+        self.rows_archived += 1
+        self._buffered_rows += 1
+        if partition.rows >= self.batch_rows:
+            self._flush_partition(partition)
+        elif self._buffered_rows >= self.max_buffered_rows:
+            self.flush()
+
+    def _rotate(self, kind, symbol, hour_ns):
+        # a later hour has arrived, so the earlier ones for the symbol are done with. A late row reopens its hour
+        # as a new part
+        self._latest_hour[(kind, symbol)] = hour_ns
+        for key in [key for key in self._partitions if key[:2] == (kind, symbol) and key[2] < hour_ns]:
+            self._close_partition(key)
+
+    def _flush_partition(self, partition):
+        rows = partition.rows
+        try:
+            partition.flush()
+        except Exception as e:
+            self.rows_failed += rows
+            self._write_failed(f"Failed to write {rows} rows to {partition.directory}", e)
+        finally:
+            self._buffered_rows -= rows
+
+    def _write_failed(self, message, e):
+        self.write_failures += 1
+        # a disk problem fails every write until it's fixed, so don't log every one
+        if self.write_failures == 1 or self.write_failures % 1000 == 0:
+            log.error(f"{message}: {e!r}, {self.write_failures} archive failures so far")
+
+    def _close_partition(self, key):
+        partition = self._partitions.pop(key)
+        self._flush_partition(partition)
+        try:
+            partition.close()
+        except Exception as e:
+            self._write_failed(f"Failed to close {partition.path}", e)
+            return
+        if partition.path:
+            self.files_closed += 1
+            if log_flags.info:
+                log.info(f"Archived {partition.path}")
+
+    @staticmethod
+    def _int64(value: int, original) -> int:
+        if abs(value) > INT64_MAX:
+            raise ValueError(f"{original} is too big for an int64 once scaled")
+        return value
+
+    def _scaled(self, value) -> int:
+        return self._int64(parse_scaled(str(value), self.decimals), value)
+
+    def _scaled_counter_volume(self, value: Decimal) -> int:
+        scaled = value.scaleb(self.counter_volume_decimals)
+        rounded = scaled.to_integral_value(COUNTER_VOLUME_ROUNDING)
+        if rounded != scaled:
+            self.counter_volumes_rounded += 1
+        return self._int64(int(rounded), value)
+
+    def _trade_row(self, trade: Trade):
+        numerics = trade.numerics
+        return (datetime_to_epoch_ns(trade.exchange_timestamp),
+                datetime_to_epoch_ns(trade.received_timestamp),
+                self._scaled(numerics.price_to_decimal(trade.price)),
+                self._scaled(numerics.volume_to_decimal(trade.volume)),
+                self._scaled_counter_volume(numerics.counter_volume_to_decimal(trade.counter_volume)))
+
+    def _book_snapshot_row(self, snapshot: BookSnapshot):
+        to_price, to_volume = snapshot.numerics.price_to_decimal, snapshot.numerics.volume_to_decimal
+        return (datetime_to_epoch_ns(snapshot.exchange_timestamp),
+                datetime_to_epoch_ns(snapshot.received_timestamp),
+                snapshot.sequence,
+                [self._scaled(to_price(price)) for price, _ in snapshot.bids],
+                [self._scaled(to_volume(volume)) for _, volume in snapshot.bids],
+                [self._scaled(to_price(price)) for price, _ in snapshot.asks],
+                [self._scaled(to_volume(volume)) for _, volume in snapshot.asks])
+
+    def flush(self):
+        for partition in self._partitions.values():
+            self._flush_partition(partition)
+
+    def close(self):
+        for key in list(self._partitions):
+            self._close_partition(key)
+
+    def metrics(self) -> dict:
+        return {'rows_archived': self.rows_archived,
+                'rows_rejected': self.rows_rejected,
+                'counter_volumes_rounded': self.counter_volumes_rounded,
+                'rows_failed': self.rows_failed,
+                'write_failures': self.write_failures,
+                'rows_buffered': self._buffered_rows,
+                'files_closed': self.files_closed,
+                'open_partitions': len(self._partitions)}
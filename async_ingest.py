@@ -0,0 +1,136 @@
+"""asyncio websocket ingest: connection handling, decode and OrderBookState dispatch for any number of symbols
+on one event loop. Reconnects are a loop with exponential backoff rather than recursion
+"""
+import asyncio
+import threading
+import time
+from logging import getLogger
+
+import websockets
+from websockets.asyncio.client import connect
+
+import ws_handlers
+from bars import DEFAULT_BAR_INTERVALS_SECS
+from book_analytics import DEFAULT_ANALYTICS_INTERVAL_SECS, DEFAULT_BANDS_BPS, DEFAULT_IMBALANCE_DEPTH
+from book_snapshots import DEFAULT_DEPTH, DEFAULT_INTERVAL_SECS
+from capture_supervisor import FLUSH_INTERVAL_SECS, SymbolStream, STREAM_URL
+
+log = getLogger(__name__)
+
+INITIAL_BACKOFF_SECS = 0.5
+MAX_BACKOFF_SECS = 30.0
+METRICS_LOG_INTERVAL_SECS = 60
+# don't hang around for the close handshake when abandoning a connection with frames still buffered
+CLOSE_TIMEOUT_SECS = 1.0
+
+
+class AsyncSocket:
+    """Passed to on_message in place of the websocket-client WebSocketApp. on_message closes the socket on an out
+    of sequence update, which here asks run_stream to reconnect"""
+    def __init__(self):
+        self.close_requested = False
+
+    def close(self):
+        self.close_requested = True
+
+
+async def run_stream(url, order_book, callbacks, credentials=None, initial_backoff=INITIAL_BACKOFF_SECS,
+                     max_backoff=MAX_BACKOFF_SECS):
+    """Stream url into callbacks until cancelled, reconnecting whenever the connection drops or the book goes out
+    of sequence. credentials is the message sent on connecting, built from secret_consts when None"""
+    credentials = credentials or ws_handlers.credentials_message()
+    backoff = initial_backoff
+    while True:
+        wsocket = AsyncSocket()
+        try:
+            async with connect(url, max_size=None, close_timeout=CLOSE_TIMEOUT_SECS) as connection:
+                log.info(f"Connected to {url}, sending credentials")
+                await connection.send(credentials)
+                async for message in connection:
+                    callbacks.on_message(wsocket, message)
+                    backoff = initial_backoff  # we're receiving again, so the next drop starts a fresh backoff
+                    if wsocket.close_requested:
+                        break
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            log.error(f"Connection to {url} failed: {e!r}")
+        except Exception as e:
+            # anything else, say from a handler, would otherwise end this symbol's stream for good
+            log.exception(f"Error streaming {url}: {e!r}")
+
+        if order_book.out_of_sequence_restart:
+            # reconnect straight away for a fresh snapshot
+            log.info(f"Out of sequence restart needed for {url}")
+            order_book.out_of_sequence_restart = False
+            continue
+        log.warning(f"Connection to {url} closed, reconnecting in {backoff:.1f}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, max_backoff)
+
+
+class AsyncCapture:
+    """Same run()/stop() interface as CaptureSupervisor, with every symbol's connection on one event loop in the
+    thread calling run()"""
+    def __init__(self, symbols, trade_queue, fixed_point=False, record_frames=False, url_template=STREAM_URL,
+                 credentials=None, book_queue=None, book_depth=DEFAULT_DEPTH,
+                 book_interval_secs=DEFAULT_INTERVAL_SECS, bar_queue=None,
+                 bar_intervals_secs=DEFAULT_BAR_INTERVALS_SECS, bar_volumes=(), analytics_queue=None,
+                 imbalance_depth=DEFAULT_IMBALANCE_DEPTH, bands_bps=DEFAULT_BANDS_BPS,
+                 analytics_interval_secs=DEFAULT_ANALYTICS_INTERVAL_SECS):
+        self.streams = {symbol: SymbolStream(symbol, trade_queue, fixed_point, record_frames, book_queue, book_depth,
+                                             book_interval_secs, bar_queue, bar_intervals_secs, bar_volumes,
+                                             analytics_queue, imbalance_depth, bands_bps, analytics_interval_secs)
+                        for symbol in symbols}
+        for symbol, stream in self.streams.items():
+            stream.url = url_template.format(symbol=symbol)
+        self.credentials = credentials
+        self._stop_requested = threading.Event()
+        self._loop = None
+        self._stopping = None
+
+    def run(self, shutdown_event: threading.Event):
+        """Blocks until stop() is called, then sets shutdown_event so the publisher drains and exits"""
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            log.info("Interrupted, closing all streams")
+        finally:
+            for stream in self.streams.values():
+                stream.finished.set()
+                stream.flush(force=True)
+                if stream.recorder:
+                    stream.recorder.close()
+            log.info(f"All streams finished: {self.metrics()}")
+            shutdown_event.set()
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        if self._stop_requested.is_set():
+            return
+        tasks = [asyncio.create_task(run_stream(stream.url, stream.order_book_state, stream.callbacks,
+                                                self.credentials), name=f"ws-{symbol}")
+                 for symbol, stream in self.streams.items()]
+        log.info(f"Capturing {list(self.streams)}")
+        next_metrics_log = time.monotonic() + METRICS_LOG_INTERVAL_SECS
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=FLUSH_INTERVAL_SECS)
+            except asyncio.TimeoutError:
+                pass
+            for stream in self.streams.values():
+                stream.flush()
+            if time.monotonic() >= next_metrics_log:
+                log.info(f"Capture metrics: {self.metrics()}")
+                next_metrics_log = time.monotonic() + METRICS_LOG_INTERVAL_SECS
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        # safe to call from any thread
+        self._stop_requested.set()
+        if self._loop and self._stopping:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def metrics(self) -> dict:
+        return {symbol: stream.metrics() for symbol, stream in self.streams.items()}
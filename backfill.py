@@ -0,0 +1,149 @@
+"""Rebuild the books and trades of recorded sessions, in parallel over a pool of processes, e.g. after a fix to how
+OrderBookState attributes trades.
+
+    python backfill.py recordings/*.frames --output backfill_out [--workers 8] [--fixed-point]
+
+Each frame log is one task. A log is a symbol's session from its first snapshot, named SYMBOL_YYYYmmddTHHMMSS.frames
+as recorded by capture_supervisor, so with the captures restarted daily it's a symbol-day. A book can only be
+rebuilt from a snapshot, so a log isn't split any finer. Frames are replayed as fast as possible with their recorded
+receive times, and with resync snapshots loaded inline, so the trades are the same as the live session's on every
+run. Each task writes its trades to <output>/<log name>.trades.jsonl, one message per line encoded with the
+JsonTradeSerializer the publisher uses, so they're byte for byte what was published.
+
+Per task throughput is logged as each finishes, then the totals and wall clock time
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent import futures
+from logging import getLogger
+
+from frame_log import FrameLogReader
+from order_book_state import OrderBookState
+from replay import replay
+from trade_serializers import JsonTradeSerializer
+from utils.utils import setup_logging
+from ws_handlers import WebsocketCallbackHandlers
+
+log = getLogger(__name__)
+
+FRAME_LOG_SUFFIX = '.frames'
+TRADES_SUFFIX = '.trades.jsonl'
+PARTIAL_SUFFIX = '.partial'
+
+
+def symbol_for_log(path) -> str:
+    # recordings are named SYMBOL_YYYYmmddTHHMMSS.frames
+    name = os.path.basename(path)
+    if '_' not in name:
+        raise ValueError(f"Can't tell the symbol of {path}, expected SYMBOL_YYYYmmddTHHMMSS{FRAME_LOG_SUFFIX}")
+    return name.split('_', 1)[0]
+
+
+def output_path(output_dir, path) -> str:
+    name = os.path.basename(path)
+    if name.endswith(FRAME_LOG_SUFFIX):
+        name = name[:-len(FRAME_LOG_SUFFIX)]
+    return os.path.join(output_dir, name + TRADES_SUFFIX)
+
+
+class TradeWriter:
+    """Takes the place of the trade queue, writing each trade as it's put"""
+    def __init__(self, file, serializer=JsonTradeSerializer()):
+        self.file = file
+        self.serializer = serializer
+        self.trades_written = 0
+
+    def put_nowait(self, trade):
+        self.file.write(self.serializer.encode(trade))
+        self.file.write(b'\n')
+        self.trades_written += 1
+
+    put = put_nowait
+
+
+class BackfillResult:
+    def __init__(self, path, symbol, output, frames, trades, reconnects, elapsed_secs):
+        self.path = path
+        self.symbol = symbol
+        self.output = output
+        self.frames = frames
+        self.trades = trades
+        self.reconnects = reconnects
+        self.elapsed_secs = elapsed_secs
+
+    @property
+    def frames_per_sec(self):
+        return self.frames / self.elapsed_secs if self.elapsed_secs else 0.0
+
+    def __repr__(self):
+        return (f"BackfillResult({self.path}: {self.frames} frames, {self.trades} trades, {self.reconnects} reconnects "
+                f"in {self.elapsed_secs:.3f}s, {self.frames_per_sec:.0f} frames/sec)")
+
+
+def backfill_log(path, output_dir, symbol=None, fixed_point=False) -> BackfillResult:
+    """One task: replays the frame log at path into a fresh book, writing its trades under output_dir. The output
+    is written as .partial and renamed once complete, so a failed task never leaves a complete looking file"""
+    symbol = symbol or symbol_for_log(path)
+    output = output_path(output_dir, path)
+    start = time.perf_counter()
+    with open(output + PARTIAL_SUFFIX, 'wb') as f:
+        writer = TradeWriter(f)
+        order_book_state = OrderBookState(symbol=symbol, trade_queue=writer, fixed_point=fixed_point)
+        handlers = WebsocketCallbackHandlers(order_book_state, background_resync=False)
+        stats = replay(FrameLogReader(path), handlers)
+    os.replace(output + PARTIAL_SUFFIX, output)
+    return BackfillResult(path, symbol, output, stats.frames, writer.trades_written, stats.reconnects,
+                          time.perf_counter() - start)
+
+
+def _worker_init():
+    setup_logging(level=logging.WARNING)
+
+
+def run_backfill(paths, output_dir, workers=None, symbol=None, fixed_point=False):
+    """Backfills every frame log in paths over a pool of workers processes, a cpu each by default. Returns the
+    results of the tasks that succeeded, in the order of paths, and the wall clock seconds taken"""
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    # the biggest logs first, so a long task isn't left running alone at the end
+    ordered = sorted(paths, key=os.path.getsize, reverse=True)
+    results = {}
+    start = time.perf_counter()
+    # spawn rather than fork, as with sharded_capture
+    with futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_worker_init) as executor:
+        tasks = {executor.submit(backfill_log, path, output_dir, symbol, fixed_point): path for path in ordered}
+        for task in futures.as_completed(tasks):
+            path = tasks[task]
+            try:
+                results[path] = task.result()
+                log.info(f"Backfilled {results[path]}")
+            except Exception as e:
+                log.error(f"Backfill of {path} failed: {e!r}")
+    wall_clock_secs = time.perf_counter() - start
+    frames = sum(result.frames for result in results.values())
+    trades = sum(result.trades for result in results.values())
+    frames_per_sec = frames / wall_clock_secs if wall_clock_secs else 0.0
+    log.info(f"Backfilled {len(results)} of {len(paths)} logs with {workers} workers in {wall_clock_secs:.1f}s: "
+             f"{frames} frames, {trades} trades, {frames_per_sec:.0f} frames/sec overall")
+    return [results[path] for path in paths if path in results], wall_clock_secs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frame_logs', nargs='+', help="frame logs written by FrameLogWriter")
+    parser.add_argument('--output', required=True, help="directory the trades are written to")
+    parser.add_argument('--workers', type=int, default=None, help="processes in the pool, a cpu each by default")
+    parser.add_argument('--symbol', default=None, help="symbol of every log, rather than taken from its name")
+    parser.add_argument('--fixed-point', action='store_true', help="key the books on scaled ints")
+    args = parser.parse_args()
+
+    setup_logging(level=logging.INFO)
+    run_backfill(args.frame_logs, args.output, args.workers, args.symbol, args.fixed_point)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""OHLCV bars built from the trade stream as it's captured. A BarPublisher listens to an OrderBookState's
+TradeProcessor and keeps one open bar per window, each updated in O(1) per trade:
+
+- time bars cover fixed intervals aligned to the epoch, on exchange time. One closes with the first trade or book
+  update at or after its end, so a quiet market still gets its bar closed promptly. Intervals without trades have
+  no bar
+- volume bars close on the trade that takes their volume to the threshold or over; trades aren't split across bars
+
+Closed bars are put onto a bounded queue, which a GcpRePublisher drains alongside (or instead of) the trades
+"""
+import datetime as dt
+import json
+import queue
+from decimal import *
+from logging import getLogger
+
+from numerics import DecimalNumerics
+from order_book_state import OrderBookState
+from utils.utils import LogLevelFlags, datetime_to_epoch_ns, epoch_ns_to_datetime
+
+log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+TIME_BARS = 'time'
+VOLUME_BARS = 'volume'
+DEFAULT_BAR_INTERVALS_SECS = (60,)
+
+
+class Bar:
+    """size is the interval in seconds for time bars, the volume threshold for volume bars. Prices and volumes are
+    in the numerics of the book the trades came from"""
+    __slots__ = ('symbol', 'kind', 'size', 'start', 'end', 'open', 'high', 'low', 'close', 'volume',
+                 'counter_volume', 'trades', 'numerics')
+
+    def __init__(self, symbol: str, kind: str, size, start: dt.datetime, end: dt.datetime, open_, high, low, close,
+                 volume, counter_volume, trades: int, numerics=None):
+        self.symbol = symbol
+        self.kind = kind
+        self.size = size
+        self.start = start
+        self.end = end
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.counter_volume = counter_volume
+        self.trades = trades
+        self.numerics = numerics or DecimalNumerics
+
+    def vwap(self) -> Decimal:
+        return self.numerics.counter_volume_to_decimal(self.counter_volume) / \
+            self.numerics.volume_to_decimal(self.volume)
+
+    def to_dict(self):
+        # the output boundary, as with Trade.to_dict()
+        to_price, to_volume = self.numerics.price_to_decimal, self.numerics.volume_to_decimal
+        return {'symbol': self.symbol,
+                'kind': self.kind,
+                'size': str(self.size),
+                'start': self.start.isoformat(),
+                'end': self.end.isoformat(),
+                'open': str(to_price(self.open)),
+                'high': str(to_price(self.high)),
+                'low': str(to_price(self.low)),
+                'close': str(to_price(self.close)),
+                'volume': str(to_volume(self.volume)),
+                'counter_volume': str(self.numerics.counter_volume_to_decimal(self.counter_volume)),
+                'vwap': str(self.vwap()),
+                'trades': self.trades}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'Bar':
+        return cls(values['symbol'], values['kind'], Decimal(values['size']),
+                   dt.datetime.fromisoformat(values['start']), dt.datetime.fromisoformat(values['end']),
+                   Decimal(values['open']), Decimal(values['high']), Decimal(values['low']), Decimal(values['close']),
+                   Decimal(values['volume']), Decimal(values['counter_volume']), values['trades'])
+
+
+class _BarWindow:
+    """The open bar for one window, kept as plain attributes so adding a trade allocates nothing"""
+    kind = None
+
+    def __init__(self, symbol, size, numerics):
+        self.symbol = symbol
+        self.size = size
+        self.numerics = numerics
+        self.trades = 0
+        self.start = self.end = None
+        self.open = self.high = self.low = self.close = None
+        self.volume = self.counter_volume = numerics.zero
+
+    def add(self, trade):
+        price = trade.price
+        if not self.trades:
+            self.open = self.high = self.low = price
+            self.volume = trade.volume
+            self.counter_volume = trade.counter_volume
+        else:
+            if price > self.high:
+                self.high = price
+            elif price < self.low:
+                self.low = price
+            self.volume += trade.volume
+            self.counter_volume += trade.counter_volume
+        self.close = price
+        self.trades += 1
+
+    def take(self) -> Bar:
+        bar = Bar(self.symbol, self.kind, self.size, self.start, self.end, self.open, self.high, self.low, self.close,
+                  self.volume, self.counter_volume, self.trades, self.numerics)
+        self.trades = 0
+        return bar
+
+
+class TimeBarWindow(_BarWindow):
+    kind = TIME_BARS
+
+    def __init__(self, symbol, interval_secs: int, numerics):
+        super().__init__(symbol, interval_secs, numerics)
+        self.interval_ns = int(interval_secs * 1e9)
+
+    def on_trade(self, trade):
+        """Returns the bar this trade closed, if any"""
+        closed = None
+        if self.trades and trade.exchange_timestamp >= self.end:
+            closed = self.take()
+        if not self.trades:
+            exchange_ns = datetime_to_epoch_ns(trade.exchange_timestamp)
+            start_ns = exchange_ns - exchange_ns % self.interval_ns
+            self.start = epoch_ns_to_datetime(start_ns)
+            self.end = epoch_ns_to_datetime(start_ns + self.interval_ns)
+        self.add(trade)
+        return closed
+
+    def on_time(self, exchange_time: dt.datetime):
+        if self.trades and exchange_time >= self.end:
+            return self.take()
+        return None
+
+
+class VolumeBarWindow(_BarWindow):
+    kind = VOLUME_BARS
+
+    def __init__(self, symbol, threshold: str, numerics):
+        super().__init__(symbol, Decimal(threshold), numerics)
+        self.threshold = numerics.parse_volume(str(threshold))
+
+    def on_trade(self, trade):
+        if not self.trades:
+            self.start = trade.exchange_timestamp
+        self.add(trade)
+        self.end = trade.exchange_timestamp
+        if self.volume >= self.threshold:
+            return self.take()
+        return None
+
+
+class BarPublisher:
+    """Listens to the trades of order_book_state, and its updates to close time bars, on the thread applying them.
+    bar_volumes are volume bar thresholds as decimal strings. The queue is never blocked on, a closed bar is dropped
+    when it's full"""
+    def __init__(self, order_book_state: OrderBookState, bar_queue: queue.Queue,
+                 intervals_secs=DEFAULT_BAR_INTERVALS_SECS, bar_volumes=()):
+        self.order_book_state = order_book_state
+        self.bar_queue = bar_queue
+        symbol, numerics = order_book_state.symbol, order_book_state.numerics
+        self.time_windows = [TimeBarWindow(symbol, interval_secs, numerics) for interval_secs in intervals_secs]
+        self.volume_windows = [VolumeBarWindow(symbol, threshold, numerics) for threshold in bar_volumes]
+        self.windows = self.time_windows + self.volume_windows
+        self.bars_published = 0
+        self.bars_dropped = 0
+        order_book_state.trade_processor.trade_listeners.append(self.on_trade)
+        if self.time_windows:
+            order_book_state.update_listeners.append(self.on_book_updated)
+
+    def on_trade(self, trade):
+        for window in self.windows:
+            closed = window.on_trade(trade)
+            if closed is not None:
+                self._publish(closed)
+
+    def on_book_updated(self, order_book_state, msg_time: dt.datetime, rec_time: dt.datetime):
+        for window in self.time_windows:
+            closed = window.on_time(msg_time)
+            if closed is not None:
+                self._publish(closed)
+
+    def _publish(self, bar: Bar):
+        try:
+            self.bar_queue.put_nowait(bar)
+            self.bars_published += 1
+            if log_flags.debug:
+                log.debug(f"Queued {bar.symbol} {bar.kind} bar. Bar queue size: {self.bar_queue.qsize()}")
+        except queue.Full:
+            self.bars_dropped += 1
+            log.error(f"Bar queue full, dropped {bar.symbol} {bar.kind} bar ({self.bars_dropped} dropped)")
+
+    def metrics(self) -> dict:
+        return {'bars_published': self.bars_published,
+                'bars_dropped': self.bars_dropped}
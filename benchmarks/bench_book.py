@@ -0,0 +1,173 @@
+"""Throughput and latency of the order book engine and trade pipeline over a synthetic Luno message stream.
+
+    python -m benchmarks.bench_book [--depth 3500] [--updates 50000] [--output results.json]
+                                    [--compare previous_results.json]
+
+Reports messages/sec, p50/p99 per-message latency and peak RSS for on_initial, on_create, on_delete and on_trade
+called directly, and for full on_message dispatch. Peak RSS is the process high-water mark after each stage
+"""
+import argparse
+import datetime as dt
+import json
+import platform
+import queue
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.synthetic import generate_frames
+from order_book_state import OrderBookState, MAX_BOOK_DEPTH
+from ws_handlers import WebsocketCallbackHandlers
+
+MSG_TIME = dt.datetime(2023, 1, 12, 4, 5, 5)
+REC_TIME = dt.datetime(2023, 1, 12, 4, 5, 6)
+
+
+class _NullSocket:
+    def close(self):
+        pass
+
+
+def _peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage  # bytes on macOS, KB elsewhere
+
+
+def _summarise(timings_ns):
+    if not timings_ns:
+        return {'messages': 0}
+    ordered = sorted(timings_ns)
+    total_ns = sum(ordered)
+    return {'messages': len(ordered),
+            'messages_per_sec': len(ordered) / (total_ns / 1e9) if total_ns else 0.0,
+            'mean_ns': statistics.fmean(ordered),
+            'p50_ns': ordered[len(ordered) // 2],
+            'p99_ns': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            'peak_rss_kb': _peak_rss_kb()}
+
+
+def _new_book(fixed_point):
+    return OrderBookState(symbol="XBTZAR", trade_queue=queue.SimpleQueue(), fixed_point=fixed_point)
+
+
+def bench_initial(snapshot, fixed_point, repeats):
+    timings = []
+    for _ in range(repeats):
+        book = _new_book(fixed_point)
+        start = time.perf_counter_ns()
+        book.on_initial(snapshot['asks'], 'ASK', MSG_TIME, REC_TIME)
+        book.on_initial(snapshot['bids'], 'BID', MSG_TIME, REC_TIME)
+        timings.append(time.perf_counter_ns() - start)
+    return _summarise(timings)
+
+
+def bench_handlers(snapshot, updates, fixed_point):
+    # updates are pre-decoded so only the book engine and trade pipeline are measured
+    book = _new_book(fixed_point)
+    book.on_initial(snapshot['asks'], 'ASK', MSG_TIME, REC_TIME)
+    book.on_initial(snapshot['bids'], 'BID', MSG_TIME, REC_TIME)
+    timings = {'on_create': [], 'on_delete': [], 'on_trade': []}
+    clock = time.perf_counter_ns
+    for update in updates:
+        create = update.get('create_update')
+        if create:
+            start = clock()
+            book.on_create(create, MSG_TIME, REC_TIME)
+            timings['on_create'].append(clock() - start)
+            continue
+        delete = update.get('delete_update')
+        if delete:
+            start = clock()
+            book.on_delete(delete, MSG_TIME, REC_TIME)
+            timings['on_delete'].append(clock() - start)
+            continue
+        trades = update.get('trade_updates')
+        if trades:
+            start = clock()
+            book.on_trade(trades, MSG_TIME, REC_TIME)
+            timings['on_trade'].append(clock() - start)
+    return {name: _summarise(values) for name, values in timings.items()}
+
+
+def bench_on_message(frames, fixed_point):
+    handlers = WebsocketCallbackHandlers(_new_book(fixed_point))
+    wsocket = _NullSocket()
+    handlers.on_message(wsocket, frames[0])  # the snapshot is covered by on_initial, so isn't timed here
+    timings = []
+    clock = time.perf_counter_ns
+    for frame in frames[1:]:
+        start = clock()
+        handlers.on_message(wsocket, frame)
+        timings.append(clock() - start)
+    return _summarise(timings)
+
+
+def run(depth, update_count, clustering, create, delete, fixed_point, initial_repeats):
+    frames = generate_frames(update_count, depth=depth, clustering=clustering, create=create, delete=delete)
+    snapshot = json.loads(frames[0])
+    updates = [json.loads(frame) for frame in frames[1:]]
+    results = {'on_initial': bench_initial(snapshot, fixed_point, initial_repeats)}
+    results.update(bench_handlers(snapshot, updates, fixed_point))
+    results['on_message'] = bench_on_message([frame.encode() for frame in frames], fixed_point)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results, previous=None):
+    print(f"{'stage':<12}{'messages':>10}{'msgs/sec':>12}{'p50 ns':>10}{'p99 ns':>10}{'peak RSS KB':>14}"
+          + (f"{'vs previous':>14}" if previous else ""))
+    for stage, result in results.items():
+        if not result['messages']:
+            continue
+        line = (f"{stage:<12}{result['messages']:>10}{result['messages_per_sec']:>12.0f}{result['p50_ns']:>10}"
+                f"{result['p99_ns']:>10}{result['peak_rss_kb']:>14}")
+        before = (previous or {}).get(stage)
+        if before and before.get('messages_per_sec'):
+            line += f"{result['messages_per_sec'] / before['messages_per_sec'] - 1:>+14.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=1000, help=f"levels per side, up to {MAX_BOOK_DEPTH}")
+    parser.add_argument('--updates', type=int, default=50000)
+    parser.add_argument('--clustering', type=float, default=10.0,
+                        help="mean distance of new orders from the touch, in ticks")
+    parser.add_argument('--create', type=float, default=0.45, help="fraction of updates which are creates")
+    parser.add_argument('--delete', type=float, default=0.45, help="fraction of updates which are deletes")
+    parser.add_argument('--fixed-point', action='store_true', help="run the book in fixed point mode")
+    parser.add_argument('--initial-repeats', type=int, default=5)
+    parser.add_argument('--output', help="save results as JSON to this path")
+    parser.add_argument('--compare', help="JSON results from a previous run to compare throughput against")
+    args = parser.parse_args()
+    if args.depth > MAX_BOOK_DEPTH:
+        parser.error(f"--depth can be at most {MAX_BOOK_DEPTH}")
+
+    results = run(args.depth, args.updates, args.clustering, args.create, args.delete, args.fixed_point,
+                  args.initial_repeats)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    _print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': _git_commit(),
+                       'timestamp': dt.datetime.utcnow().isoformat(),
+                       'python': platform.python_version(),
+                       'parameters': vars(args),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
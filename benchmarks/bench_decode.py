@@ -0,0 +1,72 @@
+"""Per-message decode and decode+dispatch cost of each installed frame decoder.
+
+    python -m benchmarks.bench_decode [--frames recorded_frames.jsonl] [--updates 20000]
+
+Frames are read one per line from --frames when given, otherwise a synthetic stream is generated
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.synthetic import generate_frames
+from decoders import available_decoders
+from order_book_state import OrderBookState
+from ws_handlers import WebsocketCallbackHandlers
+
+
+class _NullSocket:
+    def close(self):
+        pass
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def bench_decoder(decoder, frames):
+    decode = decoder.decode
+    start = time.perf_counter_ns()
+    for frame in frames:
+        decode(frame)
+    decode_ns = (time.perf_counter_ns() - start) / len(frames)
+
+    handlers = WebsocketCallbackHandlers(OrderBookState(symbol="XBTZAR"), decoder=decoder)
+    wsocket = _NullSocket()
+    timings = []
+    for frame in frames:
+        start = time.perf_counter_ns()
+        handlers.on_message(wsocket, frame)
+        timings.append(time.perf_counter_ns() - start)
+    # the snapshot dominates the first message, so leave it out of the per-update figures
+    updates = sorted(timings[1:])
+    return {'decoder': decoder.name,
+            'decode_ns': decode_ns,
+            'dispatch_mean_ns': statistics.fmean(updates),
+            'dispatch_p50_ns': _percentile(updates, 0.5),
+            'dispatch_p99_ns': _percentile(updates, 0.99),
+            'snapshot_ns': timings[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', help="file of recorded frames, one JSON message per line")
+    parser.add_argument('--updates', type=int, default=20000, help="synthetic updates to generate")
+    parser.add_argument('--depth', type=int, default=200, help="synthetic snapshot levels per side")
+    args = parser.parse_args()
+
+    if args.frames:
+        with open(args.frames, 'rb') as f:
+            frames = [line.rstrip(b'\n') for line in f if line.strip()]
+    else:
+        frames = [frame.encode() for frame in generate_frames(args.updates, depth=args.depth)]
+
+    print(f"{len(frames)} frames")
+    print(f"{'decoder':<10}{'decode ns':>12}{'dispatch mean ns':>20}{'p50 ns':>10}{'p99 ns':>10}")
+    for decoder in available_decoders():
+        result = bench_decoder(decoder, frames)
+        print(f"{result['decoder']:<10}{result['decode_ns']:>12.0f}{result['dispatch_mean_ns']:>20.0f}"
+              f"{result['dispatch_p50_ns']:>10}{result['dispatch_p99_ns']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""asyncio ingest throughput: N symbols streamed from a local LunoStreamStub into AsyncCapture on one event loop.
+
+    python -m benchmarks.bench_ingest [--symbols 1 4 16] [--updates 5000] [--depth 200]
+
+The stub runs in its own process, sending each symbol's synthetic frames as fast as the connection takes them, so
+the figures are for receive, decode and book dispatch of every symbol on the one loop
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from async_ingest import AsyncCapture
+from benchmarks.synthetic import generate_frames
+from stubs.luno_stream_stub import LunoStreamStub
+
+CREDENTIALS = '{"api_key_id": "key", "api_key_secret": "secret"}'
+
+
+def symbol_names(count):
+    return [f"SYM{n:03d}ZAR" for n in range(count)]
+
+
+def serve_frames(symbols, updates, depth, conn):
+    """Entry point of the stub process, sends its port then serves until told to stop"""
+    frames = {symbol: [generate_frames(updates, depth=depth, seed=seed + 1)]
+              for seed, symbol in enumerate(symbols)}
+
+    async def serve():
+        async with LunoStreamStub(frames) as stub:
+            conn.send(stub.port)
+            await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+
+    asyncio.run(serve())
+
+
+def bench_symbols(count, updates, depth):
+    symbols = symbol_names(count)
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    server = context.Process(target=serve_frames, args=(symbols, updates, depth, child_conn))
+    server.start()
+    port = conn.recv()
+
+    expected = updates + 1  # the snapshot and the updates
+    capture = AsyncCapture(symbols, queue.Queue(), url_template=f"ws://127.0.0.1:{port}/api/1/stream/{{symbol}}",
+                           credentials=CREDENTIALS)
+    runner = threading.Thread(target=capture.run, args=(threading.Event(),))
+    start = time.perf_counter()
+    runner.start()
+    finished = {}
+    while len(finished) < count:
+        for symbol, metrics in capture.metrics().items():
+            if symbol not in finished and metrics['messages'] >= expected:
+                finished[symbol] = time.perf_counter() - start
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    capture.stop()
+    runner.join()
+    conn.send(None)
+    server.join()
+    per_symbol = sorted(expected / secs for secs in finished.values())
+    return {'symbols': count,
+            'frames': expected * count,
+            'elapsed_secs': elapsed,
+            'frames_per_sec': expected * count / elapsed,
+            'slowest_symbol_frames_per_sec': per_symbol[0],
+            'fastest_symbol_frames_per_sec': per_symbol[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1, 4, 16], help="symbol counts to run")
+    parser.add_argument('--updates', type=int, default=5000, help="synthetic updates per symbol")
+    parser.add_argument('--depth', type=int, default=200, help="synthetic snapshot levels per side")
+    args = parser.parse_args()
+    # the stub closes each connection once its frames are sent, so leave out the reconnect warnings
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f"{'symbols':>8}{'frames':>10}{'secs':>8}{'frames/sec':>12}{'slowest sym/s':>15}{'fastest sym/s':>15}")
+    for count in args.symbols:
+        result = bench_symbols(count, args.updates, args.depth)
+        print(f"{result['symbols']:>8}{result['frames']:>10}{result['elapsed_secs']:>8.2f}"
+              f"{result['frames_per_sec']:>12.0f}{result['slowest_symbol_frames_per_sec']:>15.0f}"
+              f"{result['fastest_symbol_frames_per_sec']:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
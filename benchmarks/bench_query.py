@@ -0,0 +1,66 @@
+"""Query times over a day of synthetic archived trades: loading a time range, VWAP, and one minute OHLCV bars.
+
+    python -m benchmarks.bench_query [--trades 500000] [--compression zstd] [--repeat 5]
+"""
+import argparse
+import datetime as dt
+import random
+import tempfile
+import time
+from decimal import *
+
+from archive_sink import ArchiveSink
+from trade import Trade
+from trade_query import TradeQuery
+
+DAY = dt.datetime(2023, 1, 12)
+
+
+def archive_day(root, count, compression):
+    rng = random.Random(1)
+    sink = ArchiveSink(root, batch_rows=50_000, compression=compression)
+    step = dt.timedelta(days=1) / count
+    price = 300_000
+    for n in range(count):
+        price = max(1, price + rng.randint(-50, 50))
+        volume = Decimal(rng.randint(1, 100_000)).scaleb(-6)
+        exchange_dt = DAY + n * step
+        sink.archive(Trade("XBTZAR", exchange_dt, exchange_dt, Decimal(price), volume, price * volume))
+    sink.close()
+
+
+def best_ms(query, repeat):
+    best_ns = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        query()
+        elapsed_ns = time.perf_counter_ns() - start
+        best_ns = elapsed_ns if best_ns is None else min(best_ns, elapsed_ns)
+    return best_ns / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trades', type=int, default=500_000, help="trades over the day")
+    parser.add_argument('--compression', default='zstd', help="zstd, lz4 or none")
+    parser.add_argument('--repeat', type=int, default=5, help="best of this many runs is reported")
+    args = parser.parse_args()
+    compression = None if args.compression == 'none' else args.compression
+
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        archive_day(root, args.trades, compression)
+        print(f"archived {args.trades} trades ({args.compression}) in {time.perf_counter() - start:.1f}s")
+        query = TradeQuery(root)
+        query.trades("XBTZAR")  # reads the index sidecars the sink wrote
+        afternoon = (DAY + dt.timedelta(hours=12), DAY + dt.timedelta(hours=18))
+        print(f"{'query':<24}{'best ms':>10}")
+        for name, run in (('trades (day)', lambda: query.trades("XBTZAR")),
+                          ('trades (6 hours)', lambda: query.trades("XBTZAR", *afternoon)),
+                          ('vwap (day)', lambda: query.vwap("XBTZAR")),
+                          ('ohlcv 1m (day)', lambda: query.ohlcv("XBTZAR"))):
+            print(f"{name:<24}{best_ms(run, args.repeat):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
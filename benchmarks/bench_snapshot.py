@@ -0,0 +1,59 @@
+"""Snapshot load time of OrderBookState.on_initial against the per-order loop it replaced.
+
+    python -m benchmarks.bench_snapshot [--depth 3500] [--orders-per-level 4] [--repeat 5]
+"""
+import argparse
+import datetime as dt
+import json
+import time
+
+from benchmarks.synthetic import SyntheticStream
+from order_book_state import OrderBookState, OrderRecord, SIDES
+
+
+def legacy_on_initial(book_state, initial_msg, side_of_book, msg_time, rec_time, max_depth=3500):
+    # the original loop: one order at a time, stopping part way through the level after max_depth
+    side = SIDES[side_of_book]
+    msg_ns = int(msg_time.replace(tzinfo=dt.timezone.utc).timestamp() * 1e9)
+    rec_ns = int(rec_time.replace(tzinfo=dt.timezone.utc).timestamp() * 1e9)
+    for book_details in initial_msg:
+        price = book_state.numerics.parse_price(book_details['price'])
+        volume = book_state.numerics.parse_volume(book_details['volume'])
+        book_state.book_by_order_register[book_details['id']] = OrderRecord(side, price, volume, msg_ns, rec_ns)
+        book_state._add_to_level(side_of_book, price, volume)
+        if len(book_state.book[side_of_book].keys()) > max_depth:
+            break
+
+
+def bench(load, snapshot, fixed_point, repeat):
+    now = dt.datetime.utcnow()
+    best_ns = None
+    for _ in range(repeat):
+        book_state = OrderBookState(symbol="XBTZAR", fixed_point=fixed_point)
+        start = time.perf_counter_ns()
+        load(book_state, snapshot['asks'], 'ASK', now, now)
+        load(book_state, snapshot['bids'], 'BID', now, now)
+        elapsed_ns = time.perf_counter_ns() - start
+        best_ns = elapsed_ns if best_ns is None else min(best_ns, elapsed_ns)
+    return best_ns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=3500, help="snapshot levels per side")
+    parser.add_argument('--orders-per-level', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5, help="best of this many loads is reported")
+    args = parser.parse_args()
+
+    snapshot = json.loads(SyntheticStream(depth=args.depth, orders_per_level=args.orders_per_level).snapshot())
+    orders = len(snapshot['asks']) + len(snapshot['bids'])
+    print(f"{orders} orders over {2 * args.depth} levels, best of {args.repeat}")
+    print(f"{'mode':<14}{'legacy ms':>12}{'bulk ms':>12}{'speedup':>10}")
+    for mode, fixed_point in (('decimal', False), ('fixed point', True)):
+        legacy_ns = bench(legacy_on_initial, snapshot, fixed_point, args.repeat)
+        bulk_ns = bench(OrderBookState.on_initial, snapshot, fixed_point, args.repeat)
+        print(f"{mode:<14}{legacy_ns / 1e6:>12.2f}{bulk_ns / 1e6:>12.2f}{legacy_ns / bulk_ns:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
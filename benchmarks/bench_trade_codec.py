@@ -0,0 +1,60 @@
+"""Encoded size and encode/decode time of each trade wire format.
+
+    python -m benchmarks.bench_trade_codec [--trades 100000]
+"""
+import argparse
+import datetime as dt
+import random
+import time
+from decimal import *
+
+from numerics import FixedPointNumerics
+from trade import Trade
+from trade_serializers import SERIALIZERS
+
+
+def make_trades(count, fixed_point, seed=1):
+    rng = random.Random(seed)
+    numerics = FixedPointNumerics() if fixed_point else None
+    exchange_dt = dt.datetime(2023, 1, 12, 4, 5, 5, 654000)
+    trades = []
+    for n in range(count):
+        price = f"{rng.randint(440000, 450000)}.00000000"
+        volume = f"0.{rng.randint(1, 99999999):08d}"
+        counter = str(Decimal(price) * Decimal(volume))
+        if numerics:
+            values = numerics.parse_price(price), numerics.parse_volume(volume), numerics.parse_counter_volume(counter)
+        else:
+            values = Decimal(price).normalize(), Decimal(volume).normalize(), Decimal(counter).normalize()
+        exchange_dt += dt.timedelta(milliseconds=rng.randint(0, 500))
+        trades.append(Trade("XBTZAR", exchange_dt, exchange_dt + dt.timedelta(milliseconds=40), *values, numerics))
+    return trades
+
+
+def bench(serializer, trades):
+    start = time.perf_counter_ns()
+    encoded = [serializer.encode(trade) for trade in trades]
+    encode_ns = (time.perf_counter_ns() - start) / len(trades)
+    start = time.perf_counter_ns()
+    for data in encoded:
+        serializer.decode(data)
+    decode_ns = (time.perf_counter_ns() - start) / len(trades)
+    return sum(len(data) for data in encoded) / len(trades), encode_ns, decode_ns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trades', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'encoding':<12}{'book':<14}{'mean bytes':>12}{'encode ns':>12}{'decode ns':>12}")
+    for fixed_point in (False, True):
+        trades = make_trades(args.trades, fixed_point)
+        for encoding, serializer in SERIALIZERS.items():
+            size, encode_ns, decode_ns = bench(serializer, trades)
+            print(f"{encoding:<12}{'fixed point' if fixed_point else 'decimal':<14}{size:>12.1f}{encode_ns:>12.0f}"
+                  f"{decode_ns:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Synthetic Luno-shaped websocket frames: an initial snapshot followed by create, delete and trade updates
+against the orders resting in the book"""
+import json
+import random
+
+MID_PRICE_TICKS = 500000  # in price ticks of 1 unit, roughly XBTZAR
+VOLUME_DECIMALS = 8
+
+
+def _format(value: int, decimals: int = VOLUME_DECIMALS) -> str:
+    return f"{value // 10 ** decimals}.{value % 10 ** decimals:0{decimals}d}"
+
+
+class SyntheticStream:
+    """depth is the number of price levels per side in the snapshot, each holding orders_per_level orders.
+    New orders are placed a random distance from the touch, with clustering as the mean distance in ticks -
+    a small value concentrates activity on a few levels near the top of the book"""
+    def __init__(self, depth=200, orders_per_level=2, clustering=10.0, seed=1, start_timestamp_ms=1673496305654):
+        self.random = random.Random(seed)
+        self.depth = depth
+        self.orders_per_level = orders_per_level
+        self.clustering = clustering
+        self.sequence = 0
+        self.timestamp_ms = start_timestamp_ms
+        self.order_count = 0
+        self.orders = {}  # order_id -> [side, price, volume]
+        self.order_ids = []  # for O(1) random choice of an order to delete
+        self.order_positions = {}
+        self.levels = {'BID': {}, 'ASK': {}}  # side -> price -> [order_id]
+
+    def _next_header(self):
+        self.sequence += 1
+        self.timestamp_ms += self.random.randint(0, 20)
+        return {'sequence': str(self.sequence), 'timestamp': self.timestamp_ms}
+
+    def _new_order(self, side, price):
+        self.order_count += 1
+        order_id = f"BX{self.order_count:013d}"
+        volume = self.random.randint(1, 200) * 10 ** 5
+        self.orders[order_id] = [side, price, volume]
+        self.order_positions[order_id] = len(self.order_ids)
+        self.order_ids.append(order_id)
+        self.levels[side].setdefault(price, []).append(order_id)
+        return order_id, volume
+
+    def _remove_order(self, order_id):
+        side, price, _ = self.orders.pop(order_id)
+        position = self.order_positions.pop(order_id)
+        last = self.order_ids.pop()
+        if last != order_id:
+            self.order_ids[position] = last
+            self.order_positions[last] = position
+        level = self.levels[side][price]
+        level.remove(order_id)
+        if not level:
+            del self.levels[side][price]
+
+    def _random_price(self, side):
+        offset = 1 + int(self.random.expovariate(1 / self.clustering))
+        return MID_PRICE_TICKS - offset if side == 'BID' else MID_PRICE_TICKS + offset
+
+    def snapshot(self) -> str:
+        frame = self._next_header()
+        for side, key, sign in (('ASK', 'asks', 1), ('BID', 'bids', -1)):
+            orders = []
+            for level in range(1, self.depth + 1):
+                price = MID_PRICE_TICKS + sign * level
+                for _ in range(self.orders_per_level):
+                    order_id, volume = self._new_order(side, price)
+                    orders.append({'id': order_id, 'price': f"{price}.00000000", 'volume': _format(volume)})
+            frame[key] = orders
+        return json.dumps(frame)
+
+    def create(self) -> str:
+        side = self.random.choice(('BID', 'ASK'))
+        price = self._random_price(side)
+        order_id, volume = self._new_order(side, price)
+        frame = self._next_header()
+        frame['create_update'] = {'order_id': order_id, 'type': side, 'price': f"{price}.00000000",
+                                  'volume': _format(volume)}
+        return json.dumps(frame)
+
+    def delete(self) -> str:
+        order_id = self.order_ids[self.random.randrange(len(self.order_ids))]
+        self._remove_order(order_id)
+        frame = self._next_header()
+        frame['delete_update'] = {'order_id': order_id}
+        return json.dumps(frame)
+
+    def trade(self) -> str:
+        # fill against the oldest order at the best price on a random side
+        side = self.random.choice(('BID', 'ASK'))
+        if not self.levels[side]:
+            side = 'ASK' if side == 'BID' else 'BID'
+        best_price = (max if side == 'BID' else min)(self.levels[side])
+        order_id = self.levels[side][best_price][0]
+        order = self.orders[order_id]
+        base = min(order[2], self.random.randint(1, 100) * 10 ** 5)
+        order[2] -= base
+        if order[2] == 0:
+            self._remove_order(order_id)
+        counter = best_price * base
+        frame = self._next_header()
+        frame['trade_updates'] = [{'base': _format(base), 'counter': _format(counter),
+                                   'maker_order_id': order_id, 'taker_order_id': f"TK{self.sequence:013d}",
+                                   'order_id': order_id}]
+        return json.dumps(frame)
+
+    def updates(self, count: int, create=0.45, delete=0.45):
+        """create and delete are the fractions of updates of each kind, the remainder are trades"""
+        for _ in range(count):
+            draw = self.random.random()
+            if draw < create or len(self.orders) < 2:
+                yield self.create()
+            elif draw < create + delete:
+                yield self.delete()
+            else:
+                yield self.trade()
+
+
+def generate_frames(update_count=10000, depth=200, seed=1, **kwargs):
+    mix = {key: kwargs.pop(key) for key in ('create', 'delete') if key in kwargs}
+    stream = SyntheticStream(depth=depth, seed=seed, **kwargs)
+    return [stream.snapshot()] + list(stream.updates(update_count, **mix))
@@ -0,0 +1,267 @@
+"""Book features maintained as the book is updated: mid, microprice, the volume imbalance of the top N levels, the
+cumulative depth within bands of basis points either side of the mid, and a liquidity weighted spread, the
+difference between the volume weighted prices of the top N asks and bids.
+
+A BookAnalytics tracks the levels from the best down to the widest band, or the top N levels if they go deeper. A
+level change outside that range is ignored. A change in the volume of a tracked level is applied to the running
+sums as a delta, and only when a tracked level is added or removed, which is also when the mid can move, are the
+tracked levels read again from the book. Nothing is recomputed from the whole book, however deep it is.
+
+At most one BookFeatures per interval is put onto a bounded queue, which a GcpRePublisher drains alongside the
+trades. Features are floats, they're for models and dashboards rather than accounts
+"""
+import datetime as dt
+import json
+import queue
+import time
+from decimal import *
+from logging import getLogger
+
+from order_book_state import OrderBookState
+from utils.utils import LogLevelFlags
+
+log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+DEFAULT_IMBALANCE_DEPTH = 5
+DEFAULT_BANDS_BPS = (10, 25, 50)
+DEFAULT_ANALYTICS_INTERVAL_SECS = 1.0
+
+
+class BookFeatures:
+    """bid_depth and ask_depth are the cumulative volumes within each of bands_bps of the mid, narrowest first"""
+    __slots__ = ('symbol', 'sequence', 'exchange_timestamp', 'received_timestamp', 'mid', 'microprice', 'imbalance',
+                 'weighted_spread_bps', 'imbalance_depth', 'bands_bps', 'bid_depth', 'ask_depth')
+
+    def __init__(self, symbol: str, sequence: int, exchange_dt: dt.datetime, received_dt: dt.datetime, mid: float,
+                 microprice: float, imbalance: float, weighted_spread_bps: float, imbalance_depth: int, bands_bps,
+                 bid_depth, ask_depth):
+        self.symbol = symbol
+        self.sequence = sequence
+        self.exchange_timestamp = exchange_dt
+        self.received_timestamp = received_dt
+        self.mid = mid
+        self.microprice = microprice
+        self.imbalance = imbalance
+        self.weighted_spread_bps = weighted_spread_bps
+        self.imbalance_depth = imbalance_depth
+        self.bands_bps = bands_bps
+        self.bid_depth = bid_depth
+        self.ask_depth = ask_depth
+
+    def to_dict(self):
+        return {'symbol': self.symbol,
+                'sequence': self.sequence,
+                'exchange_timestamp': self.exchange_timestamp.isoformat(),
+                'received_timestamp': self.received_timestamp.isoformat(),
+                'mid': self.mid,
+                'microprice': self.microprice,
+                'imbalance': self.imbalance,
+                'weighted_spread_bps': self.weighted_spread_bps,
+                'imbalance_depth': self.imbalance_depth,
+                'bands_bps': list(self.bands_bps),
+                'bid_depth': list(self.bid_depth),
+                'ask_depth': list(self.ask_depth)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'BookFeatures':
+        return cls(values['symbol'], values['sequence'], dt.datetime.fromisoformat(values['exchange_timestamp']),
+                   dt.datetime.fromisoformat(values['received_timestamp']), values['mid'], values['microprice'],
+                   values['imbalance'], values['weighted_spread_bps'], values['imbalance_depth'],
+                   values['bands_bps'], values['bid_depth'], values['ask_depth'])
+
+
+class _TrackedSide:
+    """The tracked levels of one side of the book and the running sums over them, in the book's numerics"""
+    __slots__ = ('volumes', 'edge', 'top_edge', 'band_edges', 'top_volume', 'top_notional', 'band_volumes')
+
+    def __init__(self, bands: int, zero):
+        self.volumes = {}  # by price
+        self.edge = None  # the deepest tracked price, None when every level is tracked
+        self.top_edge = None  # the price of the Nth level, None when there are fewer than N
+        self.band_edges = []
+        self.top_volume = self.top_notional = zero
+        self.band_volumes = [zero] * bands
+
+
+class BookAnalytics:
+    """Listens to order_book_state on the thread applying its updates. imbalance_depth is the N of the top N levels
+    used for the imbalance and the weighted spread. Features are published when an update changes a tracked level,
+    coalesced to at most one every interval_secs. Features held back by the interval go out with the first update
+    after it, or on the next flush(), as with TopOfBookPublisher. The queue is never blocked on, features are dropped
+    when it's full. features() can also be read directly, it's only recomputed when stale"""
+    def __init__(self, order_book_state: OrderBookState, analytics_queue: queue.Queue = None,
+                 imbalance_depth=DEFAULT_IMBALANCE_DEPTH, bands_bps=DEFAULT_BANDS_BPS,
+                 interval_secs=DEFAULT_ANALYTICS_INTERVAL_SECS):
+        if imbalance_depth < 1 or not bands_bps:
+            raise ValueError("imbalance_depth must be at least 1 and bands_bps not empty")
+        self.order_book_state = order_book_state
+        self.analytics_queue = analytics_queue
+        self.numerics = order_book_state.numerics
+        self.imbalance_depth = imbalance_depth
+        self.bands_bps = tuple(sorted(bands_bps))
+        self._band_factors = [Decimal(str(bps)).scaleb(-4) for bps in self.bands_bps]
+        self.interval_ns = int(interval_secs * 1e9)
+        fixed_point = self.numerics.fixed_point
+        self._price_scale = 10.0 ** -self.numerics.price_decimals if fixed_point else 1.0
+        self._volume_scale = 10.0 ** -self.numerics.volume_decimals if fixed_point else 1.0
+        self.sides = {'BID': _TrackedSide(len(self.bands_bps), self.numerics.zero),
+                      'ASK': _TrackedSide(len(self.bands_bps), self.numerics.zero)}
+        self.recomputes = 0  # tracked levels read again from the book
+        self.incremental_updates = 0  # tracked level volume changes applied as a delta
+        self.features_published = 0
+        self.features_dropped = 0
+        self._stale = True
+        self._changed = False
+        self._next_due_ns = 0
+        self._msg_time = self._rec_time = None
+        order_book_state.level_listeners.append(self.on_level_changed)
+        order_book_state.update_listeners.append(self.on_book_updated)
+
+    def on_level_changed(self, side_of_book, price):
+        if self._stale:
+            return
+        if price is None:
+            self._stale = True
+            return
+        tracked = self.sides[side_of_book]
+        edge = tracked.edge
+        bid = side_of_book == 'BID'
+        if edge is not None and (price < edge if bid else price > edge):
+            return
+        old_volume = tracked.volumes.get(price)
+        volume = self.order_book_state.book[side_of_book].get(self.numerics.book_key(price))
+        if old_volume is None or volume is None:
+            # a tracked level added or removed
+            self._stale = True
+            return
+        delta = volume - old_volume
+        tracked.volumes[price] = volume
+        top_edge = tracked.top_edge
+        if top_edge is None or (price >= top_edge if bid else price <= top_edge):
+            tracked.top_volume += delta
+            tracked.top_notional += price * delta
+        band_volumes = tracked.band_volumes
+        for n, band_edge in enumerate(tracked.band_edges):
+            if price >= band_edge if bid else price <= band_edge:
+                band_volumes[n] += delta
+        self.incremental_updates += 1
+        self._changed = True
+
+    def on_book_updated(self, order_book_state, msg_time: dt.datetime, rec_time: dt.datetime):
+        self._msg_time, self._rec_time = msg_time, rec_time
+        if self.analytics_queue is not None:
+            self._publish_due(time.monotonic_ns())
+
+    def flush(self, force=False):
+        """Publish features held back by the interval once they're due, or straight away with force. Safe to call
+        off the book's thread, it holds the book's lock"""
+        if self.analytics_queue is None:
+            return
+        with self.order_book_state.lock:
+            # nothing to publish until the book's first update
+            if self._msg_time is not None:
+                self._publish_due(time.monotonic_ns(), force)
+
+    def _publish_due(self, now_ns, force=False):
+        if not (self._stale or self._changed) or (not force and now_ns < self._next_due_ns):
+            return
+        features = self.features()
+        if features is None:
+            return  # one side of the book is empty
+        self._next_due_ns = now_ns + self.interval_ns
+        try:
+            self.analytics_queue.put_nowait(features)
+            self._changed = False
+            self.features_published += 1
+            if log_flags.debug:
+                log.debug(f"Queued {features.symbol} book features. Analytics queue size: "
+                          f"{self.analytics_queue.qsize()}")
+        except queue.Full:
+            # still changed, so fresh features go out once the queue has room
+            self.features_dropped += 1
+            if log_flags.debug:
+                log.debug(f"Analytics queue full, dropped {features.symbol} book features")
+
+    def _recompute(self):
+        book_state = self.order_book_state
+        best_bid, best_ask = book_state.levels['BID'].best(), book_state.levels['ASK'].best()
+        self._stale = False
+        self._changed = True
+        self.recomputes += 1
+        if best_bid is None or best_ask is None:
+            # nothing to measure from, track every level so the first one on the empty side is noticed
+            for tracked in self.sides.values():
+                tracked.volumes.clear()
+                tracked.edge = None
+            return False
+        # twice the mid, which is exact in fixed point
+        double_mid = Decimal(best_bid + best_ask)
+        for side_of_book, tracked in self.sides.items():
+            bid = side_of_book == 'BID'
+            levels = book_state.levels[side_of_book]
+            band_edges = [double_mid * ((1 - factor) if bid else (1 + factor)) / 2 for factor in self._band_factors]
+            if self.numerics.fixed_point:
+                # a bid's in a band when price >= edge and an ask when price <= edge, so round the edge into the band
+                rounding = ROUND_CEILING if bid else ROUND_FLOOR
+                band_edges = [int(band_edge.to_integral_value(rounding)) for band_edge in band_edges]
+            top_edge = levels.nth(self.imbalance_depth)
+            if top_edge is None:
+                edge = None
+            else:
+                edge = min(top_edge, band_edges[-1]) if bid else max(top_edge, band_edges[-1])
+            prices = levels.until(edge) if edge is not None else levels.top(len(levels))
+            side = book_state.book[side_of_book]
+            book_key = self.numerics.book_key
+            volumes = {price: side[book_key(price)] for price in prices}
+            zero = self.numerics.zero
+            top_volume = top_notional = zero
+            for price in prices[:self.imbalance_depth]:
+                top_volume += volumes[price]
+                top_notional += price * volumes[price]
+            band_volumes = []
+            for band_edge in band_edges:
+                band_volume = zero
+                for price in prices:
+                    if price < band_edge if bid else price > band_edge:
+                        break
+                    band_volume += volumes[price]
+                band_volumes.append(band_volume)
+            tracked.volumes = volumes
+            tracked.edge, tracked.top_edge, tracked.band_edges = edge, top_edge, band_edges
+            tracked.top_volume, tracked.top_notional, tracked.band_volumes = top_volume, top_notional, band_volumes
+        return True
+
+    def features(self) -> BookFeatures:
+        """The features as of the last update, or None when either side of the book is empty"""
+        if self._stale and not self._recompute():
+            return None
+        book_state = self.order_book_state
+        best_bid, best_ask = book_state.levels['BID'].best(), book_state.levels['ASK'].best()
+        if best_bid is None or best_ask is None:
+            return None
+        bids, asks = self.sides['BID'], self.sides['ASK']
+        # the running sums stay in the book's numerics, exact, and are only scaled to floats here
+        price_scale, volume_scale = self._price_scale, self._volume_scale
+        bid_price, ask_price = float(best_bid) * price_scale, float(best_ask) * price_scale
+        bid_volume = float(bids.volumes[best_bid]) * volume_scale
+        ask_volume = float(asks.volumes[best_ask]) * volume_scale
+        mid = (bid_price + ask_price) / 2
+        microprice = (bid_price * ask_volume + ask_price * bid_volume) / (bid_volume + ask_volume)
+        top_bid_volume, top_ask_volume = float(bids.top_volume), float(asks.top_volume)
+        imbalance = (top_bid_volume - top_ask_volume) / (top_bid_volume + top_ask_volume)
+        bid_vwap = float(bids.top_notional / bids.top_volume) * price_scale
+        ask_vwap = float(asks.top_notional / asks.top_volume) * price_scale
+        return BookFeatures(book_state.symbol, book_state.sequence_num, self._msg_time, self._rec_time, mid,
+                            microprice, imbalance, (ask_vwap - bid_vwap) / mid * 1e4, self.imbalance_depth,
+                            self.bands_bps, [float(volume) * volume_scale for volume in bids.band_volumes],
+                            [float(volume) * volume_scale for volume in asks.band_volumes])
+
+    def metrics(self) -> dict:
+        return {'analytics_recomputes': self.recomputes,
+                'analytics_incremental_updates': self.incremental_updates,
+                'features_published': self.features_published,
+                'features_dropped': self.features_dropped}
@@ -0,0 +1,68 @@
+"""Render the top of an order book in place in a terminal. Only the rows that changed since the last frame are
+redrawn, using ANSI cursor positioning, and frames are capped to max_fps however fast updates arrive
+"""
+import sys
+import time
+
+CLEAR_SCREEN = "\x1b[2J"
+CLEAR_TO_END_OF_LINE = "\x1b[K"
+COLUMN_WIDTH = 16
+HEADER = "".join(f"{title:>{COLUMN_WIDTH}}" for title in ('bid_price', 'bid_volume', 'ask_price', 'ask_volume'))
+
+
+def move_to(row: int) -> str:
+    # rows are numbered from 1 at the top of the screen
+    return f"\x1b[{row};1H"
+
+
+class TerminalBookRenderer:
+    def __init__(self, depth=10, max_fps=10.0, stream=None):
+        self.depth = depth
+        self.min_interval_ns = int(1e9 / max_fps) if max_fps else 0
+        self.stream = stream or sys.stdout
+        self.frames_drawn = 0
+        self.rows_drawn = 0
+        self._rows = None  # what's on screen, None until the first frame has cleared it
+        self._next_frame_ns = 0
+
+    def render(self, order_book_state):
+        now_ns = time.monotonic_ns()
+        if now_ns < self._next_frame_ns:
+            return
+        self._next_frame_ns = now_ns + self.min_interval_ns
+        self.draw(self.format_rows(order_book_state))
+
+    def format_rows(self, order_book_state):
+        # read straight off the level index, which is already sorted best first
+        to_price, to_volume = order_book_state.numerics.price_to_decimal, order_book_state.numerics.volume_to_decimal
+        bids = order_book_state.top_n('BID', self.depth)
+        asks = order_book_state.top_n('ASK', self.depth)
+        rows = [f"{order_book_state.symbol} @ {order_book_state.sequence_num}", HEADER]
+        for n in range(self.depth):
+            cells = []
+            for levels in (bids, asks):
+                if n < len(levels):
+                    cells.append(f"{to_price(levels[n].price):>{COLUMN_WIDTH}}"
+                                 f"{to_volume(levels[n].quantity):>{COLUMN_WIDTH}}")
+                else:
+                    cells.append(" " * 2 * COLUMN_WIDTH)
+            rows.append("".join(cells).rstrip())
+        return rows
+
+    def draw(self, rows):
+        if self._rows is None:
+            out = [CLEAR_SCREEN]
+            changed = range(len(rows))
+        else:
+            out = []
+            changed = [n for n, row in enumerate(rows) if row != self._rows[n]]
+        for n in changed:
+            out.append(move_to(n + 1) + rows[n] + CLEAR_TO_END_OF_LINE)
+        if out:
+            # park the cursor below the book so anything else printed doesn't land in it
+            out.append(move_to(len(rows) + 1))
+            self.stream.write("".join(out))
+            self.stream.flush()
+        self._rows = rows
+        self.frames_drawn += 1
+        self.rows_drawn += len(changed)
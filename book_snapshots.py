@@ -0,0 +1,142 @@
+"""Top of book depth snapshots. A TopOfBookPublisher watches an OrderBookState for changes to its top N levels, and
+puts at most one BookSnapshot per interval onto a bounded queue, which a GcpRePublisher drains alongside the trades.
+Updates that only touch levels deeper in the book emit nothing
+"""
+import datetime as dt
+import json
+import queue
+import time
+from decimal import *
+from logging import getLogger
+
+from numerics import DecimalNumerics
+from order_book_state import OrderBookState
+from utils.utils import LogLevelFlags
+
+log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+DEFAULT_DEPTH = 10
+DEFAULT_INTERVAL_SECS = 1.0
+
+
+class BookSnapshot:
+    """The top levels of each side of the book, best first, as (price, volume) in the book's numerics"""
+    __slots__ = ('symbol', 'sequence', 'exchange_timestamp', 'received_timestamp', 'bids', 'asks', 'numerics')
+
+    def __init__(self, symbol: str, sequence: int, exchange_dt: dt.datetime, received_dt: dt.datetime, bids, asks,
+                 numerics=None):
+        self.symbol = symbol
+        self.sequence = sequence
+        self.exchange_timestamp = exchange_dt
+        self.received_timestamp = received_dt
+        self.bids = bids
+        self.asks = asks
+        self.numerics = numerics or DecimalNumerics
+
+    def to_dict(self):
+        # the output boundary, as with Trade.to_dict()
+        to_price, to_volume = self.numerics.price_to_decimal, self.numerics.volume_to_decimal
+        return {'symbol': self.symbol,
+                'sequence': self.sequence,
+                'exchange_timestamp': self.exchange_timestamp.isoformat(),
+                'received_timestamp': self.received_timestamp.isoformat(),
+                'bids': [[str(to_price(price)), str(to_volume(volume))] for price, volume in self.bids],
+                'asks': [[str(to_price(price)), str(to_volume(volume))] for price, volume in self.asks]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'BookSnapshot':
+        return cls(values['symbol'], values['sequence'],
+                   dt.datetime.fromisoformat(values['exchange_timestamp']),
+                   dt.datetime.fromisoformat(values['received_timestamp']),
+                   [(Decimal(price), Decimal(volume)) for price, volume in values['bids']],
+                   [(Decimal(price), Decimal(volume)) for price, volume in values['asks']])
+
+
+class TopOfBookPublisher:
+    """Listens to order_book_state on the thread applying its updates. A snapshot is due when an update changes any
+    of the top depth levels on either side, and bursts of them are coalesced so that at most one snapshot is put
+    every interval_secs. A snapshot that's due but held back goes out with the first update after the interval, or
+    on the next flush(), which the capture calls on a timer so a book that's gone quiet is still published, and at
+    shutdown. The queue is never blocked on, a snapshot is dropped when it's full"""
+    def __init__(self, order_book_state: OrderBookState, book_queue: queue.Queue, depth=DEFAULT_DEPTH,
+                 interval_secs=DEFAULT_INTERVAL_SECS):
+        self.order_book_state = order_book_state
+        self.book_queue = book_queue
+        self.depth = depth
+        self.interval_ns = int(interval_secs * 1e9)
+        self.top_changes = 0  # updates that changed the top of the book
+        self.snapshots_published = 0
+        self.snapshots_dropped = 0
+        self._touched_top = False
+        self._pending = False
+        self._next_due_ns = 0
+        self._msg_time = self._rec_time = None
+        order_book_state.level_listeners.append(self.on_level_changed)
+        order_book_state.update_listeners.append(self.on_book_updated)
+
+    def on_level_changed(self, side_of_book, price):
+        if self._touched_top:
+            return
+        if price is None:
+            self._touched_top = True
+            return
+        # the level is in the top depth if it's at least as good as the level depth from the top, which after a
+        # removal is also true of a level that was in the top depth before it
+        levels = self.order_book_state.levels[side_of_book]
+        nth_price = levels.nth(self.depth)
+        if nth_price is None or (price >= nth_price if levels.descending else price <= nth_price):
+            self._touched_top = True
+
+    def on_book_updated(self, order_book_state, msg_time: dt.datetime, rec_time: dt.datetime):
+        self._msg_time, self._rec_time = msg_time, rec_time
+        if self._touched_top:
+            self._touched_top = False
+            self._pending = True
+            self.top_changes += 1
+        if not self._pending:
+            return
+        now_ns = time.monotonic_ns()
+        if now_ns < self._next_due_ns:
+            return
+        self._next_due_ns = now_ns + self.interval_ns
+        self._publish(msg_time, rec_time)
+
+    def flush(self, force=False):
+        """Publish a snapshot held back by the interval once it's due, or straight away with force. Safe to call off
+        the book's thread, it holds the book's lock"""
+        with self.order_book_state.lock:
+            if not self._pending:
+                return
+            now_ns = time.monotonic_ns()
+            if not force and now_ns < self._next_due_ns:
+                return
+            self._next_due_ns = now_ns + self.interval_ns
+            # as of the last update, the book hasn't changed since
+            self._publish(self._msg_time, self._rec_time)
+
+    def _publish(self, msg_time: dt.datetime, rec_time: dt.datetime):
+        book_state = self.order_book_state
+        snapshot = BookSnapshot(book_state.symbol, book_state.sequence_num, msg_time, rec_time,
+                                [(level.price, level.quantity) for level in book_state.top_n('BID', self.depth)],
+                                [(level.price, level.quantity) for level in book_state.top_n('ASK', self.depth)],
+                                book_state.numerics)
+        try:
+            self.book_queue.put_nowait(snapshot)
+            self._pending = False
+            self.snapshots_published += 1
+            if log_flags.debug:
+                log.debug(f"Queued {book_state.symbol} book snapshot. Book queue size: {self.book_queue.qsize()}")
+        except queue.Full:
+            # leave it pending, so a fresh snapshot goes out once the queue has room
+            self.snapshots_dropped += 1
+            if log_flags.debug:
+                log.debug(f"Book queue full, dropped {book_state.symbol} book snapshot")
+
+    def metrics(self) -> dict:
+        return {'top_changes': self.top_changes,
+                'snapshots_published': self.snapshots_published,
+                'snapshots_dropped': self.snapshots_dropped}
@@ -0,0 +1,130 @@
+"""Invariant checks for an OrderBookState, cheap enough to run on every update.
+
+After each update only the levels it touched are checked: positive price and volume, level present in the sorted
+level index exactly when it's in the book, and the book not crossed. A full audit of every level, plus reconciling
+each level's volume against the resting orders in the register, runs every audit_interval_secs. Both are run on the
+thread applying updates, so they always see a consistent book
+"""
+import time
+from collections import Counter
+from logging import getLogger
+
+from order_book_state import OrderBookState
+
+log = getLogger(__name__)
+
+DEFAULT_AUDIT_INTERVAL_SECS = 60
+
+# kinds of violation counted
+NON_POSITIVE_VOLUME = 'non_positive_volume'
+NON_POSITIVE_PRICE = 'non_positive_price'
+INDEX_MISMATCH = 'index_mismatch'
+CROSSED_BOOK = 'crossed_book'
+REGISTER_MISMATCH = 'register_mismatch'
+
+
+class BookValidator:
+    """audit_interval_secs of None turns off the periodic full audit, audit() can still be called directly"""
+    def __init__(self, order_book_state: OrderBookState, audit_interval_secs=DEFAULT_AUDIT_INTERVAL_SECS):
+        self.order_book_state = order_book_state
+        self.audit_interval_ns = int(audit_interval_secs * 1e9) if audit_interval_secs else None
+        self.violations = Counter()
+        self.levels_checked = 0
+        self.audits = 0
+        self._touched = set()
+        self._audit_due = False
+        self._next_audit_ns = self._schedule_audit()
+        order_book_state.level_listeners.append(self.on_level_changed)
+        order_book_state.update_listeners.append(self.on_book_updated)
+
+    def _schedule_audit(self):
+        return time.monotonic_ns() + self.audit_interval_ns if self.audit_interval_ns else None
+
+    def on_level_changed(self, side_of_book, price):
+        if price is None:
+            # a whole side was replaced, which only a full audit covers
+            self._audit_due = True
+        else:
+            self._touched.add((side_of_book, price))
+
+    def on_book_updated(self, order_book_state, msg_time, rec_time):
+        found = Counter()
+        if self._touched:
+            self._check_levels(self._touched, found)
+            self._touched.clear()
+        self._check_crossed(found)
+        if self._audit_due or (self._next_audit_ns is not None and time.monotonic_ns() >= self._next_audit_ns):
+            self._audit(found)
+        if found:
+            self.violations.update(found)
+            log.error(f"{order_book_state.symbol} book failed validation at sequence "
+                      f"{order_book_state.sequence_num}: {dict(found)}")
+
+    def _check_levels(self, touched, found):
+        book_state = self.order_book_state
+        book_key = book_state.numerics.book_key
+        zero = book_state.numerics.zero
+        for side_of_book, price in touched:
+            volume = book_state.book[side_of_book].get(book_key(price))
+            indexed = price in book_state.levels[side_of_book]
+            if volume is None:
+                if indexed:
+                    found[INDEX_MISMATCH] += 1
+                continue
+            if not indexed:
+                found[INDEX_MISMATCH] += 1
+            if volume <= zero:
+                found[NON_POSITIVE_VOLUME] += 1
+            if price <= zero:
+                found[NON_POSITIVE_PRICE] += 1
+        self.levels_checked += len(touched)
+
+    def _check_crossed(self, found):
+        spread = self.order_book_state.spread()
+        if spread is not None and spread <= self.order_book_state.numerics.zero:
+            found[CROSSED_BOOK] += 1
+
+    def audit(self) -> Counter:
+        """Check the whole book now, returning and counting any violations found"""
+        found = Counter()
+        self._audit(found)
+        self._check_crossed(found)
+        self.violations.update(found)
+        return found
+
+    def _audit(self, found):
+        start_ns = time.monotonic_ns()
+        book_state = self.order_book_state
+        numerics = book_state.numerics
+        book_key = numerics.book_key
+        zero = numerics.zero
+
+        register_volumes = {'BID': {}, 'ASK': {}}
+        for order in book_state.book_by_order_register.values():
+            side_volumes = register_volumes[order.side]
+            key = book_key(order.price)
+            side_volumes[key] = side_volumes.get(key, zero) + order.volume
+
+        for side_of_book, side in book_state.book.items():
+            prices = book_state.levels[side_of_book].top(len(side) + 1)
+            if len(prices) != len(side) or any(book_key(price) not in side for price in prices):
+                found[INDEX_MISMATCH] += 1
+            found[NON_POSITIVE_PRICE] += sum(1 for price in prices if price <= zero)
+            found[NON_POSITIVE_VOLUME] += sum(1 for volume in side.values() if volume <= zero)
+            # every level's volume should be the sum of its resting orders
+            side_volumes = register_volumes[side_of_book]
+            found[REGISTER_MISMATCH] += sum(1 for key, volume in side.items() if side_volumes.get(key) != volume)
+            found[REGISTER_MISMATCH] += sum(1 for key in side_volumes if key not in side)
+
+        for kind in [kind for kind, count in found.items() if not count]:
+            del found[kind]
+        self.audits += 1
+        self._audit_due = False
+        self._next_audit_ns = self._schedule_audit()
+        log.info(f"Audited {book_state.symbol} book in {(time.monotonic_ns() - start_ns) / 1e6:.1f}ms, "
+                 f"{len(book_state.book_by_order_register)} resting orders, violations: {dict(found) or 'none'}")
+
+    def metrics(self) -> dict:
+        return {'levels_checked': self.levels_checked,
+                'audits': self.audits,
+                'violations': dict(self.violations)}
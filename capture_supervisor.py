@@ -0,0 +1,133 @@
+"""Capture several symbols in one process: a websocket connection and book per symbol, each on its own thread,
+all feeding one trade queue and so one publisher pipeline
+"""
+import datetime as dt
+import threading
+import time
+from logging import getLogger
+
+import ws_handlers
+from bars import BarPublisher, DEFAULT_BAR_INTERVALS_SECS
+from book_analytics import (BookAnalytics, DEFAULT_ANALYTICS_INTERVAL_SECS, DEFAULT_BANDS_BPS,
+                            DEFAULT_IMBALANCE_DEPTH)
+from book_snapshots import TopOfBookPublisher, DEFAULT_DEPTH, DEFAULT_INTERVAL_SECS
+from frame_log import FrameLogWriter
+from order_book_state import OrderBookState
+
+log = getLogger(__name__)
+
+STREAM_URL = "wss://ws.luno.com/api/1/stream/{symbol}"
+METRICS_LOG_INTERVAL_SECS = 60
+# how often snapshots and features held back by their intervals are flushed, for books that have gone quiet
+FLUSH_INTERVAL_SECS = 0.25
+
+
+class SymbolStream:
+    def __init__(self, symbol, trade_queue, fixed_point=False, record_frames=False, book_queue=None,
+                 book_depth=DEFAULT_DEPTH, book_interval_secs=DEFAULT_INTERVAL_SECS, bar_queue=None,
+                 bar_intervals_secs=DEFAULT_BAR_INTERVALS_SECS, bar_volumes=(), analytics_queue=None,
+                 imbalance_depth=DEFAULT_IMBALANCE_DEPTH, bands_bps=DEFAULT_BANDS_BPS,
+                 analytics_interval_secs=DEFAULT_ANALYTICS_INTERVAL_SECS):
+        self.symbol = symbol
+        self.url = STREAM_URL.format(symbol=symbol)
+        self.order_book_state = OrderBookState(symbol=symbol, render_flag=False, trade_queue=trade_queue,
+                                               fixed_point=fixed_point)
+        self.recorder = None
+        if record_frames:
+            self.recorder = FrameLogWriter(f"{symbol}_{dt.datetime.utcnow():%Y%m%dT%H%M%S}.frames", compress=True)
+        self.callbacks = ws_handlers.WebsocketCallbackHandlers(self.order_book_state, recorder=self.recorder)
+        self.book_publisher = None
+        if book_queue is not None:
+            self.book_publisher = TopOfBookPublisher(self.order_book_state, book_queue, book_depth,
+                                                     book_interval_secs)
+        self.bar_publisher = None
+        if bar_queue is not None:
+            self.bar_publisher = BarPublisher(self.order_book_state, bar_queue, bar_intervals_secs, bar_volumes)
+        self.analytics = None
+        if analytics_queue is not None:
+            self.analytics = BookAnalytics(self.order_book_state, analytics_queue, imbalance_depth, bands_bps,
+                                           analytics_interval_secs)
+        self.finished = threading.Event()  # set by start_ws when the connection ends for good
+        self.thread = None
+
+    def flush(self, force=False):
+        """Publish the book snapshot and features held back by their intervals, see TopOfBookPublisher.flush()"""
+        if self.book_publisher:
+            self.book_publisher.flush(force)
+        if self.analytics:
+            self.analytics.flush(force)
+
+    def metrics(self) -> dict:
+        book = self.order_book_state
+        book_snapshots = self.book_publisher.metrics() if self.book_publisher else {}
+        bars = self.bar_publisher.metrics() if self.bar_publisher else {}
+        analytics = self.analytics.metrics() if self.analytics else {}
+        return {'messages': self.callbacks.messages_received,
+                'trades': book.trade_processor.trades_processed,
+                'trades_dropped': book.trade_processor.trades_dropped,
+                'sequence': book.sequence_num,
+                'bid_levels': len(book.book['BID']),
+                'ask_levels': len(book.book['ASK']),
+                'resting_orders': len(book.book_by_order_register),
+                'running': not self.finished.is_set(),
+                **self.callbacks.resync.metrics(),
+                **self.callbacks.validator.metrics(),
+                **book_snapshots,
+                **bars,
+                **analytics}
+
+
+class CaptureSupervisor:
+    """Runs a SymbolStream per symbol. start_stream(url, order_book, callbacks, finished_event) is called on each
+    stream's thread, and is ws_handlers.start_ws unless a stand-in is given for testing. When book_queue is given,
+    top of book snapshots are put onto it, see book_snapshots, when bar_queue is given, closed OHLCV bars, see
+    bars, and when analytics_queue is given, book features, see book_analytics"""
+    def __init__(self, symbols, trade_queue, fixed_point=False, record_frames=False, start_stream=None,
+                 book_queue=None, book_depth=DEFAULT_DEPTH, book_interval_secs=DEFAULT_INTERVAL_SECS, bar_queue=None,
+                 bar_intervals_secs=DEFAULT_BAR_INTERVALS_SECS, bar_volumes=(), analytics_queue=None,
+                 imbalance_depth=DEFAULT_IMBALANCE_DEPTH, bands_bps=DEFAULT_BANDS_BPS,
+                 analytics_interval_secs=DEFAULT_ANALYTICS_INTERVAL_SECS):
+        self.streams = {symbol: SymbolStream(symbol, trade_queue, fixed_point, record_frames, book_queue, book_depth,
+                                             book_interval_secs, bar_queue, bar_intervals_secs, bar_volumes,
+                                             analytics_queue, imbalance_depth, bands_bps, analytics_interval_secs)
+                        for symbol in symbols}
+        self.start_stream = start_stream or ws_handlers.start_ws
+
+    def run(self, shutdown_event: threading.Event):
+        """Blocks until every stream has finished, then sets shutdown_event so the publisher drains and exits"""
+        for symbol, stream in self.streams.items():
+            stream.thread = threading.Thread(target=self.start_stream, name=f"ws-{symbol}",
+                                             args=(stream.url, stream.order_book_state, stream.callbacks,
+                                                   stream.finished), daemon=True)
+            stream.thread.start()
+        log.info(f"Capturing {list(self.streams)}")
+
+        next_metrics_log = time.monotonic() + METRICS_LOG_INTERVAL_SECS
+        try:
+            while not all(stream.finished.wait(timeout=FLUSH_INTERVAL_SECS) for stream in self.streams.values()):
+                for stream in self.streams.values():
+                    stream.flush()
+                if time.monotonic() >= next_metrics_log:
+                    log.info(f"Capture metrics: {self.metrics()}")
+                    next_metrics_log = time.monotonic() + METRICS_LOG_INTERVAL_SECS
+        except KeyboardInterrupt:
+            log.info("Interrupted, closing all streams")
+            self.stop()
+            for stream in self.streams.values():
+                stream.finished.wait(timeout=10)
+        finally:
+            for stream in self.streams.values():
+                # the last changes go out ahead of the publisher draining
+                stream.flush(force=True)
+                if stream.recorder:
+                    stream.recorder.close()
+            log.info(f"All streams finished: {self.metrics()}")
+            shutdown_event.set()
+
+    def stop(self):
+        for stream in self.streams.values():
+            if stream.callbacks.wsocket:
+                stream.callbacks.wsocket.close()
+
+    def metrics(self) -> dict:
+        return {symbol: stream.metrics() for symbol, stream in self.streams.items()}
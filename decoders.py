@@ -0,0 +1,120 @@
+"""Decoding of raw Luno websocket frames into a message object whose fields can be dispatched on directly.
+The fastest installed backend is used by default: msgspec, then orjson, then the stdlib json module
+"""
+import json
+from logging import getLogger
+from typing import List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = getLogger(__name__)
+
+
+class LunoMessage:
+    """Top level fields of a Luno stream message. Missing fields are None"""
+    __slots__ = ('sequence', 'timestamp', 'asks', 'bids', 'trade_updates', 'create_update', 'delete_update',
+                 'status_update')
+
+    def __init__(self, msg_data: dict):
+        get = msg_data.get
+        self.sequence = get('sequence')
+        self.timestamp = get('timestamp')
+        self.asks = get('asks')
+        self.bids = get('bids')
+        self.trade_updates = get('trade_updates')
+        self.create_update = get('create_update')
+        self.delete_update = get('delete_update')
+        self.status_update = get('status_update')
+
+
+class StdlibJsonDecoder:
+    name = 'json'
+
+    @staticmethod
+    def decode(message) -> LunoMessage:
+        return LunoMessage(json.loads(message))
+
+
+class OrjsonDecoder:
+    name = 'orjson'
+
+    @staticmethod
+    def decode(message) -> LunoMessage:
+        return LunoMessage(orjson.loads(message))
+
+
+if msgspec is not None:
+    class _Schema(msgspec.Struct):
+        # order book handlers read messages with dict style access, so the typed schemas support it too
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+    class SnapshotOrder(_Schema):
+        id: str
+        price: str
+        volume: str
+
+    class CreateUpdate(_Schema):
+        order_id: str
+        type: str
+        price: str
+        volume: str
+
+    class DeleteUpdate(_Schema):
+        order_id: str
+
+    class TradeUpdate(_Schema):
+        base: str
+        counter: str
+        maker_order_id: Optional[str] = None
+        taker_order_id: Optional[str] = None
+        order_id: Optional[str] = None
+
+    class LunoFrame(_Schema):
+        sequence: Union[int, str, None] = None
+        timestamp: Optional[int] = None
+        asks: Optional[List[SnapshotOrder]] = None
+        bids: Optional[List[SnapshotOrder]] = None
+        trade_updates: Optional[List[TradeUpdate]] = None
+        create_update: Optional[CreateUpdate] = None
+        delete_update: Optional[DeleteUpdate] = None
+        status_update: Optional[dict] = None
+
+    class MsgspecDecoder:
+        name = 'msgspec'
+
+        def __init__(self):
+            # decodes straight into the typed schema in a single pass
+            self.decode = msgspec.json.Decoder(LunoFrame).decode
+
+
+def available_decoders():
+    decoders = []
+    if msgspec is not None:
+        decoders.append(MsgspecDecoder())
+    if orjson is not None:
+        decoders.append(OrjsonDecoder())
+    decoders.append(StdlibJsonDecoder())
+    return decoders
+
+
+def get_decoder(name: str = None):
+    """Return the named decoder, or the fastest one installed when name is None"""
+    decoders = available_decoders()
+    if name is None:
+        return decoders[0]
+    for decoder in decoders:
+        if decoder.name == name:
+            return decoder
+    raise ValueError(f"Decoder {name} is not available, installed: {[decoder.name for decoder in decoders]}")
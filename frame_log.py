@@ -0,0 +1,107 @@
+"""Append-only binary log of raw websocket frames and their receive timestamps.
+
+Layout: a file header (magic, version, flags) followed by chunks. Each chunk is a (stored length, raw length)
+header and a payload of length-prefixed records, zstd compressed when the file's compressed flag is set.
+A record is (received epoch ns, frame length) followed by the frame bytes
+"""
+import struct
+from logging import getLogger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = getLogger(__name__)
+
+MAGIC = b'LMDF'
+VERSION = 1
+FLAG_ZSTD = 0x01
+FILE_HEADER = struct.Struct('<4sBB')
+CHUNK_HEADER = struct.Struct('<II')
+RECORD_HEADER = struct.Struct('<qI')
+
+
+class FrameLogWriter:
+    def __init__(self, path, compress=False, chunk_bytes=256 * 1024):
+        if compress and zstandard is None:
+            raise ValueError("zstandard must be installed to write compressed frame logs")
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self._compressor = zstandard.ZstdCompressor() if compress else None
+        self._buffer = bytearray()
+        self._file = open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, FLAG_ZSTD if compress else 0))
+        self.frames_written = 0
+
+    def append(self, frame, received_ns: int):
+        if isinstance(frame, str):
+            frame = frame.encode('utf-8')
+        self._buffer += RECORD_HEADER.pack(received_ns, len(frame))
+        self._buffer += frame
+        self.frames_written += 1
+        if len(self._buffer) >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        payload = self._compressor.compress(self._buffer) if self._compressor else self._buffer
+        self._file.write(CHUNK_HEADER.pack(len(payload), len(self._buffer)))
+        self._file.write(payload)
+        self._file.flush()
+        self._buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FrameLogReader:
+    """Iterates (received epoch ns, frame bytes) tuples from a frame log"""
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            magic, version, flags = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{self.path} is not a version {VERSION} frame log")
+            decompressor = None
+            if flags & FLAG_ZSTD:
+                if zstandard is None:
+                    raise ValueError("zstandard must be installed to read compressed frame logs")
+                decompressor = zstandard.ZstdDecompressor()
+
+            while True:
+                header = f.read(CHUNK_HEADER.size)
+                if not header:
+                    break
+                if len(header) < CHUNK_HEADER.size:
+                    log.warning(f"Truncated chunk header at end of {self.path}")
+                    break
+                stored_length, raw_length = CHUNK_HEADER.unpack(header)
+                payload = f.read(stored_length)
+                if len(payload) < stored_length:
+                    log.warning(f"Truncated chunk at end of {self.path}")
+                    break
+                if decompressor:
+                    payload = decompressor.decompress(payload, max_output_size=raw_length)
+                yield from _records(payload)
+
+
+def _records(payload):
+    view = memoryview(payload)
+    offset = 0
+    end = len(payload)
+    while offset < end:
+        received_ns, length = RECORD_HEADER.unpack_from(view, offset)
+        offset += RECORD_HEADER.size
+        yield received_ns, bytes(view[offset:offset + length])
+        offset += length
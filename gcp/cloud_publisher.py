@@ -1,41 +1,122 @@
 import logging
+import threading
+import time
+from functools import partial
 from queue import Empty
 from google.cloud.pubsub_v1 import types, PublisherClient
 
+from gcp.publish_stats import PublishStats
 from trade import Trade
+from trade_serializers import JsonTradeSerializer, ENCODING_ATTRIBUTE
+from utils.utils import LogLevelFlags
 
 log = logging.getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+STATS_LOG_INTERVAL_SECS = 60
+# the client has already retried transient errors by the time a future fails
+DEFAULT_MAX_RETRIES = 3
+TRADES_TOPIC_ID = "luno_topic_full_fat"
+BOOK_SNAPSHOTS_TOPIC_ID = "luno_topic_book_snapshots"
+BARS_TOPIC_ID = "luno_topic_bars"
+BOOK_ANALYTICS_TOPIC_ID = "luno_topic_book_analytics"
 
 
 class GcpRePublisher:
-    def __init__(self):
+    """Drains the trade queue in batches and publishes without waiting on each future. At most max_in_flight
+    messages are unresolved at any time, their futures are resolved via add_done_callback. serializer sets the wire
+    format, see trade_serializers. publisher can be a stand-in for PublisherClient in tests. Anything with a
+    to_json(), such as a book_snapshots.BookSnapshot, bars.Bar or book_analytics.BookFeatures, can be published with
+    the default JSON serializer. A failed publish pauses the ordering key, failing everything queued behind it, so
+    each failed message is published again once the key's resumed, up to max_retries times before it's dropped"""
+    def __init__(self, publisher=None, max_in_flight=500, max_batch=100, batch_settings=None, serializer=None,
+                 topic_id=TRADES_TOPIC_ID, max_retries=DEFAULT_MAX_RETRIES):
         self.project_id = "692233547485"
-        self.topic_id = "luno_topic_full_fat"
+        self.topic_id = topic_id
         self.ordering_key = "luno"
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        # JSON by default, as that's what the Pub/Sub to BigQuery Dataflow template reads
+        self.serializer = serializer or JsonTradeSerializer()
         self.publisher_options = types.PublisherOptions(enable_message_ordering=True)
-        self.publisher = PublisherClient(publisher_options=self.publisher_options)
+        # let the client group messages into fewer publish requests, but don't hold any for longer than 10ms
+        self.batch_settings = batch_settings or types.BatchSettings(max_messages=100,
+                                                                    max_bytes=1024 * 1024,
+                                                                    max_latency=0.01)
+        self.publisher = publisher or PublisherClient(batch_settings=self.batch_settings,
+                                                      publisher_options=self.publisher_options)
         self.topic_path = self.publisher.topic_path(self.project_id, self.topic_id)
+        self._in_flight_slots = threading.BoundedSemaphore(max_in_flight)
+        self.stats = PublishStats(topic_id)
 
     def consume_and_republish(self, trade_queue, shutdown_event):
+        next_stats_log = time.monotonic() + STATS_LOG_INTERVAL_SECS
         while not shutdown_event.is_set() or trade_queue.qsize() > 0:
             try:
-                message: Trade = trade_queue.get(timeout=3)
-                log.info(f"GcpRePublisher read message off queue: {message.to_json()=}, queue-size: {trade_queue.qsize()}")
+                batch = [trade_queue.get(timeout=3)]
             except Empty:
                 # force a timeout so that the blocking call to queue.get() will jump out every so often and
                 # re-evaluate the shutdown_event Event
                 log.debug(f"GcpRePublisher consume loop continuing: {shutdown_event.is_set()=}")
                 continue
+            # take whatever else has queued up behind it, so bursts go out together
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(trade_queue.get_nowait())
+            except Empty:
+                pass
+            if log_flags.debug:
+                log.debug(f"GcpRePublisher read {len(batch)} messages off queue, queue-size: {trade_queue.qsize()}")
 
-            # start publishing JSON, move to protobuf later to make messages smaller?
-            api_future = self.publisher.publish(topic=self.topic_path,
-                                                data=message.to_json().encode("utf-8"),
-                                                ordering_key=self.ordering_key)
-            # result() blocks, but this is okay as we're pulling off our internal buffer.
-            # If we wanted to resolve API futures asynchronously, could use add_done_callback().
-            message_id = api_future.result()
-            # message_id = api_future.add_done_callback()
-            log.info(f"Published a message to {self.topic_path} with ordering_key {self.ordering_key}, "
-                     f"message_id = {message_id}")
+            for message in batch:
+                self.stats.on_dequeue(message)
+                self.publish(message)
+
+            if time.monotonic() >= next_stats_log:
+                log.info(f"GcpRePublisher {self.stats.summary()}")
+                next_stats_log = time.monotonic() + STATS_LOG_INTERVAL_SECS
 
-        log.info(f"GcpRePublisher exiting")
+        if not self.stats.wait_for_in_flight(timeout=30):
+            log.error(f"GcpRePublisher timed out waiting for {self.stats.in_flight} in flight messages")
+        log.info(f"GcpRePublisher exiting, {self.stats.summary()}")
+
+    def publish(self, message: Trade):
+        # blocks only when max_in_flight messages are already waiting on the API
+        self._in_flight_slots.acquire()
+        self.stats.on_publish()
+        self._publish(self.serializer.encode(message), 0)
+
+    def _publish(self, data: bytes, retries: int):
+        published_ns = time.monotonic_ns()
+        api_future = self.publisher.publish(topic=self.topic_path,
+                                            data=data,
+                                            ordering_key=self.ordering_key,
+                                            **{ENCODING_ATTRIBUTE: self.serializer.encoding})
+        api_future.add_done_callback(partial(self._on_published, published_ns, data, retries))
+
+    def _on_published(self, published_ns, data, retries, api_future):
+        latency_ns = time.monotonic_ns() - published_ns
+        published = retried = False
+        try:
+            message_id = api_future.result()
+            published = True
+            if log_flags.debug:
+                log.debug(f"Published a message to {self.topic_path} with ordering_key {self.ordering_key}, "
+                          f"message_id = {message_id}")
+        except Exception as e:
+            # publishing is paused for an ordering key after a failure, until it's explicitly resumed
+            self.publisher.resume_publish(self.topic_path, self.ordering_key)
+            if retries < self.max_retries:
+                log.warning(f"Failed to publish a message to {self.topic_path}, retrying "
+                            f"({retries + 1} of {self.max_retries}): {e}")
+                self.stats.on_retry()
+                # still in flight, so it keeps its slot
+                self._publish(data, retries + 1)
+                retried = True
+            else:
+                log.error(f"Failed to publish a message to {self.topic_path} after {retries} retries, dropping it: "
+                          f"{e}")
+        finally:
+            if not retried:
+                self.stats.on_done(latency_ns, failed=not published)
+                self._in_flight_slots.release()
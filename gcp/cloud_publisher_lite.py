@@ -1,6 +1,10 @@
 import logging
+import threading
+import time
+from functools import partial
 from queue import Empty
 
+from google.cloud.pubsub_v1.types import BatchSettings
 from google.cloud.pubsublite.cloudpubsub import PublisherClient
 from google.cloud.pubsublite.types import (
     CloudRegion,
@@ -9,13 +13,24 @@ from google.cloud.pubsublite.types import (
     TopicPath,
 )
 
+from gcp.publish_stats import PublishStats
 from trade import Trade
+from trade_serializers import JsonTradeSerializer, ENCODING_ATTRIBUTE
+from utils.utils import LogLevelFlags
 
 log = logging.getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+STATS_LOG_INTERVAL_SECS = 60
 
 
 class GcpRePublisherLite:
-    def __init__(self):
+    """Publishes trades to Pub/Sub Lite through one PublisherClient held open for the life of the consumer.
+    Messages are batched by the client and their futures resolved via add_done_callback, with at most
+    max_in_flight unresolved. serializer sets the wire format, see trade_serializers. client_factory can return a
+    stand-in for PublisherClient in tests"""
+    def __init__(self, client_factory=None, max_in_flight=500, max_batch=100, batch_settings=None,
+                 serializer=None):
         self.project_number = 692233547485
         self.cloud_region = "europe-west2"
         self.zone_id = "a"
@@ -28,26 +43,72 @@ class GcpRePublisherLite:
             self.location = CloudZone(CloudRegion(self.cloud_region), self.zone_id)
 
         self.topic_path = TopicPath(self.project_number, self.location, self.topic_id)
+        self.max_batch = max_batch
+        self.serializer = serializer or JsonTradeSerializer()
+        self.batch_settings = batch_settings or BatchSettings(max_messages=100,
+                                                              max_bytes=1024 * 1024,
+                                                              max_latency=0.01)
+        self.client_factory = client_factory or partial(PublisherClient,
+                                                        per_partition_batching_settings=self.batch_settings)
+        self._in_flight_slots = threading.BoundedSemaphore(max_in_flight)
+        self.stats = PublishStats(self.topic_id)
 
     def consume_and_republish(self, trade_queue, shutdown_event):
-        while not shutdown_event.is_set() or trade_queue.qsize() > 0:
-            try:
-                message: Trade = trade_queue.get(timeout=3)
-                log.info(f"GcpRePublisher read message off queue: {message.to_json()=}, queue-size: {trade_queue.qsize()}")
-            except Empty as e:
-                # force a timeout so that the blocking call to queue.get() will jump out every so often and
-                # re-evaluate the shutdown_event Event
-                log.debug(f"GcpRePublisher consume loop continuing: {shutdown_event.is_set()=}")
-                continue
-
-            # start publishing JSON, move to protobuf later to make messages smaller?
-            with PublisherClient() as publisher_client:
-                api_future = publisher_client.publish(self.topic_path, message.to_json().encode("utf-8"))
-                # result() blocks. To resolve API futures asynchronously, use add_done_callback().
-                message_id = api_future.result()
-                # message_id = api_future.add_done_callback()
-                message_metadata = MessageMetadata.decode(message_id)
-                log.info(f"Published a message to {self.topic_path} with partition {message_metadata.partition.value} "
-                         f"and offset {message_metadata.cursor.offset}.")
+        # PublisherClient() must be used in a `with` block or have __enter__() called before use. Leaving the
+        # block flushes anything the client is still batching
+        with self.client_factory() as publisher_client:
+            next_stats_log = time.monotonic() + STATS_LOG_INTERVAL_SECS
+            while not shutdown_event.is_set() or trade_queue.qsize() > 0:
+                try:
+                    batch = [trade_queue.get(timeout=3)]
+                except Empty:
+                    # force a timeout so that the blocking call to queue.get() will jump out every so often and
+                    # re-evaluate the shutdown_event Event
+                    log.debug(f"GcpRePublisherLite consume loop continuing: {shutdown_event.is_set()=}")
+                    continue
+                # take whatever else has queued up behind it, so bursts go out together
+                try:
+                    while len(batch) < self.max_batch:
+                        batch.append(trade_queue.get_nowait())
+                except Empty:
+                    pass
+                if log_flags.debug:
+                    log.debug(f"GcpRePublisherLite read {len(batch)} messages off queue, "
+                              f"queue-size: {trade_queue.qsize()}")
+
+                for message in batch:
+                    self.stats.on_dequeue(message)
+                    self.publish(publisher_client, message)
+
+                if time.monotonic() >= next_stats_log:
+                    log.info(f"GcpRePublisherLite {self.stats.summary()}")
+                    next_stats_log = time.monotonic() + STATS_LOG_INTERVAL_SECS
 
-        log.info(f"GcpRePublisherLite exiting")
+            if not self.stats.wait_for_in_flight(timeout=30):
+                log.error(f"GcpRePublisherLite timed out waiting for {self.stats.in_flight} in flight messages")
+
+        log.info(f"GcpRePublisherLite exiting, {self.stats.summary()}")
+
+    def publish(self, publisher_client, message: Trade):
+        # blocks only when max_in_flight messages are already waiting on the API
+        self._in_flight_slots.acquire()
+        self.stats.on_publish()
+        published_ns = time.monotonic_ns()
+        api_future = publisher_client.publish(self.topic_path, self.serializer.encode(message),
+                                              **{ENCODING_ATTRIBUTE: self.serializer.encoding})
+        api_future.add_done_callback(partial(self._on_published, published_ns))
+
+    def _on_published(self, published_ns, api_future):
+        latency_ns = time.monotonic_ns() - published_ns
+        try:
+            message_id = api_future.result()
+            if log_flags.debug:
+                message_metadata = MessageMetadata.decode(message_id)
+                log.debug(f"Published a message to {self.topic_path} with partition "
+                          f"{message_metadata.partition.value} and offset {message_metadata.cursor.offset}.")
+            self.stats.on_done(latency_ns)
+        except Exception as e:
+            log.error(f"Failed to publish a message to {self.topic_path}: {e}")
+            self.stats.on_done(latency_ns, failed=True)
+        finally:
+            self._in_flight_slots.release()
@@ -2,6 +2,7 @@ from concurrent.futures import TimeoutError
 from google.cloud import pubsub_v1
 import logging
 
+from trade_serializers import serializer_for_encoding, ENCODING_ATTRIBUTE
 from utils.utils import setup_logging
 
 setup_logging()
@@ -20,8 +21,9 @@ subscription_path = subscriber.subscription_path(project_id, subscription_id)
 
 
 def callback(message: pubsub_v1.subscriber.message.Message) -> None:
-    message_data = message.data.decode("utf-8")
-    log.info(f"Received {message_data=}, {message.ordering_key=}.")
+    serializer = serializer_for_encoding(message.attributes.get(ENCODING_ATTRIBUTE))
+    message_data = serializer.decode(message.data)
+    log.info(f"Received {message_data=}, {message.ordering_key=}, {serializer.encoding=}.")
     message.ack()
 
 
@@ -10,6 +10,7 @@ from google.cloud.pubsublite.types import (
     SubscriptionPath,
 )
 
+from trade_serializers import serializer_for_encoding, ENCODING_ATTRIBUTE
 from utils.utils import setup_logging
 
 setup_logging()
@@ -40,7 +41,8 @@ per_partition_flow_control_settings = FlowControlSettings(
 
 
 def callback(message: PubsubMessage):
-    message_data = message.data.decode("utf-8")
+    serializer = serializer_for_encoding(message.attributes.get(ENCODING_ATTRIBUTE))
+    message_data = serializer.decode(message.data)
     metadata = MessageMetadata.decode(message.message_id)
     log.info(f"Received {message_data=} of ordering key {message.ordering_key=} with id {metadata=}.")
     message.ack()
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from metrics import REGISTRY, format_ns
+
+
+class PublishStats:
+    """Counters for a publisher whose futures resolve on other threads: messages published, retried and failed and
+    in-flight depth. Publish round trip latency, and how long messages waited on the queue before being published,
+    go to histograms in the metrics registry labelled with topic"""
+    def __init__(self, topic: str = ""):
+        self._lock = threading.Condition()
+        self.started_ns = time.monotonic_ns()
+        self.published = 0
+        self.failed = 0
+        self.retried = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.round_trip = REGISTRY.histogram('publish_round_trip', "Publish to the API future resolving",
+                                             thread_safe=True, topic=topic)
+        self.queue_wait = REGISTRY.histogram('queue_wait', "Put on the queue to taken off it by the publisher",
+                                             topic=topic)
+
+    def on_dequeue(self, message):
+        # only on the consume thread, messages without a queued_ns (such as book snapshots) aren't timed
+        queued_ns = getattr(message, 'queued_ns', None)
+        if queued_ns is not None:
+            self.queue_wait.record(time.monotonic_ns() - queued_ns)
+
+    def on_publish(self):
+        with self._lock:
+            self.in_flight += 1
+            if self.in_flight > self.max_in_flight:
+                self.max_in_flight = self.in_flight
+
+    def on_retry(self):
+        with self._lock:
+            self.retried += 1
+
+    def on_done(self, latency_ns: int, failed: bool = False):
+        if not failed:
+            self.round_trip.record(latency_ns)
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.published += 1
+            self._lock.notify_all()
+
+    def wait_for_in_flight(self, timeout=None) -> bool:
+        # blocks until every published message has resolved, returns False on timeout
+        with self._lock:
+            return self._lock.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def summary(self) -> str:
+        round_trip, queue_wait = self.round_trip, self.queue_wait
+        with self._lock:
+            elapsed = (time.monotonic_ns() - self.started_ns) / 1e9
+            return (f"published: {self.published} ({self.published / elapsed if elapsed else 0:.1f}/sec), "
+                    f"retried: {self.retried}, failed: {self.failed}, "
+                    f"in flight: {self.in_flight} (max {self.max_in_flight}), "
+                    f"latency p50: {format_ns(round_trip.percentile(0.5))} "
+                    f"p99: {format_ns(round_trip.percentile(0.99))} max: {format_ns(round_trip.max)}, "
+                    f"queue wait p99: {format_ns(queue_wait.percentile(0.99))}")
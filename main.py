@@ -7,28 +7,97 @@ import threading
 from concurrent import futures
 import queue
 
-import ws_handlers
-from gcp.cloud_publisher import GcpRePublisher
-from order_book_state import OrderBookState
+from archive_sink import ArchiveSink
+from async_ingest import AsyncCapture
+from capture_supervisor import CaptureSupervisor
+from gcp.cloud_publisher import GcpRePublisher, BARS_TOPIC_ID, BOOK_ANALYTICS_TOPIC_ID, BOOK_SNAPSHOTS_TOPIC_ID
+from metrics import MetricsReporter, MetricsServer
+from trade_handoff import make_trade_handoff
+from sharded_capture import ShardedCapture
 from utils.utils import setup_logging
 
-CRYPTO_ISO_PAIR = "XBTZAR"  # or "ETHZAR"
+CRYPTO_ISO_PAIRS = ["XBTZAR"]  # eg. ["XBTZAR", "ETHZAR"], each gets its own connection and book
+FIXED_POINT_BOOK = False  # key the book on scaled ints rather than Decimal price strings
+QUEUED_LOGGING = True  # do log I/O on a listener thread rather than the websocket callback thread
+RECORD_FRAMES = False  # append every raw websocket frame to a frame log which replay.py can play back
+CAPTURE_WORKERS = 0  # > 0 shards the pairs across this many worker processes, rather than threads in this one
+ASYNC_INGEST = False  # run every pair's connection on one asyncio event loop rather than a thread per pair
+PUBLISH_BOOK_SNAPSHOTS = False  # publish the top levels of each book when they change, as well as the trades
+BOOK_SNAPSHOT_DEPTH = 10
+BOOK_SNAPSHOT_INTERVAL_SECS = 1.0  # at most one snapshot per pair in this interval, however busy the book
+PUBLISH_TRADES = True  # False publishes only the bars (and book snapshots when on), not each trade
+PUBLISH_BARS = False  # publish OHLCV bars built from the trades as they're captured
+BAR_INTERVALS_SECS = (60,)  # a time bar per pair for each of these intervals
+BAR_VOLUMES = ()  # eg. ("1.0",), a volume bar per pair each time this much has traded
+PUBLISH_BOOK_ANALYTICS = False  # publish mid, microprice, imbalance, depth and weighted spread as the books change
+ANALYTICS_IMBALANCE_DEPTH = 5  # top levels a side in the imbalance and weighted spread
+ANALYTICS_BANDS_BPS = (10, 25, 50)  # cumulative depth within each of these basis points of the mid
+ANALYTICS_INTERVAL_SECS = 1.0  # at most one set of features per pair in this interval
+TRADE_HANDOFF = 'spill'  # what to do with trades once the publisher falls behind: spill, drop_oldest or coalesce
+TRADE_HANDOFF_MAXSIZE = 1000  # trades held in memory before the TRADE_HANDOFF strategy kicks in
+ARCHIVE_DIR = None  # eg. "archive", also keep a local Arrow copy of the trades and book snapshots in this directory
+METRICS_PORT = 9108  # serve the latency histograms at http://localhost:9108/metrics, None to turn off
+METRICS_HOST = "127.0.0.1"  # the address to serve them on, "0.0.0.0" for a scraper on another machine
+METRICS_REPORT_INTERVAL_SECS = 60  # log a summary line of the latency histograms this often
 
 if __name__ == '__main__':
-    setup_logging()
+    log_listener = setup_logging(use_queue=QUEUED_LOGGING)
     log = logging.getLogger(__name__)
-    stream_url = f"wss://ws.luno.com/api/1/stream/{CRYPTO_ISO_PAIR}"
-    book_queue = queue.Queue(maxsize=100)
-    trade_queue = queue.Queue(maxsize=10)
-    ccy_par = stream_url[stream_url.rfind('/') + 1:]
-    _order_book_state = OrderBookState(symbol=ccy_par, render_flag=False, trade_queue=trade_queue)
-    _callback_handlers = ws_handlers.WebsocketCallbackHandlers(_order_book_state)
+    book_queue = queue.Queue(maxsize=100 * len(CRYPTO_ISO_PAIRS)) if PUBLISH_BOOK_SNAPSHOTS else None
+    bar_queue = queue.Queue(maxsize=100 * len(CRYPTO_ISO_PAIRS)) if PUBLISH_BARS else None
+    analytics_queue = queue.Queue(maxsize=100 * len(CRYPTO_ISO_PAIRS)) if PUBLISH_BOOK_ANALYTICS else None
+    outputs = dict(book_queue=book_queue, book_depth=BOOK_SNAPSHOT_DEPTH,
+                   book_interval_secs=BOOK_SNAPSHOT_INTERVAL_SECS, bar_queue=bar_queue,
+                   bar_intervals_secs=BAR_INTERVALS_SECS, bar_volumes=BAR_VOLUMES, analytics_queue=analytics_queue,
+                   imbalance_depth=ANALYTICS_IMBALANCE_DEPTH, bands_bps=ANALYTICS_BANDS_BPS,
+                   analytics_interval_secs=ANALYTICS_INTERVAL_SECS)
+    # never blocks the threads applying book updates, however slow publishing gets
+    trade_queue = make_trade_handoff(TRADE_HANDOFF, TRADE_HANDOFF_MAXSIZE) if PUBLISH_TRADES else None
+    metrics_server = MetricsServer(port=METRICS_PORT, host=METRICS_HOST).start() if METRICS_PORT else None
+    metrics_reporter = MetricsReporter(interval_secs=METRICS_REPORT_INTERVAL_SECS).start()
+    if CAPTURE_WORKERS > 0:
+        supervisor = ShardedCapture(CRYPTO_ISO_PAIRS, trade_queue, workers=CAPTURE_WORKERS,
+                                    fixed_point=FIXED_POINT_BOOK, record_frames=RECORD_FRAMES, **outputs)
+    elif ASYNC_INGEST:
+        supervisor = AsyncCapture(CRYPTO_ISO_PAIRS, trade_queue, fixed_point=FIXED_POINT_BOOK,
+                                  record_frames=RECORD_FRAMES, **outputs)
+    else:
+        supervisor = CaptureSupervisor(CRYPTO_ISO_PAIRS, trade_queue, fixed_point=FIXED_POINT_BOOK,
+                                       record_frames=RECORD_FRAMES, **outputs)
 
-    # start a consumer thread which will take the trades off queue and persist
-    trade_consumer = GcpRePublisher()
-    shutdown_event = threading.Event()  # use as a means of communicating with consumer thread
-    with futures.ThreadPoolExecutor(max_workers=2) as executor:
-        executor.submit(trade_consumer.consume_and_republish, trade_queue, shutdown_event)
-        ws_handlers.start_ws(stream_url, _order_book_state, _callback_handlers, shutdown_event)
+    # start a consumer thread which will take the trades off queue and persist, and others for the book snapshots,
+    # bars and book features
+    shutdown_event = threading.Event()  # use as a means of communicating with consumer threads
+    with futures.ThreadPoolExecutor(max_workers=6) as executor:
+        def start_consumer(publisher, source_queue, handoff_strategy, stream):
+            if ARCHIVE_DIR is None:
+                executor.submit(publisher.consume_and_republish, source_queue, shutdown_event)
+                return
+            # archive first, then forward to the publisher, whose backlog can't hold up the archive
+            publish_queue = make_trade_handoff(handoff_strategy, TRADE_HANDOFF_MAXSIZE, stream=f"{stream}_to_publish")
+            forwarded_event = threading.Event()
+            executor.submit(ArchiveSink(ARCHIVE_DIR).consume, source_queue, shutdown_event, publish_queue,
+                            forwarded_event)
+            executor.submit(publisher.consume_and_republish, publish_queue, forwarded_event)
 
-    # TODO: start another thread which will take n levels of book updates from queue and persist
+        if trade_queue is not None:
+            start_consumer(GcpRePublisher(), trade_queue, TRADE_HANDOFF, 'trades')
+        if book_queue is not None:
+            # spilling and coalescing only work for trades, and a stale snapshot is worth less than a fresh one
+            start_consumer(GcpRePublisher(topic_id=BOOK_SNAPSHOTS_TOPIC_ID), book_queue, 'drop_oldest',
+                           'book_snapshots')
+        if bar_queue is not None:
+            # bars aren't archived, they can be rebuilt from the archived trades with trade_query
+            executor.submit(GcpRePublisher(topic_id=BARS_TOPIC_ID).consume_and_republish, bar_queue, shutdown_event)
+        if analytics_queue is not None:
+            executor.submit(GcpRePublisher(topic_id=BOOK_ANALYTICS_TOPIC_ID).consume_and_republish, analytics_queue,
+                            shutdown_event)
+        supervisor.run(shutdown_event)
+
+    if trade_queue is not None:
+        log.info(f"Trade handoff: {trade_queue.metrics()}")
+    metrics_reporter.stop()
+    if metrics_server:
+        metrics_server.stop()
+    if log_listener:
+        log_listener.stop()
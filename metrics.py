@@ -0,0 +1,227 @@
+"""Latency histograms for each stage of the pipeline, exported as a compact summary line and as Prometheus text over
+HTTP.
+
+Histograms are HDR style: values are counted in buckets whose width grows with the value, so every recorded value
+is kept to within about 1.6% (SUB_BUCKET_BITS) over a range from nanoseconds to minutes, in a fixed ~2k bucket
+array. Recording is a few integer operations and a list increment, cheap enough for every message. Durations are
+taken with time.perf_counter_ns() or time.monotonic_ns(), apart from exchange to receive latency, which has to
+compare against the exchange's wall clock timestamp
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+
+log = getLogger(__name__)
+
+SUB_BUCKET_BITS = 7
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_TRACKABLE_NS = (1 << 40) - 1  # about 18 minutes, anything longer is counted as this
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+DEFAULT_REPORT_INTERVAL_SECS = 60
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < _SUB_BUCKETS:
+        return index
+    shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    return ((index - (shift << (SUB_BUCKET_BITS - 1)) + 1) << shift) - 1
+
+
+class Histogram:
+    """Counts of nanosecond values. Only the bucket counts and the total are kept up to date as values are recorded,
+    the count, max and percentiles are worked out from the buckets when read. Set thread_safe when more than one
+    thread records into it, such as publish futures resolving on client threads"""
+    def __init__(self, name: str, help_text: str = "", labels: dict = None, thread_safe=False):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.counts = [0] * (_bucket_index(MAX_TRACKABLE_NS) + 1)
+        self.total = 0
+        self._lock = threading.Lock() if thread_safe else None
+        if not thread_safe:
+            self.record = self._record  # skip a call on the per message path
+
+    def record(self, value_ns: int):
+        with self._lock:
+            self._record(value_ns)
+
+    def _record(self, value_ns: int):
+        # _bucket_index() inlined
+        if value_ns < _SUB_BUCKETS:
+            if value_ns < 0:
+                value_ns = 0  # clock skew against the exchange
+            index = value_ns
+        else:
+            if value_ns > MAX_TRACKABLE_NS:
+                value_ns = MAX_TRACKABLE_NS
+            shift = value_ns.bit_length() - SUB_BUCKET_BITS
+            index = (shift << (SUB_BUCKET_BITS - 1)) + (value_ns >> shift)
+        self.counts[index] += 1
+        self.total += value_ns
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def max(self) -> int:
+        for index in range(len(self.counts) - 1, -1, -1):
+            if self.counts[index]:
+                return _bucket_upper_bound(index)
+        return 0
+
+    def percentile(self, fraction: float) -> int:
+        """The value at or below which fraction of the recorded values fall, to within the bucket precision"""
+        counts = list(self.counts)
+        count = sum(counts)
+        if not count:
+            return 0
+        target = max(1, int(count * fraction + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= target:
+                return _bucket_upper_bound(index)
+        return 0
+
+    def mean(self) -> float:
+        count = self.count
+        return self.total / count if count else 0.0
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+
+
+def format_ns(value_ns: float) -> str:
+    if value_ns >= 1e9:
+        return f"{value_ns / 1e9:.2f}s"
+    if value_ns >= 1e6:
+        return f"{value_ns / 1e6:.2f}ms"
+    if value_ns >= 1e3:
+        return f"{value_ns / 1e3:.1f}us"
+    return f"{value_ns:.0f}ns"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str = "", thread_safe=False, **labels) -> Histogram:
+        """Returns the histogram for name and labels, creating it on first use. Look it up once and hold on to it,
+        rather than calling this per message"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(name, help_text, labels, thread_safe)
+            return histogram
+
+    def histograms(self):
+        with self._lock:
+            return list(self._histograms.values())
+
+    def summary_line(self) -> str:
+        parts = []
+        for histogram in self.histograms():
+            if not histogram.count:
+                continue
+            labels = ",".join(str(value) for value in histogram.labels.values())
+            parts.append(f"{histogram.name}{'[' + labels + ']' if labels else ''} n={histogram.count} "
+                         f"p50={format_ns(histogram.percentile(0.5))} p99={format_ns(histogram.percentile(0.99))} "
+                         f"max={format_ns(histogram.max)}")
+        return "; ".join(parts)
+
+    def prometheus_text(self) -> str:
+        """Every histogram as a Prometheus summary, in seconds"""
+        lines = []
+        described = set()
+        for histogram in sorted(self.histograms(), key=lambda h: h.name):
+            name = f"{histogram.name}_seconds"
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {histogram.help_text}")
+                lines.append(f"# TYPE {name} summary")
+            labels = [f'{key}="{value}"' for key, value in histogram.labels.items()]
+            for quantile in SUMMARY_QUANTILES:
+                quantile_labels = ",".join(labels + [f'quantile="{quantile}"'])
+                lines.append(f"{name}{{{quantile_labels}}} {histogram.percentile(quantile) / 1e9:.9f}")
+            label_text = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{name}_sum{label_text} {histogram.total / 1e9:.9f}")
+            lines.append(f"{name}_count{label_text} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# shared by everything in the process, as the stages are spread over several objects and threads
+REGISTRY = MetricsRegistry()
+# only reachable from this machine unless a wider address is asked for
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+
+class MetricsServer:
+    """Serves registry.prometheus_text() at /metrics from a daemon thread, on host, which is "" or "0.0.0.0" for
+    every interface"""
+    def __init__(self, registry: MetricsRegistry = REGISTRY, port=9108, host=DEFAULT_METRICS_HOST):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry_.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes would otherwise be logged to stderr
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        log.info(f"Serving metrics on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsReporter:
+    """Logs registry.summary_line() every interval_secs from a daemon thread"""
+    def __init__(self, registry: MetricsRegistry = REGISTRY, interval_secs=DEFAULT_REPORT_INTERVAL_SECS):
+        self.registry = registry
+        self.interval_secs = interval_secs
+        self._stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping.wait(self.interval_secs):
+            self.report()
+
+    def report(self):
+        summary = self.registry.summary_line()
+        if summary:
+            log.info(f"Latency: {summary}")
+
+    def stop(self):
+        self._stopping.set()
+        self.report()
@@ -0,0 +1,100 @@
+from decimal import *
+
+DEFAULT_PRICE_DECIMALS = 8
+DEFAULT_VOLUME_DECIMALS = 8
+
+# decimal places used when parsing a symbol's prices and volumes into scaled integers, as (price, volume).
+# Symbols not listed here use the defaults above, which cover the 8dp strings the Luno stream sends.
+SYMBOL_SCALES = {}
+
+
+def parse_scaled(value: str, decimals: int) -> int:
+    """Parse a decimal string such as '1.2500' straight into an integer scaled by 10**decimals,
+    without going through Decimal"""
+    if 'e' in value or 'E' in value:
+        scaled = Decimal(value).scaleb(decimals)
+        if scaled != scaled.to_integral_value():
+            raise ValueError(f"{value} has more than {decimals} decimal places")
+        return int(scaled)
+    whole, _, frac = value.partition('.')
+    if len(frac) > decimals:
+        if frac[decimals:].strip('0'):
+            raise ValueError(f"{value} has more than {decimals} decimal places")
+        frac = frac[:decimals]
+    return int(whole + frac.ljust(decimals, '0'))
+
+
+class DecimalNumerics:
+    """Prices and volumes as normalized Decimals, with the book keyed on the price as a string"""
+    fixed_point = False
+    zero = Decimal(0)
+
+    @staticmethod
+    def parse_price(value) -> Decimal:
+        return Decimal(value).normalize()
+
+    @staticmethod
+    def parse_volume(value) -> Decimal:
+        return Decimal(value).normalize()
+
+    @staticmethod
+    def parse_counter_volume(value) -> Decimal:
+        return Decimal(value).normalize()
+
+    @staticmethod
+    def book_key(price: Decimal) -> str:
+        return str(price)
+
+    @staticmethod
+    def price_to_decimal(price) -> Decimal:
+        return price
+
+    @staticmethod
+    def volume_to_decimal(volume) -> Decimal:
+        return volume
+
+    @staticmethod
+    def counter_volume_to_decimal(counter_volume) -> Decimal:
+        return counter_volume
+
+
+class FixedPointNumerics:
+    """Prices and volumes parsed once into integers scaled by a per-symbol number of decimal places. The book and
+    order register key on the integers directly and Decimals are only produced at the output boundary"""
+    fixed_point = True
+    zero = 0
+
+    def __init__(self, price_decimals=DEFAULT_PRICE_DECIMALS, volume_decimals=DEFAULT_VOLUME_DECIMALS):
+        self.price_decimals = price_decimals
+        self.volume_decimals = volume_decimals
+        # counter volume is price * volume, so carries the decimal places of both
+        self.counter_volume_decimals = price_decimals + volume_decimals
+
+    def parse_price(self, value) -> int:
+        return parse_scaled(value, self.price_decimals)
+
+    def parse_volume(self, value) -> int:
+        return parse_scaled(value, self.volume_decimals)
+
+    def parse_counter_volume(self, value) -> int:
+        return parse_scaled(value, self.counter_volume_decimals)
+
+    @staticmethod
+    def book_key(price: int) -> int:
+        return price
+
+    def price_to_decimal(self, price: int) -> Decimal:
+        return Decimal(price).scaleb(-self.price_decimals).normalize()
+
+    def volume_to_decimal(self, volume: int) -> Decimal:
+        return Decimal(volume).scaleb(-self.volume_decimals).normalize()
+
+    def counter_volume_to_decimal(self, counter_volume: int) -> Decimal:
+        return Decimal(counter_volume).scaleb(-self.counter_volume_decimals).normalize()
+
+
+def numerics_for_symbol(symbol: str, fixed_point: bool = False):
+    if not fixed_point:
+        return DecimalNumerics()
+    price_decimals, volume_decimals = SYMBOL_SCALES.get(symbol, (DEFAULT_PRICE_DECIMALS, DEFAULT_VOLUME_DECIMALS))
+    return FixedPointNumerics(price_decimals, volume_decimals)
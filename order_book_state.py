@@ -1,17 +1,55 @@
+import bisect
 import datetime as dt
-import pandas as pd
+import sys
+import threading
+from enum import Enum
 from logging import getLogger
 from decimal import *
 
+from book_renderer import TerminalBookRenderer
+from numerics import numerics_for_symbol
 from trade import TradeProcessor
+from utils.utils import datetime_to_epoch_ns, LogLevelFlags
 
 MAX_BOOK_DEPTH = 3500
 MAX_BOOK_RENDER_DEPTH = 10
 
 log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+try:
+    import numpy
+except ImportError:  # only used to speed up loading fixed point snapshots
+    numpy = None
+
+
+class Side(str, Enum):
+    # str valued, so members hash and compare equal to the 'BID'/'ASK' strings the book is keyed on
+    BID = 'BID'
+    ASK = 'ASK'
+
+
+SIDES = {'BID': Side.BID, 'ASK': Side.ASK}
+
+
+class OrderRecord:
+    """A resting order in the order register. Timestamps are epoch nanoseconds"""
+    __slots__ = ('side', 'price', 'volume', 'exchange_timestamp', 'received_timestamp')
+
+    def __init__(self, side: Side, price, volume, exchange_timestamp: int, received_timestamp: int):
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.exchange_timestamp = exchange_timestamp
+        self.received_timestamp = received_timestamp
+
+    def __repr__(self):
+        return f"OrderRecord({self.side.value}: {self.price}@{self.volume}, {self.exchange_timestamp=})"
 
 
 class BookLevel:
+    __slots__ = ('price', 'quantity', 'side')
+
     def __init__(self, price, quantity, side):
         self.price = price
         self.quantity = quantity
@@ -23,49 +61,177 @@ class BookLevel:
     def __repr__(self):
         return f"BookLevel({self.side}: {self.price}@{self.quantity})"
 
+    def __eq__(self, other):
+        return (self.price, self.quantity, self.side) == (other.price, other.quantity, other.side)
+
+
+class PriceLevelIndex:
+    """Prices present on one side of the book, kept in ascending order so the best level and the top n levels
+    can be read without sorting the whole side on every query"""
+    def __init__(self, descending: bool):
+        self.descending = descending
+        self._prices = []
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __contains__(self, price):
+        i = bisect.bisect_left(self._prices, price)
+        return i < len(self._prices) and self._prices[i] == price
+
+    def add(self, price):
+        bisect.insort(self._prices, price)
+
+    def remove(self, price):
+        i = bisect.bisect_left(self._prices, price)
+        if i < len(self._prices) and self._prices[i] == price:
+            del self._prices[i]
+        else:
+            log.error(f"Price level {price} not found in index")
+
+    def clear(self):
+        self._prices.clear()
+
+    def reset(self, sorted_prices):
+        # replace the index with prices already in ascending order, as when bulk loading a snapshot
+        self._prices = list(sorted_prices)
+
+    def best(self):
+        if not self._prices:
+            return None
+        return self._prices[-1] if self.descending else self._prices[0]
+
+    def nth(self, n: int):
+        # the nth best price, or None when there are fewer than n levels
+        if n > len(self._prices) or n < 1:
+            return None
+        return self._prices[-n] if self.descending else self._prices[n - 1]
+
+    def top(self, n: int):
+        # best price first
+        if self.descending:
+            return self._prices[:-n - 1:-1] if n > 0 else []
+        return self._prices[:n]
+
+    def until(self, edge):
+        # best price first, down to and including edge
+        if self.descending:
+            return self._prices[bisect.bisect_left(self._prices, edge):][::-1]
+        return self._prices[:bisect.bisect_right(self._prices, edge)]
+
+
+def _sum_by_price_numpy(orders) -> dict:
+    # group by and sum scaled int volumes by scaled int price, as int64 so the sums stay exact
+    prices = numpy.fromiter((order[1] for order in orders), dtype=numpy.int64, count=len(orders))
+    volumes = numpy.fromiter((order[2] for order in orders), dtype=numpy.int64, count=len(orders))
+    unique_prices, level_of_order = numpy.unique(prices, return_inverse=True)
+    sums = numpy.zeros(len(unique_prices), dtype=numpy.int64)
+    numpy.add.at(sums, level_of_order, volumes)
+    # back to python ints, which the rest of the book uses
+    return dict(zip(unique_prices.tolist(), sums.tolist()))
+
 
 class OrderBookState:
-    def __init__(self, symbol, render_flag=False, trade_queue=None):
+    def __init__(self, symbol, render_flag=False, trade_queue=None, fixed_point=False):
         self.symbol = symbol
+        # how prices and volumes are parsed and keyed - Decimals keyed by price string, or scaled ints when
+        # fixed_point is set. In fixed point mode, book levels, order records and trades hold scaled ints
+        self.numerics = numerics_for_symbol(symbol, fixed_point)
         self.book = {'BID': {}, 'ASK': {}}
-        # self.book_by_level_bids: [BookLevel] = []
-        # self.book_by_level_asks: [BookLevel] = []
-        self.trade_processor = TradeProcessor(trade_queue)
+        # sorted price levels for each side of the book, maintained alongside self.book
+        self.levels = {'BID': PriceLevelIndex(descending=True), 'ASK': PriceLevelIndex(descending=False)}
+        self.trade_processor = TradeProcessor(trade_queue, self.numerics)
         self.book_by_order_register = {}
         self.sequence_num = 0
         self.out_of_sequence_restart = False
-        self.render_book = render_flag
+        # draws the top of the book in the terminal after each update when render_flag is set
+        self.renderer = TerminalBookRenderer(depth=MAX_BOOK_RENDER_DEPTH) if render_flag else None
+        # called with (side_of_book, price) whenever a level's volume changes, or is added or removed. price is None
+        # when the whole side has been replaced, as on a snapshot
+        self.level_listeners = []
+        # called with (order_book_state, msg_time, rec_time) once each update has been applied
+        self.update_listeners = []
+        # held while updates are applied, by the websocket callbacks and a resync completing, so anything reading the
+        # book off that thread, like a timed flush of the publishers listening to it, sees it between updates
+        self.lock = threading.RLock()
 
     def on_initial(self, initial_msg: [], side_of_book: str, msg_time: dt.datetime, rec_time: dt.datetime):
-        for count, book_details in enumerate(initial_msg):
-            price = str(Decimal(book_details['price']).normalize())
-            volume = Decimal(book_details['volume']).normalize()
-            order_id = book_details['id']
-            log.debug(f"{count}: {price}@{volume}: {order_id}")
-
-            # add to order record (needed so we can look up details when we receive deletes)
-            self.book_by_order_register.update({order_id: {'type': side_of_book,
-                                                           'price': Decimal(price).normalize(),
-                                                           'volume': volume,
-                                                           'exchange_timestamp': msg_time,
-                                                           'received_timestamp': rec_time}
-                                                })
-            # build book
-            volume += self.book[side_of_book].get(price, Decimal(0))  # add this volume to any existing at this level
-            self.book[side_of_book].update({price: volume})  # TODO: add id to FILO list?
-
-            # stop when we've processed MAX_BOOK_DEPTH complete price levels
-            if len(self.book[side_of_book].keys()) > MAX_BOOK_DEPTH:
-                # TODO: delete the last price level as it could contain incomplete volume/ids if
-                #  there are multiple orders at this price
-                break
-
-        self.render()
+        """Bulk load one side of a snapshot: volumes are summed by price level, only the best MAX_BOOK_DEPTH levels
+        are kept, with every order at each of them, and the register and level index are built in one go"""
+        side = SIDES[side_of_book]
+        msg_ns = datetime_to_epoch_ns(msg_time)
+        rec_ns = datetime_to_epoch_ns(rec_time)
+        descending = self.levels[side_of_book].descending
+
+        orders, level_volumes = self._parse_snapshot(initial_msg)
+        prices = sorted(level_volumes)
+        if len(prices) > MAX_BOOK_DEPTH:
+            # drop the worst levels whole, rather than stopping part way through a level's orders
+            prices = prices[-MAX_BOOK_DEPTH:] if descending else prices[:MAX_BOOK_DEPTH]
+            kept = set(prices)
+            orders = [order for order in orders if order[1] in kept]
+            log.info(f"Snapshot {side_of_book} side truncated to {MAX_BOOK_DEPTH} of {len(level_volumes)} levels")
+        if log_flags.debug:
+            log.debug(f"Loading {len(orders)} {side_of_book} orders over {len(prices)} levels")
+
+        # the order register is needed so we can look up details when we receive deletes
+        self.book_by_order_register.update({order_id: OrderRecord(side, price, volume, msg_ns, rec_ns)
+                                            for order_id, price, volume in orders})
+        book_side = self.book[side_of_book]
+        if book_side:
+            # not expected, snapshots are loaded into an empty book, but merge rather than lose what's there
+            for price in prices:
+                self._add_to_level(side_of_book, price, level_volumes[price])
+        else:
+            book_key = self.numerics.book_key
+            book_side.update((book_key(price), level_volumes[price]) for price in prices)
+            self.levels[side_of_book].reset(prices)
+        for listener in self.level_listeners:
+            listener(side_of_book, None)
+
+        self._updated(msg_time, rec_time)
+
+    def _parse_snapshot(self, initial_msg):
+        """Returns a list of (order id, price, volume) and a dict of total volume by price"""
+        numerics = self.numerics
+        # there are typically several orders per level, so only parse each distinct price string once
+        parsed_prices = {}
+        for book_details in initial_msg:
+            text = book_details['price']
+            if text not in parsed_prices:
+                parsed_prices[text] = numerics.parse_price(text)
+        parse_volume = numerics.parse_volume
+        orders = [(book_details['id'], parsed_prices[book_details['price']], parse_volume(book_details['volume']))
+                  for book_details in initial_msg]
+
+        if numerics.fixed_point and numpy is not None and orders:
+            try:
+                return orders, _sum_by_price_numpy(orders)
+            except OverflowError:
+                pass  # beyond int64, sum them as python ints below
+        level_volumes = {}
+        zero = numerics.zero
+        for _, price, volume in orders:
+            level_volumes[price] = level_volumes.get(price, zero) + volume
+        return orders, level_volumes
+
+    def adopt(self, other: 'OrderBookState', msg_time: dt.datetime, rec_time: dt.datetime):
+        """Take over the book built up in other, a shadow OrderBookState for the same symbol (see resync), as of the
+        last update applied to it at msg_time. Each structure is swapped by reference, so this is quick however deep
+        the book is"""
+        self.book = other.book
+        self.levels = other.levels
+        self.book_by_order_register = other.book_by_order_register
+        self.sequence_num = other.sequence_num
+        for listener in self.level_listeners:
+            listener('BID', None)
+            listener('ASK', None)
+        self._updated(msg_time, rec_time)
 
     def on_trade(self, trade_msg, msg_time: dt.datetime, rec_time: dt.datetime):
         for trade in trade_msg:
-            trade_base = Decimal(trade['base']).normalize()
-            trade_counter = Decimal(trade['counter']).normalize()
+            trade_base = self.numerics.parse_volume(trade['base'])
+            trade_counter = self.numerics.parse_counter_volume(trade['counter'])
 
             maker_id = trade.get('maker_order_id')
             maker_order = self.book_by_order_register.get(maker_id)
@@ -77,118 +243,146 @@ class OrderBookState:
             order = self.book_by_order_register.get(order_id)
             self.trade_processor.on_trade(self.symbol, order, trade_base, trade_counter, msg_time, rec_time)
 
-            log.debug(f"\n{maker_order=}, \n{taker_order=}, \n{order=}")
+            if log_flags.debug:
+                log.debug(f"\n{maker_order=}, \n{taker_order=}, \n{order=}")
 
             if maker_order:
                 # reduce the maker volume by the size of the trade and update orders
-                maker_order['volume'] -= trade_base
-                log.debug(f"Updated maker order: \n{maker_order=}")
-                if maker_order['volume'] == 0:
+                maker_order.volume -= trade_base
+                if log_flags.debug:
+                    log.debug(f"Updated maker order: \n{maker_order=}")
+                if maker_order.volume == 0:
                     # remove order from order register if its now zero volume
                     self.book_by_order_register.pop(maker_id)
-                elif maker_order['volume'] < 0:
+                elif maker_order.volume < 0:
                     log.error(f"Order volume went negative! \n{maker_order=}")
                     # handle this case if it ever happens. log error to see
-                self.book_by_order_register.update(maker_order)
                 self.update_book_after_trade_or_deletion(maker_order, trade_base)
 
             if taker_order:
                 # reduce the maker volume by the size of the trade
-                taker_order['volume'] -= trade_base
-                log.debug(f"Updated taker order: \n{taker_order=}")
-                if taker_order['volume'] < 0:
+                taker_order.volume -= trade_base
+                if log_flags.debug:
+                    log.debug(f"Updated taker order: \n{taker_order=}")
+                if taker_order.volume < 0:
                     log.error(f"Order volume went negative! \n{taker_order=}")
                     # handle this case if it ever happens. log error to see
-                self.book_by_order_register.update(taker_order)
                 self.update_book_after_trade_or_deletion(taker_order, trade_base)
 
             if not maker_order and not taker_order:
                 log.error("Trade occurred but no maker or taker order found in order register")
 
-        self.render()
+        self._updated(msg_time, rec_time)
 
-    def update_book_after_trade_or_deletion(self, order, reduce_by):
+    def update_book_after_trade_or_deletion(self, order: OrderRecord, reduce_by):
         # update book
-        if isinstance(order['price'], Decimal):
-            lookup_price = str(order['price'])
-        else:
-            lookup_price = order['price']
-        level = self.book[order['type']].get(lookup_price)
+        lookup_price = self.numerics.book_key(order.price)
+        level = self.book[order.side].get(lookup_price)
         if level:
             new_level = level - reduce_by
             if new_level < 0:
                 log.error("Somethings gone wrong, price in book reduced below 0!")
             elif new_level > 0:
-                self.book[order['type']].update({lookup_price: new_level})
+                self.book[order.side][lookup_price] = new_level
             else:
                 # remove level entirely
-                removed = self.book[order['type']].pop(lookup_price)
-                log.debug(f"Removed entire level: {removed=}")
+                removed = self.book[order.side].pop(lookup_price)
+                self.levels[order.side].remove(order.price)
+                if log_flags.debug:
+                    log.debug(f"Removed entire level: {removed=}")
+            for listener in self.level_listeners:
+                listener(order.side, order.price)
         else:
             log.error("Somethings gone wrong updating book, trying to update or remove an order which doesn't exist!")
 
+    def _add_to_level(self, side_of_book: str, price, volume):
+        key = self.numerics.book_key(price)
+        level = self.book[side_of_book].get(key)
+        if level is None:
+            self.levels[side_of_book].add(price)
+            self.book[side_of_book][key] = volume
+        else:
+            self.book[side_of_book][key] = level + volume  # add this volume to any existing at this level
+        for listener in self.level_listeners:
+            listener(side_of_book, price)
+
+    def _updated(self, msg_time: dt.datetime, rec_time: dt.datetime):
+        for listener in self.update_listeners:
+            listener(self, msg_time, rec_time)
+        self.render()
+
+    def best_bid(self):
+        return self._best_level('BID')
+
+    def best_ask(self):
+        return self._best_level('ASK')
+
+    def _best_level(self, side_of_book: str):
+        price = self.levels[side_of_book].best()
+        if price is None:
+            return None
+        return BookLevel(price, self.book[side_of_book][self.numerics.book_key(price)], side_of_book)
+
+    def top_n(self, side_of_book: str, n: int):
+        side = self.book[side_of_book]
+        book_key = self.numerics.book_key
+        return [BookLevel(price, side[book_key(price)], side_of_book) for price in self.levels[side_of_book].top(n)]
+
+    def spread(self):
+        best_bid = self.levels['BID'].best()
+        best_ask = self.levels['ASK'].best()
+        if best_bid is None or best_ask is None:
+            return None
+        return best_ask - best_bid
+
     def on_create(self, create_msg: dict, msg_time: dt.datetime, rec_time: dt.datetime):
         order_id = create_msg.get('order_id')
         side_of_book = create_msg.get('type')
-        price = str(Decimal(create_msg.get('price')).normalize())
-        volume = Decimal(create_msg.get('volume')).normalize()
-        created = {order_id: {'type': side_of_book,
-                              'price': Decimal(price),
-                              'volume': volume,
-                              'exchange_timestamp': msg_time,
-                              'received_timestamp': rec_time}}
-        self.book_by_order_register.update(created)
+        price = self.numerics.parse_price(create_msg.get('price'))
+        volume = self.numerics.parse_volume(create_msg.get('volume'))
+        created = OrderRecord(SIDES[side_of_book], price, volume,
+                              datetime_to_epoch_ns(msg_time), datetime_to_epoch_ns(rec_time))
+        self.book_by_order_register[order_id] = created
         # update book
-        volume += self.book[side_of_book].get(price, Decimal(0))  # add this volume to any existing at this level
-        self.book[side_of_book].update({price: volume})
-        log.debug(f"Order created: \n{created=}")
+        self._add_to_level(side_of_book, price, volume)
+        if log_flags.debug:
+            log.debug(f"Order created: \n{created=}")
 
-        self.render()
+        self._updated(msg_time, rec_time)
 
     def on_delete(self, delete_msg, msg_time: dt.datetime, rec_time: dt.datetime):
         order_id = delete_msg.get('order_id')
         order = self.book_by_order_register.get(order_id)
         if order:
             removed = self.book_by_order_register.pop(order_id)
-            log.debug(f"Order deleted: \n{removed=}")
+            if log_flags.debug:
+                log.debug(f"Order deleted: \n{removed=}")
             # remove reduce volume from book or remove price entirely
-            self.update_book_after_trade_or_deletion(order, reduce_by=order['volume'])
+            self.update_book_after_trade_or_deletion(order, reduce_by=order.volume)
         else:
             log.warning("Received a delete for an order which we have no record!")
 
-        self.render()
+        self._updated(msg_time, rec_time)
+
+    def memory_footprint(self):
+        """Approximate heap used by the order register and book, so we can track bytes per resting order"""
+        register_bytes = sys.getsizeof(self.book_by_order_register)
+        for order_id, record in self.book_by_order_register.items():
+            register_bytes += (sys.getsizeof(order_id) + sys.getsizeof(record) + sys.getsizeof(record.price)
+                               + sys.getsizeof(record.volume) + sys.getsizeof(record.exchange_timestamp)
+                               + sys.getsizeof(record.received_timestamp))
+        book_bytes = 0
+        for side_of_book, side in self.book.items():
+            book_bytes += sys.getsizeof(side) + sys.getsizeof(self.levels[side_of_book]._prices)
+            for key, volume in side.items():
+                book_bytes += sys.getsizeof(key) + sys.getsizeof(volume)
+        resting_orders = len(self.book_by_order_register)
+        return {'resting_orders': resting_orders,
+                'price_levels': len(self.book['BID']) + len(self.book['ASK']),
+                'register_bytes': register_bytes,
+                'book_bytes': book_bytes,
+                'bytes_per_resting_order': register_bytes / resting_orders if resting_orders else 0}
 
     def render(self):
-        if self.render_book:
-            self._render()
-
-    def _render(self):
-        if len(self.book['BID']) > 0 and len(self.book['ASK']) > 0:
-            # Convert to pd DataFrame for cleaner rendering
-            # Create a list of tuples from the dictionary
-            list_of_bid_tuples = list(self.book['BID'].items())
-            list_of_ask_tuples = list(self.book['ASK'].items())
-            # Create a pandas DataFrame from the list of tuples
-            bid_book = pd.DataFrame(list_of_bid_tuples, columns=['bid_price', 'bid_volume'])
-            bid_book = bid_book.sort_values('bid_price', ascending=False)
-            ask_book = pd.DataFrame(list_of_ask_tuples, columns=['ask_price', 'ask_volume'])
-            ask_book = ask_book.sort_values('ask_price', ascending=True)
-            bid_book.reset_index(drop=True, inplace=True)
-            ask_book.reset_index(drop=True, inplace=True)
-            pretty_book = pd.concat([bid_book, ask_book], ignore_index=False, axis=1)
-            print("\n" * 100)  # hack to render half-decent in-place book updates in Pycharm terminal window
-            print(f"\n{pretty_book[0:MAX_BOOK_RENDER_DEPTH]}")
-
-    def validate_structures(self):
-        bid_side = self.book.get('BID')
-        ask_side = self.book.get('ASK')
-        if bid_side and ask_side:
-            # check that no level in both sides of book has zero volume
-            if 0 in bid_side.values() or 0 in ask_side.values():
-                log.error("0 volume detected in book")
-                self._render()
-
-            if 0.0 in bid_side.keys() or 0.0 in ask_side.keys():
-                log.error("0 price detected in book")
-                self._render()
-
+        if self.renderer:
+            self.renderer.render(self)
@@ -0,0 +1,89 @@
+"""Replay a recorded frame log through WebsocketCallbackHandlers, either at the original pace, at N x speed or as
+fast as possible.
+
+    python replay.py recorded.frames --symbol XBTZAR [--speed 10]
+"""
+import argparse
+import logging
+import time
+from logging import getLogger
+
+from frame_log import FrameLogReader
+from order_book_state import OrderBookState
+from utils.utils import setup_logging
+from ws_handlers import WebsocketCallbackHandlers
+
+log = getLogger(__name__)
+
+
+class ReplaySocket:
+    """Stands in for the websocket passed to the handlers. on_message closes the socket when it sees an out of
+    sequence update, which in a recording is followed by the frames of the reconnection"""
+    def __init__(self):
+        self.closed_count = 0
+
+    def close(self):
+        self.closed_count += 1
+
+
+class ReplayStats:
+    def __init__(self):
+        self.frames = 0
+        self.elapsed_ns = 0
+        self.reconnects = 0
+
+    @property
+    def frames_per_sec(self):
+        return self.frames / (self.elapsed_ns / 1e9) if self.elapsed_ns else 0.0
+
+    def __repr__(self):
+        return (f"ReplayStats({self.frames} frames in {self.elapsed_ns / 1e9:.3f}s, "
+                f"{self.frames_per_sec:.0f} frames/sec, {self.reconnects} reconnects)")
+
+
+def replay(frames, handlers: WebsocketCallbackHandlers, speed: float = None) -> ReplayStats:
+    """Feed (received epoch ns, frame) tuples to handlers.on_frame. speed of None replays as fast as possible,
+    1.0 at the recorded pace, and N at N times the recorded pace"""
+    wsocket = ReplaySocket()
+    stats = ReplayStats()
+    first_received_ns = None
+    start_ns = time.perf_counter_ns()
+    for received_ns, frame in frames:
+        if speed:
+            if first_received_ns is None:
+                first_received_ns = received_ns
+            due_ns = start_ns + (received_ns - first_received_ns) / speed
+            wait_ns = due_ns - time.perf_counter_ns()
+            if wait_ns > 0:
+                time.sleep(wait_ns / 1e9)
+
+        # recorded receive times are passed through, so a replay produces the same trades as the live session
+        handlers.on_frame(wsocket, frame, received_ns)
+        stats.frames += 1
+        if handlers.order_book_state.out_of_sequence_restart:
+            handlers.order_book_state.out_of_sequence_restart = False
+            stats.reconnects += 1
+
+    stats.elapsed_ns = time.perf_counter_ns() - start_ns
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frame_log', help="frame log written by FrameLogWriter")
+    parser.add_argument('--symbol', default="XBTZAR")
+    parser.add_argument('--speed', type=float, default=None,
+                        help="1 for the recorded pace, N for N x speed, omit for as fast as possible")
+    parser.add_argument('--render', action='store_true', help="render the book while replaying")
+    args = parser.parse_args()
+
+    setup_logging(level=logging.INFO)
+    order_book_state = OrderBookState(symbol=args.symbol, render_flag=args.render)
+    # resync snapshots are loaded inline, so every replay of a recording ends with the same book
+    handlers = WebsocketCallbackHandlers(order_book_state, background_resync=False)
+    stats = replay(FrameLogReader(args.frame_log), handlers, speed=args.speed)
+    log.info(f"Replay finished: {stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Resynchronise a book after a sequence gap or reconnect, without tearing down the live one.
+
+The fresh snapshot is loaded into a shadow OrderBookState on a loader thread, while the deltas that follow it are
+buffered. As soon as it's loaded, the buffered deltas are replayed onto the shadow book and it's swapped into the
+live OrderBookState with adopt(), on the loader thread, holding the lock the callback thread takes to hand it frames.
+Until then, readers of the live book keep seeing its last consistent state
+"""
+import threading
+import time
+from logging import getLogger
+
+from order_book_state import OrderBookState
+
+log = getLogger(__name__)
+
+
+class BookResync:
+    """Driven from the websocket callback thread by WebsocketCallbackHandlers. dispatch(book_state, msg_data,
+    msg_datetime, now_datetime) applies a decoded delta to a book. With background=False the snapshot is loaded on
+    the calling thread, which makes replays and tests deterministic"""
+    def __init__(self, order_book_state: OrderBookState, dispatch, background=True):
+        self.order_book_state = order_book_state
+        self.dispatch = dispatch
+        self.background = background
+        self.active = False
+        self.resyncs = 0
+        self.last_gap_ns = 0  # from the gap being detected to the shadow book being swapped in
+        self.last_missed = 0  # sequence numbers we never saw the update for, covered by the snapshot instead
+        self.total_missed = 0
+        self._started_ns = 0
+        self._last_good_sequence = 0
+        self._snapshot_sequence = 0
+        self._shadow = None
+        self._loaded = None
+        self._snapshot_times = None
+        self._buffered = []
+        # the live book's lock, held while frames are handed over and while the resync completes, so a frame is
+        # either buffered ahead of the swap or applied to the live book after it
+        self._lock = order_book_state.lock
+
+    def begin(self, last_good_sequence: int):
+        """Called when a gap is detected. The live book is left as is until the resync completes"""
+        if self.active:
+            return
+        self.active = True
+        self._started_ns = time.monotonic_ns()
+        self._last_good_sequence = last_good_sequence
+        self._shadow = None
+        self._buffered = []
+        log.warning(f"Resynchronising {self.order_book_state.symbol} book from sequence {last_good_sequence}")
+
+    def on_frame(self, msg_data, msg_datetime, now_datetime) -> bool:
+        """Called instead of the usual dispatch while a resync is active. Returns False if the resync completed
+        before the frame could be taken, in which case the caller applies it to the live book as usual"""
+        with self._lock:
+            if not self.active:
+                return False
+            if msg_data.asks or msg_data.bids:
+                self._start_load(msg_data, msg_datetime, now_datetime)
+            elif self._shadow is None:
+                # still on the old connection, or the new one hasn't sent its snapshot yet. The snapshot covers it
+                return True
+            else:
+                self._buffered.append((msg_data, msg_datetime, now_datetime))
+            if self._loaded.is_set():
+                self._complete()
+            return True
+
+    def _start_load(self, msg_data, msg_datetime, now_datetime):
+        live = self.order_book_state
+        shadow = OrderBookState(live.symbol, render_flag=False, fixed_point=live.numerics.fixed_point)
+        # trades replayed onto the shadow book go out through the live book's processor, and its counters
+        shadow.trade_processor = live.trade_processor
+        shadow.sequence_num = self._snapshot_sequence = int(msg_data.sequence)
+        # a second snapshot (the new connection dropped too) replaces the first, along with anything buffered
+        self._shadow = shadow
+        self._snapshot_times = (msg_datetime, now_datetime)
+        self._loaded = threading.Event()
+        self._buffered = []
+        if self.background:
+            threading.Thread(target=self._load_and_complete,
+                             args=(shadow, self._loaded, msg_data, msg_datetime, now_datetime),
+                             name=f"resync-{live.symbol}", daemon=True).start()
+        else:
+            self._load(shadow, self._loaded, msg_data, msg_datetime, now_datetime)
+
+    @staticmethod
+    def _load(shadow, loaded, msg_data, msg_datetime, now_datetime):
+        # the shadow book isn't visible to anything else until it's adopted, so it's safe to build off thread
+        try:
+            if msg_data.asks:
+                shadow.on_initial(msg_data.asks, 'ASK', msg_datetime, now_datetime)
+            if msg_data.bids:
+                shadow.on_initial(msg_data.bids, 'BID', msg_datetime, now_datetime)
+        except Exception as e:
+            log.exception(e)
+        finally:
+            loaded.set()
+
+    def _load_and_complete(self, shadow, loaded, msg_data, msg_datetime, now_datetime):
+        # the loader thread swaps the book in itself rather than waiting for the next frame, which on a quiet
+        # symbol might not come for a while
+        self._load(shadow, loaded, msg_data, msg_datetime, now_datetime)
+        with self._lock:
+            # unless a later snapshot has replaced this one, or a frame handed over since the load finished has
+            # already completed it
+            if self._shadow is shadow:
+                self._complete()
+
+    def _complete(self):
+        shadow = self._shadow
+        msg_datetime, now_datetime = self._snapshot_times
+        for msg_data, msg_datetime, now_datetime in self._buffered:
+            sequence_no = int(msg_data.sequence)
+            if sequence_no <= shadow.sequence_num:
+                continue  # already in the snapshot
+            shadow.sequence_num = sequence_no
+            self.dispatch(shadow, msg_data, msg_datetime, now_datetime)
+        replayed = len(self._buffered)
+        self._buffered = []
+
+        # as of the last update replayed, or the snapshot if none were
+        self.order_book_state.adopt(shadow, msg_datetime, now_datetime)
+        self._shadow = None
+        self.active = False
+        self.resyncs += 1
+        self.last_gap_ns = time.monotonic_ns() - self._started_ns
+        self.last_missed = max(0, self._snapshot_sequence - self._last_good_sequence)
+        self.total_missed += self.last_missed
+        log.warning(f"Resynchronised {self.order_book_state.symbol} book at sequence {shadow.sequence_num} after "
+                    f"{self.last_gap_ns / 1e6:.1f}ms, {self.last_missed} updates missed, {replayed} buffered "
+                    f"updates replayed")
+
+    def metrics(self) -> dict:
+        return {'resyncs': self.resyncs,
+                'resyncing': self.active,
+                'last_gap_ms': self.last_gap_ns / 1e6,
+                'last_missed': self.last_missed,
+                'total_missed': self.total_missed}
@@ -0,0 +1,287 @@
+"""Shard symbols across worker processes, so book updates for different symbols run on different cores.
+
+Each worker runs a CaptureSupervisor over its share of the symbols and forwards trades back to the parent over a
+one-way pipe, in batches of BinaryTradeSerializer encoded trades, along with any top of book snapshots, OHLCV
+bars and book features as JSON. Workers also send a periodic health report. The parent puts the trades onto the
+trade queue feeding the single publisher, and the rest onto their own queues
+"""
+import json
+import multiprocessing
+import queue
+import signal
+import struct
+import threading
+import time
+from logging import getLogger
+from multiprocessing.connection import wait
+
+from bars import Bar, DEFAULT_BAR_INTERVALS_SECS
+from book_analytics import BookFeatures, DEFAULT_ANALYTICS_INTERVAL_SECS, DEFAULT_BANDS_BPS, DEFAULT_IMBALANCE_DEPTH
+from book_snapshots import BookSnapshot, DEFAULT_DEPTH, DEFAULT_INTERVAL_SECS
+from capture_supervisor import CaptureSupervisor
+from metrics import REGISTRY
+from trade_serializers import BinaryTradeSerializer
+from utils.utils import setup_logging
+
+log = getLogger(__name__)
+
+# channel message kinds
+TRADES = 1
+HEALTH = 2
+CLOSED = 3
+BOOKS = 4
+BARS = 5
+ANALYTICS = 6
+
+MESSAGE_HEADER = struct.Struct('<BI')  # kind, record count
+RECORD_HEADER = struct.Struct('<H')
+MAX_BATCH = 500
+HEALTH_INTERVAL_SECS = 10
+STOP_TIMEOUT_SECS = 10  # how long a worker waits for its streams to close once stopped
+
+
+def shard_symbols(symbols, workers: int):
+    shards = [[] for _ in range(min(workers, len(symbols)))]
+    for n, symbol in enumerate(symbols):
+        shards[n % len(shards)].append(symbol)
+    return shards
+
+
+def encode_trades(trades, serializer=BinaryTradeSerializer()) -> bytes:
+    payload = bytearray(MESSAGE_HEADER.pack(TRADES, len(trades)))
+    for trade in trades:
+        data = serializer.encode(trade)
+        payload += RECORD_HEADER.pack(len(data))
+        payload += data
+    return bytes(payload)
+
+
+def decode_trades(payload: bytes, serializer=BinaryTradeSerializer()):
+    view = memoryview(payload)
+    _, count = MESSAGE_HEADER.unpack_from(view)
+    offset = MESSAGE_HEADER.size
+    trades = []
+    for _ in range(count):
+        (length,) = RECORD_HEADER.unpack_from(view, offset)
+        offset += RECORD_HEADER.size
+        trades.append(serializer.decode_trade(view[offset:offset + length]))
+        offset += length
+    return trades
+
+
+def encode_book_snapshots(snapshots) -> bytes:
+    return MESSAGE_HEADER.pack(BOOKS, len(snapshots)) + json.dumps([s.to_dict() for s in snapshots]).encode()
+
+
+def decode_book_snapshots(payload: bytes):
+    return [BookSnapshot.from_dict(values) for values in json.loads(bytes(payload[MESSAGE_HEADER.size:]))]
+
+
+def encode_bars(bars) -> bytes:
+    return MESSAGE_HEADER.pack(BARS, len(bars)) + json.dumps([bar.to_dict() for bar in bars]).encode()
+
+
+def decode_bars(payload: bytes):
+    return [Bar.from_dict(values) for values in json.loads(bytes(payload[MESSAGE_HEADER.size:]))]
+
+
+def encode_book_features(features) -> bytes:
+    return MESSAGE_HEADER.pack(ANALYTICS, len(features)) + json.dumps([f.to_dict() for f in features]).encode()
+
+
+def decode_book_features(payload: bytes):
+    return [BookFeatures.from_dict(values) for values in json.loads(bytes(payload[MESSAGE_HEADER.size:]))]
+
+
+def _forward_queued(conn, source_queue, encode):
+    # sends whatever's queued, if anything, as one message
+    items = []
+    try:
+        while len(items) < MAX_BATCH:
+            items.append(source_queue.get_nowait())
+    except queue.Empty:
+        pass
+    if items:
+        conn.send_bytes(encode(items))
+
+
+def _send_health(conn, worker_id, supervisor, forwarded, batches, started):
+    elapsed = time.monotonic() - started
+    report = {'worker': worker_id,
+              'pid': multiprocessing.current_process().pid,
+              'trades_forwarded': forwarded,
+              'batches': batches,
+              'trades_per_sec': forwarded / elapsed if elapsed else 0.0,
+              'streams': supervisor.metrics(),
+              'latency': REGISTRY.summary_line()}
+    conn.send_bytes(MESSAGE_HEADER.pack(HEALTH, 1) + json.dumps(report).encode())
+
+
+def capture_worker(worker_id, symbols, conn, stop_event, fixed_point=False, record_frames=False,
+                   start_stream=None, book_snapshots=False, book_depth=DEFAULT_DEPTH,
+                   book_interval_secs=DEFAULT_INTERVAL_SECS, bars=False, bar_intervals_secs=DEFAULT_BAR_INTERVALS_SECS,
+                   bar_volumes=(), analytics=False, imbalance_depth=DEFAULT_IMBALANCE_DEPTH,
+                   bands_bps=DEFAULT_BANDS_BPS, analytics_interval_secs=DEFAULT_ANALYTICS_INTERVAL_SECS):
+    """Entry point of a worker process"""
+    # Ctrl-C reaches the whole process group, only the parent handles it and stops the workers through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()
+    trade_queue = queue.Queue()
+    book_queue = queue.Queue(maxsize=100 * len(symbols)) if book_snapshots else None
+    bar_queue = queue.Queue(maxsize=100 * len(symbols)) if bars else None
+    analytics_queue = queue.Queue(maxsize=100 * len(symbols)) if analytics else None
+    side_queues = [(side_queue, encode) for side_queue, encode in ((book_queue, encode_book_snapshots),
+                                                                    (bar_queue, encode_bars),
+                                                                    (analytics_queue, encode_book_features))
+                   if side_queue is not None]
+    supervisor = CaptureSupervisor(symbols, trade_queue, fixed_point=fixed_point, record_frames=record_frames,
+                                   start_stream=start_stream, book_queue=book_queue, book_depth=book_depth,
+                                   book_interval_secs=book_interval_secs, bar_queue=bar_queue,
+                                   bar_intervals_secs=bar_intervals_secs, bar_volumes=bar_volumes,
+                                   analytics_queue=analytics_queue, imbalance_depth=imbalance_depth,
+                                   bands_bps=bands_bps, analytics_interval_secs=analytics_interval_secs)
+    streams_done = threading.Event()
+    capture = threading.Thread(target=supervisor.run, args=(streams_done,), name="capture", daemon=True)
+    capture.start()
+
+    forwarded = batches = 0
+    started = time.monotonic()
+    next_health = started + HEALTH_INTERVAL_SECS
+    stop_deadline = None
+    # keep going until the streams have finished and everything they queued has been forwarded
+    while not streams_done.is_set() or not trade_queue.empty() or any(not q.empty() for q, _ in side_queues):
+        if stop_event.is_set() and stop_deadline is None:
+            stop_deadline = time.monotonic() + STOP_TIMEOUT_SECS
+            supervisor.stop()
+        if stop_deadline is not None and not streams_done.is_set() and time.monotonic() >= stop_deadline:
+            log.warning(f"Capture worker {worker_id} streams didn't close within {STOP_TIMEOUT_SECS}s, exiting")
+            break
+        batch = []
+        try:
+            batch.append(trade_queue.get(timeout=0.5))
+            while len(batch) < MAX_BATCH:
+                batch.append(trade_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
+            # one send per batch of trades rather than one per trade
+            conn.send_bytes(encode_trades(batch))
+            forwarded += len(batch)
+            batches += 1
+        for side_queue, encode in side_queues:
+            _forward_queued(conn, side_queue, encode)
+        if time.monotonic() >= next_health:
+            _send_health(conn, worker_id, supervisor, forwarded, batches, started)
+            next_health = time.monotonic() + HEALTH_INTERVAL_SECS
+
+    capture.join(timeout=STOP_TIMEOUT_SECS)
+    _send_health(conn, worker_id, supervisor, forwarded, batches, started)
+    conn.send_bytes(MESSAGE_HEADER.pack(CLOSED, 0))
+    conn.close()
+
+
+class ShardedCapture:
+    """Same run()/stop() interface as CaptureSupervisor, with the symbols spread over worker processes"""
+    def __init__(self, symbols, trade_queue, workers: int, fixed_point=False, record_frames=False,
+                 start_stream=None, book_queue=None, book_depth=DEFAULT_DEPTH,
+                 book_interval_secs=DEFAULT_INTERVAL_SECS, bar_queue=None,
+                 bar_intervals_secs=DEFAULT_BAR_INTERVALS_SECS, bar_volumes=(), analytics_queue=None,
+                 imbalance_depth=DEFAULT_IMBALANCE_DEPTH, bands_bps=DEFAULT_BANDS_BPS,
+                 analytics_interval_secs=DEFAULT_ANALYTICS_INTERVAL_SECS):
+        self.trade_queue = trade_queue
+        self.book_queue = book_queue
+        self.book_snapshots_dropped = 0
+        self.bar_queue = bar_queue
+        self.bars_dropped = 0
+        self.analytics_queue = analytics_queue
+        self.features_dropped = 0
+        # spawn rather than fork, as the parent already has logging and publisher threads running
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.workers = []
+        self.health = {}
+        for worker_id, shard in enumerate(shard_symbols(symbols, workers)):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=capture_worker, name=f"capture-{worker_id}",
+                                      args=(worker_id, shard, sender, self.stop_event, fixed_point, record_frames,
+                                            start_stream, book_queue is not None, book_depth, book_interval_secs,
+                                            bar_queue is not None, bar_intervals_secs, bar_volumes,
+                                            analytics_queue is not None, imbalance_depth, bands_bps,
+                                            analytics_interval_secs))
+            self.workers.append((worker_id, shard, process, receiver, sender))
+            self.health[worker_id] = {'symbols': shard}
+
+    def run(self, shutdown_event: threading.Event):
+        """Blocks until every worker has closed its channel, then sets shutdown_event"""
+        for _, _, process, _, sender in self.workers:
+            process.start()
+            sender.close()  # the worker holds the only sending end now, so we see EOF if it dies
+        open_channels = {receiver: worker_id for worker_id, _, _, receiver, _ in self.workers}
+        try:
+            while open_channels:
+                try:
+                    self._receive(open_channels)
+                except KeyboardInterrupt:
+                    # keep receiving until the workers have flushed their last trades and closed their channels
+                    log.info("Interrupted, stopping capture workers")
+                    self.stop()
+        finally:
+            for _, _, process, _, _ in self.workers:
+                process.join(timeout=10)
+            log.info(f"All capture workers finished: {self.report()}")
+            shutdown_event.set()
+
+    def _receive(self, open_channels):
+        for receiver in wait(list(open_channels), timeout=1):
+            worker_id = open_channels[receiver]
+            try:
+                payload = receiver.recv_bytes()
+            except EOFError:
+                log.error(f"Capture worker {worker_id} exited without closing its channel")
+                del open_channels[receiver]
+                continue
+            self._on_payload(worker_id, payload, open_channels, receiver)
+
+    def _on_payload(self, worker_id, payload, open_channels, receiver):
+        kind, _ = MESSAGE_HEADER.unpack_from(payload)
+        if kind == TRADES:
+            if self.trade_queue is None:
+                return  # only the bars are being published
+            for trade in decode_trades(payload):
+                # the wait on the publisher's queue, the time in the pipe is in the worker's latency report
+                trade.queued_ns = time.monotonic_ns()
+                self.trade_queue.put(trade)
+        elif kind == BOOKS:
+            for snapshot in decode_book_snapshots(payload):
+                try:
+                    self.book_queue.put_nowait(snapshot)
+                except queue.Full:
+                    self.book_snapshots_dropped += 1
+        elif kind == BARS:
+            for bar in decode_bars(payload):
+                try:
+                    self.bar_queue.put_nowait(bar)
+                except queue.Full:
+                    self.bars_dropped += 1
+        elif kind == ANALYTICS:
+            for features in decode_book_features(payload):
+                try:
+                    self.analytics_queue.put_nowait(features)
+                except queue.Full:
+                    self.features_dropped += 1
+        elif kind == HEALTH:
+            report = json.loads(bytes(payload[MESSAGE_HEADER.size:]))
+            self.health[worker_id].update(report)
+            log.info(f"Capture worker {worker_id} health: {report}")
+        elif kind == CLOSED:
+            del open_channels[receiver]
+        else:
+            log.error(f"Unknown message kind {kind} from capture worker {worker_id}")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def report(self) -> dict:
+        for worker_id, _, process, _, _ in self.workers:
+            self.health[worker_id]['alive'] = process.is_alive()
+        return self.health
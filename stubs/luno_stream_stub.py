@@ -0,0 +1,50 @@
+from logging import getLogger
+
+from websockets.asyncio.server import serve
+
+log = getLogger(__name__)
+
+
+class LunoStreamStub:
+    """Local stand-in for the Luno streaming websocket. Each connection reads the credentials message, then is sent
+    the next list of frames from frames_per_connection and closed. Connections beyond the last list are held open
+    without sending anything. frames_per_connection is either one list of lists for every symbol, in connection
+    order, or a dict of them by symbol, the last part of the url path"""
+    def __init__(self, frames_per_connection, host="127.0.0.1"):
+        if isinstance(frames_per_connection, dict):
+            self.frames_by_symbol = {symbol: list(frames) for symbol, frames in frames_per_connection.items()}
+        else:
+            self.frames_by_symbol = {None: list(frames_per_connection)}
+        self.host = host
+        self.port = None
+        self.credentials = []
+        self.connections = 0
+        self.connections_by_symbol = {}
+        self._server = None
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/api/1/stream/"
+
+    async def _handler(self, connection):
+        self.credentials.append(await connection.recv())
+        self.connections += 1
+        symbol = connection.request.path.rsplit('/', 1)[-1] if None not in self.frames_by_symbol else None
+        frames_per_connection = self.frames_by_symbol.get(symbol, [])
+        connection_number = self.connections_by_symbol.get(symbol, 0)
+        self.connections_by_symbol[symbol] = connection_number + 1
+        if connection_number >= len(frames_per_connection):
+            await connection.wait_closed()
+            return
+        for frame in frames_per_connection[connection_number]:
+            await connection.send(frame)
+        log.info(f"Stub sent {len(frames_per_connection[connection_number])} frames, closing")
+
+    async def __aenter__(self):
+        self._server = await serve(self._handler, self.host, 0, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        await self._server.wait_closed()
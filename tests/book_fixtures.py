@@ -0,0 +1,51 @@
+"""Books and updates shared by the tests of things that listen to an OrderBookState"""
+import datetime as dt
+import queue
+
+from order_book_state import OrderBookState
+
+MSG_TIME = dt.datetime(2023, 1, 12, 4, 5, 5)
+REC_TIME = dt.datetime(2023, 1, 12, 4, 5, 6)
+
+
+def ladder(side_of_book, levels=3, volume='1.00'):
+    """An order a level, best first, bids from 9 down and asks from 11 up"""
+    if side_of_book == 'BID':
+        return [{'id': f'bid_order{n}', 'price': f'{10 - n}.00000000', 'volume': volume} for n in range(1, levels + 1)]
+    return [{'id': f'ask_order{n}', 'price': f'{10 + n}.00000000', 'volume': volume} for n in range(1, levels + 1)]
+
+
+MSG_BIDS = ladder('BID')
+MSG_ASKS = ladder('ASK')
+
+
+def create(order_id, side, price, volume='0.50'):
+    return {'order_id': order_id, 'type': side, 'price': price, 'volume': volume}
+
+
+def load_book(book_state, bids=MSG_BIDS, asks=MSG_ASKS):
+    book_state.on_initial(bids, 'BID', MSG_TIME, REC_TIME)
+    book_state.on_initial(asks, 'ASK', MSG_TIME, REC_TIME)
+
+
+class BookListenerTestMixin:
+    """For unittest.TestCase classes. construct_book(attach) builds self.book_state, calls attach(book_state,
+    output_queue) to hook up whatever's under test before the snapshot's loaded, and returns what attach does"""
+    def construct_book(self, attach, bids=MSG_BIDS, asks=MSG_ASKS, fixed_point=False, maxsize=0):
+        self.output_queue = queue.Queue(maxsize=maxsize)
+        self.book_state = OrderBookState(symbol="XBTZAR", fixed_point=fixed_point)
+        attached = attach(self.book_state, self.output_queue)
+        load_book(self.book_state, bids, asks)
+        return attached
+
+    def drain(self):
+        items = []
+        while not self.output_queue.empty():
+            items.append(self.output_queue.get_nowait())
+        return items
+
+    def create(self, order_id, side, price, volume='0.50'):
+        self.book_state.on_create(create(order_id, side, price, volume), MSG_TIME, REC_TIME)
+
+    def delete(self, order_id):
+        self.book_state.on_delete({'order_id': order_id}, MSG_TIME, REC_TIME)
@@ -0,0 +1,174 @@
+import datetime as dt
+import glob
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from decimal import *
+
+import archive_sink
+from archive_sink import ArchiveSink, BOOK_SNAPSHOTS, TRADES, partition_dir
+from book_snapshots import BookSnapshot
+from numerics import FixedPointNumerics
+from trade import Trade
+from utils.utils import datetime_to_epoch_ns
+
+HOUR = dt.datetime(2023, 1, 12, 4)
+
+
+def make_trade(minutes, symbol="XBTZAR", numerics=None):
+    exchange_dt = HOUR + dt.timedelta(minutes=minutes)
+    trade = Trade(symbol, exchange_dt, exchange_dt + dt.timedelta(milliseconds=40), Decimal("305000.5"),
+                  Decimal("0.0123"), Decimal("3751.50615"))
+    if numerics:
+        trade = Trade(symbol, trade.exchange_timestamp, trade.received_timestamp, numerics.parse_price("305000.5"),
+                      numerics.parse_volume("0.0123"), numerics.parse_counter_volume("3751.50615"), numerics)
+    return trade
+
+
+def read_partition(root, kind, symbol, hour):
+    pa = archive_sink.pa
+    paths = sorted(glob.glob(os.path.join(partition_dir(root, kind, symbol, datetime_to_epoch_ns(hour)), '*.arrow')))
+    return paths, [pa.ipc.open_file(pa.memory_map(path)).read_all() for path in paths]
+
+
+@unittest.skipIf(archive_sink.pa is None, "pyarrow not installed")
+class ArchiveSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_trades_partitioned_by_symbol_and_hour(self):
+        sink = ArchiveSink(self.root, batch_rows=4)
+        for minutes in range(0, 120, 10):
+            sink.archive(make_trade(minutes))
+        sink.archive(make_trade(5, "ETHZAR", FixedPointNumerics()))
+        # the 04:00 XBTZAR hour was closed when 05:00 arrived, the rest are still being written
+        paths, tables = read_partition(self.root, TRADES, "XBTZAR", HOUR)
+        self.assertEqual([os.path.join(partition_dir(self.root, TRADES, "XBTZAR", datetime_to_epoch_ns(HOUR)),
+                                       'part-0000.arrow')], paths)
+        self.assertEqual(6, tables[0].num_rows)
+        self.assertEqual(1, sink.files_closed)
+        sink.close()
+
+        self.assertEqual(3, sink.files_closed)
+        self.assertEqual([], glob.glob(os.path.join(self.root, '**', '*.partial'), recursive=True))
+        _, tables = read_partition(self.root, TRADES, "XBTZAR", HOUR + dt.timedelta(hours=1))
+        table = tables[0]
+        self.assertEqual(6, table.num_rows)
+        self.assertEqual('8', table.schema.metadata[b'decimals'].decode())
+        self.assertEqual(datetime_to_epoch_ns(HOUR + dt.timedelta(hours=1)), table['exchange_timestamp'][0].value)
+        self.assertEqual([30500050000000], table['price'].to_pylist()[:1])
+        self.assertEqual([1230000], table['volume'].to_pylist()[:1])
+        self.assertEqual([375150615000], table['counter_volume'].to_pylist()[:1])
+        # fixed point trades archive the same values
+        _, tables = read_partition(self.root, TRADES, "ETHZAR", HOUR)
+        self.assertEqual([30500050000000], tables[0]['price'].to_pylist())
+        self.assertEqual([375150615000], tables[0]['counter_volume'].to_pylist())
+
+    def test_counter_volume_rounded_not_rejected(self):
+        numerics = FixedPointNumerics()
+        # price * volume carries the decimal places of both
+        precise = Trade("XBTZAR", HOUR, HOUR, numerics.parse_price("305000.12345678"),
+                        numerics.parse_volume("0.00012345"), numerics.parse_counter_volume("37.6522652395394910"),
+                        numerics)
+        sink = ArchiveSink(self.root)
+        sink.archive(precise)
+        sink.archive(make_trade(1, numerics=numerics))
+        sink.close()
+        self.assertEqual((2, 0, 1), (sink.rows_archived, sink.rows_rejected, sink.counter_volumes_rounded))
+        _, tables = read_partition(self.root, TRADES, "XBTZAR", HOUR)
+        self.assertEqual([3765226524, 375150615000], tables[0]['counter_volume'].to_pylist())
+        metadata = tables[0].schema.metadata
+        self.assertEqual((b'8', b'ROUND_HALF_EVEN'),
+                         (metadata[b'counter_volume_decimals'], metadata[b'counter_volume_rounding']))
+
+        # 16 places in an int64 would overflow on an ordinary trade
+        with self.assertRaises(ValueError):
+            ArchiveSink(self.root, counter_volume_decimals=16)
+        sink = ArchiveSink(os.path.join(self.root, 'nine'),
+                           counter_volume_decimals=archive_sink.MAX_COUNTER_VOLUME_DECIMALS)
+        sink.archive(precise)
+        sink.close()
+        _, tables = read_partition(os.path.join(self.root, 'nine'), TRADES, "XBTZAR", HOUR)
+        self.assertEqual([37652265240], tables[0]['counter_volume'].to_pylist())
+
+    def test_late_trade_reopens_hour_as_new_part(self):
+        sink = ArchiveSink(self.root)
+        sink.archive(make_trade(10))
+        sink.archive(make_trade(70))
+        sink.archive(make_trade(20))
+        sink.close()
+        paths, tables = read_partition(self.root, TRADES, "XBTZAR", HOUR)
+        self.assertEqual(['part-0000.arrow', 'part-0001.arrow'], [os.path.basename(path) for path in paths])
+        self.assertEqual([1, 1], [table.num_rows for table in tables])
+
+    def test_book_snapshots(self):
+        numerics = FixedPointNumerics()
+        snapshot = BookSnapshot("XBTZAR", 42, HOUR, HOUR,
+                                [(numerics.parse_price("100"), numerics.parse_volume("1.5"))],
+                                [(numerics.parse_price("101"), numerics.parse_volume("0.25")),
+                                 (numerics.parse_price("102"), numerics.parse_volume("2"))], numerics)
+        sink = ArchiveSink(self.root, compression=None)
+        sink.archive(snapshot)
+        sink.archive("not archivable")
+        sink.close()
+        _, tables = read_partition(self.root, BOOK_SNAPSHOTS, "XBTZAR", HOUR)
+        row = tables[0].to_pylist()[0]
+        self.assertEqual(42, row['sequence'])
+        self.assertEqual([10000000000], row['bid_prices'])
+        self.assertEqual([25000000, 200000000], row['ask_volumes'])
+        self.assertEqual({'rows_archived': 1, 'rows_rejected': 1, 'counter_volumes_rounded': 0, 'rows_failed': 0,
+                          'write_failures': 0, 'rows_buffered': 0, 'files_closed': 1, 'open_partitions': 0},
+                         sink.metrics())
+
+    def test_consume_forwards(self):
+        source, forward = queue.Queue(), queue.Queue()
+        trades = [make_trade(minutes) for minutes in range(5)]
+        for trade in trades:
+            source.put(trade)
+        shutdown_event, forwarded_event = threading.Event(), threading.Event()
+        shutdown_event.set()  # drain what's queued then exit
+        ArchiveSink(self.root).consume(source, shutdown_event, forward, forwarded_event)
+        self.assertTrue(forwarded_event.is_set())
+        self.assertEqual(trades, [forward.get_nowait() for _ in trades])
+        _, tables = read_partition(self.root, TRADES, "XBTZAR", HOUR)
+        self.assertEqual(5, tables[0].num_rows)
+
+    def test_archive_failures_dont_stop_forwarding(self):
+        source, forward = queue.Queue(), queue.Queue()
+        trades = [make_trade(minutes) for minutes in range(5)]
+        for trade in trades:
+            source.put(trade)
+        shutdown_event, forwarded_event = threading.Event(), threading.Event()
+        shutdown_event.set()
+        # the archive root can't be created, as its parent is a file
+        not_a_dir = os.path.join(self.root, 'not_a_dir')
+        open(not_a_dir, 'w').close()
+        sink = ArchiveSink(os.path.join(not_a_dir, 'archive'), batch_rows=2)
+        sink.consume(source, shutdown_event, forward, forwarded_event)
+        self.assertEqual(trades, [forward.get_nowait() for _ in trades])
+        self.assertTrue(forwarded_event.is_set())
+        metrics = sink.metrics()
+        self.assertEqual((5, 0), (metrics['rows_failed'], metrics['rows_buffered']))
+        self.assertGreater(metrics['write_failures'], 0)
+
+    def test_oversized_value_rejects_its_row(self):
+        sink = ArchiveSink(self.root)
+        huge = make_trade(1)
+        huge.counter_volume = Decimal("1E+12")
+        sink.archive(make_trade(0))
+        sink.archive(huge)
+        sink.archive(make_trade(2))
+        sink.close()
+        self.assertEqual((2, 1, 0), (sink.rows_archived, sink.rows_rejected, sink.rows_failed))
+        _, tables = read_partition(self.root, TRADES, "XBTZAR", HOUR)
+        self.assertEqual(2, tables[0].num_rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
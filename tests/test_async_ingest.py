@@ -0,0 +1,164 @@
+import asyncio
+import json
+import queue
+import threading
+import unittest
+
+from async_ingest import run_stream, AsyncCapture
+from benchmarks.synthetic import generate_frames
+from order_book_state import OrderBookState
+from stubs.luno_stream_stub import LunoStreamStub
+from ws_handlers import WebsocketCallbackHandlers
+
+CREDENTIALS = json.dumps({"api_key_id": "key", "api_key_secret": "secret"})
+
+
+class AsyncIngestTest(unittest.IsolatedAsyncioTestCase):
+    async def wait_for(self, condition, timeout=5.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition():
+            self.assertLess(asyncio.get_running_loop().time(), deadline, "timed out")
+            await asyncio.sleep(0.01)
+
+    async def test_dispatches_frames_into_book(self):
+        frames = generate_frames(200, depth=10)
+        book_state = OrderBookState(symbol="XBTZAR")
+        handlers = WebsocketCallbackHandlers(book_state)
+        async with LunoStreamStub([frames]) as stub:
+            task = asyncio.create_task(run_stream(stub.url + "XBTZAR", book_state, handlers, CREDENTIALS))
+            await self.wait_for(lambda: handlers.messages_received == len(frames))
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.assertEqual([CREDENTIALS], stub.credentials[:1])
+        self.assertEqual(len(frames), book_state.sequence_num)
+
+    async def test_reconnects_after_out_of_sequence(self):
+        first = generate_frames(50, depth=10)
+        # the second half of the first connection repeats sequence numbers, forcing a restart
+        first = first + first[20:]
+        second = generate_frames(50, depth=10, seed=2)
+        book_state = OrderBookState(symbol="XBTZAR")
+        handlers = WebsocketCallbackHandlers(book_state, background_resync=False)
+        async with LunoStreamStub([first, second]) as stub:
+            task = asyncio.create_task(run_stream(stub.url + "XBTZAR", book_state, handlers, CREDENTIALS,
+                                                  initial_backoff=0.01))
+            # the first connection is dropped at the out of sequence frame, the 52nd
+            await self.wait_for(lambda: handlers.messages_received == 52 + len(second))
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.assertFalse(book_state.out_of_sequence_restart)
+        self.assertEqual(1, handlers.resync.resyncs)
+        self.assertEqual(len(second), book_state.sequence_num)
+
+    async def test_reconnects_after_handler_error(self):
+        first = generate_frames(50, depth=10)
+        second = generate_frames(50, depth=10, seed=2)
+        book_state = OrderBookState(symbol="XBTZAR")
+        handlers = WebsocketCallbackHandlers(book_state, background_resync=False)
+        on_message = handlers.on_message
+
+        def fail_on_tenth(wsocket, message):
+            on_message(wsocket, message)
+            if handlers.messages_received == 10:
+                raise ValueError("handler failed")
+
+        handlers.on_message = fail_on_tenth
+        async with LunoStreamStub([first, second]) as stub:
+            with self.assertLogs(logger='async_ingest', level='ERROR') as logs:
+                task = asyncio.create_task(run_stream(stub.url + "XBTZAR", book_state, handlers, CREDENTIALS,
+                                                      initial_backoff=0.01))
+                # the first connection is abandoned at the error, and the stream carries on on a second one
+                await self.wait_for(lambda: handlers.messages_received == 10 + len(second))
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.assertIn("handler failed", "\n".join(logs.output))
+        self.assertEqual(2, len(stub.credentials))
+        self.assertEqual(len(second), book_state.sequence_num)
+
+    async def test_backoff_when_server_unavailable(self):
+        book_state = OrderBookState(symbol="XBTZAR")
+        handlers = WebsocketCallbackHandlers(book_state)
+        with self.assertLogs(logger='async_ingest', level='WARNING') as logs:
+            task = asyncio.create_task(run_stream("ws://127.0.0.1:9/api/1/stream/XBTZAR", book_state, handlers,
+                                                  CREDENTIALS, initial_backoff=0.1, max_backoff=0.3))
+            await self.wait_for(lambda: sum('reconnecting in' in line for line in logs.output) >= 4)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        waits = [float(line.rsplit('reconnecting in ', 1)[1].rstrip('s')) for line in logs.output
+                 if 'reconnecting in' in line]
+        # doubling each time, capped at max_backoff
+        self.assertEqual([0.1, 0.2, 0.3, 0.3], waits[:4])
+
+
+def expected_trades(symbol, frames):
+    """(exchange time, price, volume) of each trade when the frames are dispatched directly"""
+    trade_queue = queue.Queue()
+    handlers = WebsocketCallbackHandlers(OrderBookState(symbol=symbol, trade_queue=trade_queue))
+    for n, frame in enumerate(frames):
+        handlers.on_frame(None, frame, 1673496305654000000 + n)
+    return trade_keys(trade_queue)
+
+
+def trade_keys(trade_queue):
+    trades = []
+    while not trade_queue.empty():
+        trade = trade_queue.get_nowait()
+        trades.append((trade.symbol, trade.exchange_timestamp, trade.price, trade.volume))
+    return trades
+
+
+class AsyncCaptureTest(unittest.TestCase):
+    def test_many_symbols_on_one_loop(self):
+        frames = {symbol: generate_frames(100, depth=10, seed=seed)
+                  for seed, symbol in enumerate(('XBTZAR', 'ETHZAR', 'XRPZAR', 'LTCZAR'), start=1)}
+        ready = threading.Event()
+        stub_holder = {}
+
+        async def serve():
+            async with LunoStreamStub({symbol: [symbol_frames] for symbol, symbol_frames in frames.items()}) as stub:
+                stub_holder['stub'] = stub
+                ready.set()
+                while 'done' not in stub_holder:
+                    await asyncio.sleep(0.01)
+
+        server = threading.Thread(target=asyncio.run, args=(serve(),))
+        server.start()
+        ready.wait(timeout=5)
+        stub = stub_holder['stub']
+        trade_queue = queue.Queue()
+        capture = AsyncCapture(list(frames), trade_queue, url_template=stub.url + "{symbol}",
+                               credentials=CREDENTIALS)
+        shutdown_event = threading.Event()
+        runner = threading.Thread(target=capture.run, args=(shutdown_event,))
+        runner.start()
+        try:
+            for _ in range(1000):
+                if all(stream['messages'] == 101 for stream in capture.metrics().values()):
+                    break
+                threading.Event().wait(0.01)
+        finally:
+            capture.stop()
+            runner.join(timeout=5)
+            stub_holder['done'] = True
+            server.join(timeout=5)
+        self.assertTrue(shutdown_event.is_set())
+        self.assertEqual({symbol: 1 for symbol in frames}, stub.connections_by_symbol)
+
+        trades = trade_keys(trade_queue)
+        for symbol, symbol_frames in frames.items():
+            with self.subTest(symbol=symbol):
+                metrics = capture.metrics()[symbol]
+                self.assertEqual((101, 101), (metrics['messages'], metrics['sequence']))
+                expected_book = OrderBookState(symbol=symbol)
+                expected_handlers = WebsocketCallbackHandlers(expected_book)
+                for frame in symbol_frames:
+                    expected_handlers.on_frame(None, frame, 1673496305654000000)
+                self.assertEqual(expected_book.book, capture.streams[symbol].order_book_state.book)
+                # each symbol's trades, in order, are those of its own stream
+                expected = expected_trades(symbol, symbol_frames)
+                self.assertTrue(expected)
+                self.assertEqual(expected, [trade for trade in trades if trade[0] == symbol])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import queue
+import tempfile
+import unittest
+
+from backfill import backfill_log, output_path, run_backfill, symbol_for_log
+from benchmarks.synthetic import generate_frames
+from frame_log import FrameLogWriter
+from order_book_state import OrderBookState
+from trade_serializers import JsonTradeSerializer
+from ws_handlers import WebsocketCallbackHandlers
+
+START_NS = 1673496305654000000
+
+
+def recorded_frames(seed):
+    return [(START_NS + n * 1_000_000, frame.encode()) for n, frame in enumerate(generate_frames(2000, depth=20,
+                                                                                                 seed=seed))]
+
+
+def live_trades(symbol, frames):
+    """The published messages of the live path, with the trade queue drained by the publisher"""
+    trade_queue = queue.Queue()
+    handlers = WebsocketCallbackHandlers(OrderBookState(symbol=symbol, trade_queue=trade_queue),
+                                         background_resync=False)
+    for received_ns, frame in frames:
+        handlers.on_frame(None, frame, received_ns)
+    messages = []
+    while not trade_queue.empty():
+        messages.append(JsonTradeSerializer.encode(trade_queue.get_nowait()) + b'\n')
+    return b''.join(messages)
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = os.path.join(self.tmp_dir.name, 'out')
+        os.makedirs(self.output_dir)
+        self.logs = {}
+        for seed, symbol in enumerate(("XBTZAR", "ETHZAR", "XBTZAR"), start=1):
+            path = os.path.join(self.tmp_dir.name, f"{symbol}_2023011{seed}T000000.frames")
+            frames = recorded_frames(seed)
+            with FrameLogWriter(path, chunk_bytes=4096) as writer:
+                for received_ns, frame in frames:
+                    writer.append(frame, received_ns)
+            self.logs[path] = (symbol, frames)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_output(self, path):
+        with open(output_path(self.output_dir, path), 'rb') as f:
+            return f.read()
+
+    def test_matches_live_path(self):
+        path, (symbol, frames) = next(iter(self.logs.items()))
+        result = backfill_log(path, self.output_dir)
+        expected = live_trades(symbol, frames)
+        self.assertGreater(result.trades, 0)
+        self.assertEqual((symbol, len(frames), expected.count(b'\n')), (result.symbol, result.frames, result.trades))
+        self.assertEqual(expected, self.read_output(path))
+        self.assertEqual([os.path.basename(result.output)], os.listdir(self.output_dir))
+
+    def test_process_pool(self):
+        paths = list(self.logs)
+        results, wall_clock_secs = run_backfill(paths, self.output_dir, workers=2)
+        self.assertEqual(paths, [result.path for result in results])
+        self.assertGreater(wall_clock_secs, 0)
+        for path, (symbol, frames) in self.logs.items():
+            self.assertEqual(live_trades(symbol, frames), self.read_output(path))
+
+    def test_symbol_for_log(self):
+        self.assertEqual("XBTZAR", symbol_for_log("recordings/XBTZAR_20230112T040505.frames"))
+        with self.assertRaises(ValueError):
+            symbol_for_log("recording.frames")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import datetime as dt
+import json
+import queue
+import unittest
+from decimal import *
+
+from bars import Bar, BarPublisher, TIME_BARS, VOLUME_BARS
+from order_book_state import OrderBookState
+from sharded_capture import decode_bars, encode_bars
+
+START = dt.datetime(2023, 1, 12, 4, 5)
+MSG_BIDS = [{'id': 'bid_order1', 'price': '9.00000000', 'volume': '1.00'}]
+MSG_ASKS = [{'id': 'ask_order1', 'price': '11.00000000', 'volume': '1.00'}]
+NUMERIC_FIELDS = ('size', 'open', 'high', 'low', 'close', 'volume', 'counter_volume', 'vwap')
+
+
+class MakerOrder:
+    def __init__(self, price):
+        self.price = price
+
+
+class BarPublisherTest(unittest.TestCase):
+    def construct(self, intervals_secs=(60,), bar_volumes=(), fixed_point=False):
+        self.bar_queue = queue.Queue()
+        self.book_state = OrderBookState(symbol="XBTZAR", fixed_point=fixed_point)
+        self.publisher = BarPublisher(self.book_state, self.bar_queue, intervals_secs, bar_volumes)
+
+    def trade(self, seconds, price, volume):
+        numerics = self.book_state.numerics
+        price, volume = numerics.parse_price(price), numerics.parse_volume(volume)
+        counter_volume = numerics.parse_counter_volume(str(numerics.price_to_decimal(price) *
+                                                           numerics.volume_to_decimal(volume)))
+        exchange_dt = START + dt.timedelta(seconds=seconds)
+        self.book_state.trade_processor.on_trade("XBTZAR", MakerOrder(price), volume, counter_volume, exchange_dt,
+                                                 exchange_dt)
+
+    def drain(self):
+        bars = []
+        while not self.bar_queue.empty():
+            bar = self.bar_queue.get_nowait().to_dict()
+            # compare values, as Decimal and fixed point books format them differently, eg. '1E+2' and '100'
+            bars.append({name: Decimal(value) if name in NUMERIC_FIELDS else value for name, value in bar.items()})
+        return bars
+
+    def test_time_bars(self):
+        for fixed_point in (False, True):
+            with self.subTest(fixed_point=fixed_point):
+                self.construct(fixed_point=fixed_point)
+                self.trade(1, '100', '1')
+                self.trade(20, '102', '0.5')
+                self.trade(30, '99', '0.5')
+                self.trade(59, '101', '2')
+                self.assertEqual([], self.drain())
+                # the first trade of the next minute closes the bar
+                self.trade(61, '105', '1')
+                expected = {'symbol': 'XBTZAR', 'kind': TIME_BARS, 'size': 60,
+                            'start': '2023-01-12T04:05:00', 'end': '2023-01-12T04:06:00',
+                            'open': 100, 'high': 102, 'low': 99, 'close': 101, 'volume': 4,
+                            'counter_volume': Decimal('402.5'), 'vwap': Decimal('100.625'), 'trades': 4}
+                self.assertEqual([expected], self.drain())
+                # as does a book update after the end of the minute, without a trade
+                self.book_state.on_initial(MSG_BIDS, 'BID', START + dt.timedelta(seconds=119), START)
+                self.assertEqual([], self.drain())
+                self.book_state.on_initial(MSG_ASKS, 'ASK', START + dt.timedelta(seconds=120), START)
+                bars = self.drain()
+                self.assertEqual([('2023-01-12T04:06:00', 105, 1)],
+                                 [(bar['start'], bar['close'], bar['trades']) for bar in bars])
+                self.assertEqual(2, self.publisher.metrics()['bars_published'])
+
+    def test_volume_bars(self):
+        self.construct(intervals_secs=(), bar_volumes=("1.5",))
+        self.trade(1, '100', '1')
+        self.trade(2, '101', '0.25')
+        self.assertEqual([], self.drain())
+        self.trade(3, '99', '1')  # takes the bar over its threshold, it isn't split
+        self.trade(4, '98', '1.5')
+        bars = self.drain()
+        self.assertEqual([(VOLUME_BARS, Decimal('1.5'), Decimal('2.25'), 99, 3),
+                          (VOLUME_BARS, Decimal('1.5'), Decimal('1.5'), 98, 1)],
+                         [(bar['kind'], bar['size'], bar['volume'], bar['close'], bar['trades']) for bar in bars])
+        self.assertEqual('2023-01-12T04:05:01', bars[0]['start'])
+        self.assertEqual('2023-01-12T04:05:03', bars[0]['end'])
+        # without time bars the book updates aren't listened to
+        self.assertEqual([], self.book_state.update_listeners)
+
+    def test_full_queue_drops(self):
+        self.construct(intervals_secs=(), bar_volumes=("1",))
+        self.bar_queue = self.publisher.bar_queue = queue.Queue(maxsize=1)
+        for seconds in range(3):
+            self.trade(seconds, '100', '1')
+        self.assertEqual({'bars_published': 1, 'bars_dropped': 2}, self.publisher.metrics())
+
+    def test_round_trip(self):
+        self.construct(intervals_secs=(), bar_volumes=("1",), fixed_point=True)
+        self.trade(1, '100.5', '1')
+        bar = self.bar_queue.get_nowait()
+        self.assertEqual(bar.to_dict(), Bar.from_dict(json.loads(bar.to_json())).to_dict())
+        self.assertEqual([bar.to_dict()], [decoded.to_dict() for decoded in decode_bars(encode_bars([bar]))])
+        self.assertEqual(Decimal('100.5'), bar.vwap())
+
+
+if __name__ == '__main__':
+    unittest.main()
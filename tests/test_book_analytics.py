@@ -0,0 +1,174 @@
+import json
+import random
+import unittest
+from decimal import *
+
+from book_analytics import BookAnalytics, BookFeatures
+from sharded_capture import decode_book_features, encode_book_features
+from tests.book_fixtures import BookListenerTestMixin
+
+# ten levels a side around a mid of 1000, 0.1 (1 bps) apart, best first, and one far from the mid
+MSG_BIDS = [{'id': f'bid_order{n}', 'price': f'{999.9 - n / 10:.8f}', 'volume': f'{n + 1}.00'} for n in range(10)] + \
+    [{'id': 'far_bid', 'price': '900.00000000', 'volume': '5.00'}]
+MSG_ASKS = [{'id': f'ask_order{n}', 'price': f'{1000.1 + n / 10:.8f}', 'volume': '1.50'} for n in range(10)] + \
+    [{'id': 'far_ask', 'price': '1100.00000000', 'volume': '5.00'}]
+
+
+def expected_features(book_state, imbalance_depth, bands_bps):
+    """The features recomputed from the whole book, in Decimal"""
+    numerics = book_state.numerics
+    sides = {}
+    for side_of_book in ('BID', 'ASK'):
+        sides[side_of_book] = [(numerics.price_to_decimal(level.price), numerics.volume_to_decimal(level.quantity))
+                               for level in book_state.top_n(side_of_book, len(book_state.book[side_of_book]))]
+    (bid_price, bid_volume), (ask_price, ask_volume) = sides['BID'][0], sides['ASK'][0]
+    mid = (bid_price + ask_price) / 2
+    top = {side_of_book: levels[:imbalance_depth] for side_of_book, levels in sides.items()}
+    top_volume = {side_of_book: sum(volume for _, volume in levels) for side_of_book, levels in top.items()}
+    vwap = {side_of_book: sum(price * volume for price, volume in levels) / top_volume[side_of_book]
+            for side_of_book, levels in top.items()}
+    band_widths = [mid * Decimal(bps) / 10_000 for bps in bands_bps]
+    return {'mid': float(mid),
+            'microprice': float((bid_price * ask_volume + ask_price * bid_volume) / (bid_volume + ask_volume)),
+            'imbalance': float((top_volume['BID'] - top_volume['ASK']) / (top_volume['BID'] + top_volume['ASK'])),
+            'weighted_spread_bps': float((vwap['ASK'] - vwap['BID']) / mid * 10_000),
+            'bid_depth': [float(sum(volume for price, volume in sides['BID'] if price >= mid - band_width))
+                          for band_width in band_widths],
+            'ask_depth': [float(sum(volume for price, volume in sides['ASK'] if price <= mid + band_width))
+                          for band_width in band_widths]}
+
+
+class BookAnalyticsTest(BookListenerTestMixin, unittest.TestCase):
+    def construct(self, fixed_point=False, interval_secs=0, maxsize=0, imbalance_depth=3, bands_bps=(2, 5)):
+        self.analytics = self.construct_book(
+            lambda book_state, analytics_queue: BookAnalytics(book_state, analytics_queue,
+                                                              imbalance_depth=imbalance_depth, bands_bps=bands_bps,
+                                                              interval_secs=interval_secs),
+            MSG_BIDS, MSG_ASKS, fixed_point, maxsize)
+
+    def assertFeatures(self, imbalance_depth=3, bands_bps=(2, 5)):
+        features = self.analytics.features().to_dict()
+        expected = expected_features(self.book_state, imbalance_depth, bands_bps)
+        for name, value in expected.items():
+            if isinstance(value, list):
+                for actual, expected_value in zip(features[name], value):
+                    self.assertAlmostEqual(expected_value, actual, places=6, msg=name)
+            else:
+                self.assertAlmostEqual(value, features[name], places=6, msg=name)
+
+    def test_features(self):
+        for fixed_point in (False, True):
+            with self.subTest(fixed_point=fixed_point):
+                self.construct(fixed_point=fixed_point)
+                # only published once both sides are loaded
+                features = self.drain()
+                self.assertEqual(1, len(features))
+                self.assertEqual(1000.0, features[0].mid)
+                # bids within 2bps of the mid are the best two, 999.9 and 999.8
+                self.assertEqual([3.0, 15.0], features[0].bid_depth)
+                self.assertFeatures()
+
+    def test_band_edges_between_ticks(self):
+        # a mid half a tick above 1000, so neither 10bps edge is a whole tick, with a level a fraction of a tick
+        # outside each
+        bids = [{'id': 'best_bid', 'price': '1000.00000000', 'volume': '1.00'},
+                {'id': 'outside_bid', 'price': '999.00000000', 'volume': '2.00'}]
+        asks = [{'id': 'best_ask', 'price': '1000.00000001', 'volume': '1.00'},
+                {'id': 'outside_ask', 'price': '1001.00000001', 'volume': '2.00'}]
+        for fixed_point in (False, True):
+            with self.subTest(fixed_point=fixed_point):
+                self.analytics = self.construct_book(
+                    lambda book_state, analytics_queue: BookAnalytics(book_state, analytics_queue, imbalance_depth=1,
+                                                                      bands_bps=(10,), interval_secs=0),
+                    bids, asks, fixed_point)
+                features = self.analytics.features()
+                self.assertEqual(([1.0], [1.0]), (features.bid_depth, features.ask_depth))
+                self.assertFeatures(imbalance_depth=1, bands_bps=(10,))
+
+    def test_tracked_band_only(self):
+        self.construct()
+        self.drain()
+        recomputes = self.analytics.recomputes
+        # beyond both the widest band and the top three levels
+        self.create('deep_bid', 'BID', '950.00000000')
+        self.delete('far_ask')
+        self.assertEqual([], self.drain())
+        self.assertEqual((recomputes, 0), (self.analytics.recomputes, self.analytics.incremental_updates))
+
+        # volume added to a tracked level is applied as a delta
+        self.create('top_bid', 'BID', '999.80000000')
+        self.assertEqual(1, len(self.drain()))
+        self.assertEqual((recomputes, 1), (self.analytics.recomputes, self.analytics.incremental_updates))
+        self.assertFeatures()
+
+        # removing the best ask moves the mid, so the tracked levels are read again
+        self.delete('ask_order0')
+        self.assertEqual(1, len(self.drain()))
+        self.assertEqual(recomputes + 1, self.analytics.recomputes)
+        self.assertFeatures()
+
+    def test_random_updates_match_recomputed(self):
+        for fixed_point in (False, True):
+            with self.subTest(fixed_point=fixed_point):
+                self.construct(fixed_point=fixed_point)
+                rng = random.Random(7)
+                orders = {}
+                for n in range(500):
+                    if orders and rng.random() < 0.4:
+                        order_id = rng.choice(list(orders))
+                        del orders[order_id]
+                        self.delete(order_id)
+                    else:
+                        side = rng.choice(('BID', 'ASK'))
+                        offset = Decimal(rng.randint(1, 30)) / 10
+                        price = Decimal(1000) - offset if side == 'BID' else Decimal(1000) + offset
+                        order_id = f'order{n}'
+                        orders[order_id] = side
+                        self.create(order_id, side, f'{price:.8f}', f'{rng.randint(1, 9)}.25')
+                    self.assertFeatures()
+                self.assertGreater(self.analytics.incremental_updates, 0)
+
+    def test_coalesced_and_dropped(self):
+        self.construct(interval_secs=60)
+        self.assertEqual(1, len(self.drain()))
+        for n in range(5):
+            self.create(f'bid{n}', 'BID', '999.90000000')
+        self.assertEqual([], self.drain())
+
+        self.construct(maxsize=1)
+        for n in range(3):
+            self.create(f'bid{n}', 'BID', '999.90000000')
+        # one recompute after each side of the snapshot is loaded
+        self.assertEqual({'analytics_recomputes': 2, 'analytics_incremental_updates': 3, 'features_published': 1,
+                          'features_dropped': 3}, self.analytics.metrics())
+
+    def test_flush_publishes_held_back_features(self):
+        self.construct(interval_secs=60)
+        self.drain()
+        self.create('top_bid', 'BID', '999.90000000')
+        self.analytics.flush()
+        self.assertEqual([], self.drain())
+
+        self.analytics._next_due_ns = 0
+        self.analytics.flush()
+        features = self.drain()
+        self.assertEqual(1, len(features))
+        self.assertEqual(self.analytics.features().to_dict(), features[0].to_dict())
+        self.analytics.flush(force=True)
+        self.assertEqual([], self.drain())
+
+        # at shutdown, whether or not the interval's up
+        self.delete('top_bid')
+        self.analytics.flush(force=True)
+        self.assertEqual(1, len(self.drain()))
+
+    def test_round_trip(self):
+        self.construct(fixed_point=True)
+        features = self.drain()[0]
+        self.assertEqual(features.to_dict(), BookFeatures.from_dict(json.loads(features.to_json())).to_dict())
+        decoded = decode_book_features(encode_book_features([features]))
+        self.assertEqual([features.to_dict()], [decoded_features.to_dict() for decoded_features in decoded])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import io
+import subprocess
+import sys
+import unittest
+
+from book_renderer import TerminalBookRenderer, CLEAR_SCREEN, move_to
+from order_book_state import OrderBookState
+from tests.book_fixtures import MSG_BIDS, MSG_TIME, REC_TIME, create, load_book
+
+
+class TerminalBookRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.book_state = OrderBookState(symbol="XBTZAR")
+        load_book(self.book_state)
+        self.stream = io.StringIO()
+        self.renderer = TerminalBookRenderer(depth=5, max_fps=0, stream=self.stream)
+
+    def take_output(self):
+        output = self.stream.getvalue()
+        self.stream.seek(0)
+        self.stream.truncate()
+        return output
+
+    def test_first_frame_draws_everything(self):
+        self.renderer.render(self.book_state)
+        output = self.take_output()
+        self.assertTrue(output.startswith(CLEAR_SCREEN))
+        rows = self.renderer.format_rows(self.book_state)
+        self.assertEqual(7, len(rows))  # title, header and 5 levels
+        self.assertIn("9" + " " * 15 + "1" + " " * 14 + "11", rows[2])
+        self.assertEqual("", rows[5])  # only 3 levels a side
+        for n, row in enumerate(rows):
+            self.assertIn(move_to(n + 1) + row, output)
+
+    def test_only_changed_rows_redrawn(self):
+        self.renderer.render(self.book_state)
+        self.take_output()
+        self.book_state.on_create(create('new', 'ASK', '12.00000000', '0.5'), MSG_TIME, REC_TIME)
+        self.renderer.render(self.book_state)
+        output = self.take_output()
+        self.assertNotIn(CLEAR_SCREEN, output)
+        # the second ask level, and nothing else
+        self.assertIn(move_to(4), output)
+        self.assertIn("1.5", output)
+        for row in (1, 2, 3, 5, 6, 7):
+            self.assertNotIn(move_to(row), output)
+
+        self.renderer.render(self.book_state)
+        self.assertEqual("", self.take_output())
+
+    def test_frame_rate_capped(self):
+        renderer = TerminalBookRenderer(depth=5, max_fps=0.01, stream=self.stream)
+        renderer.render(self.book_state)
+        renderer.render(self.book_state)
+        self.assertEqual(1, renderer.frames_drawn)
+
+    def test_book_renders_through_renderer(self):
+        book_state = OrderBookState(symbol="XBTZAR", render_flag=True)
+        book_state.renderer.stream = self.stream
+        book_state.on_initial(MSG_BIDS, 'BID', MSG_TIME, REC_TIME)
+        self.assertIn("XBTZAR", self.take_output())
+
+    def test_capture_doesnt_import_pandas(self):
+        result = subprocess.run([sys.executable, '-c', 'import sys, ws_handlers; print("pandas" in sys.modules)'],
+                                capture_output=True, text=True, check=True)
+        self.assertEqual("False", result.stdout.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
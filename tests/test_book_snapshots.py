@@ -0,0 +1,95 @@
+import json
+import unittest
+from decimal import *
+
+from book_snapshots import BookSnapshot, TopOfBookPublisher
+from tests.book_fixtures import BookListenerTestMixin, ladder
+
+
+class TopOfBookPublisherTest(BookListenerTestMixin, unittest.TestCase):
+    def construct(self, depth=2, interval_secs=0, maxsize=0, fixed_point=False):
+        # four levels a side
+        self.publisher = self.construct_book(
+            lambda book_state, book_queue: TopOfBookPublisher(book_state, book_queue, depth=depth,
+                                                              interval_secs=interval_secs),
+            ladder('BID', 4), ladder('ASK', 4), fixed_point, maxsize)
+
+    def test_only_top_of_book_changes_publish(self):
+        self.construct(depth=2)
+        self.assertEqual(2, len(self.drain()))  # one per side of the snapshot
+
+        # deeper in the book than the top two levels
+        self.create('deep_bid', 'BID', '6.00000000')
+        self.create('deep_ask', 'ASK', '13.00000000')
+        self.delete('bid_order4')
+        self.assertEqual([], self.drain())
+
+        # volume added to the second best bid
+        self.create('top_bid', 'BID', '8.00000000')
+        # the best ask removed, so the third level moves up
+        self.delete('ask_order1')
+        snapshots = self.drain()
+        self.assertEqual(2, len(snapshots))
+        self.assertEqual([(Decimal('9'), Decimal('1')), (Decimal('8'), Decimal('1.5'))], snapshots[0].bids)
+        self.assertEqual([(Decimal('12'), Decimal('1')), (Decimal('13'), Decimal('1.5'))], snapshots[1].asks)
+        self.assertEqual(4, self.publisher.top_changes)
+
+    def test_bursts_coalesced(self):
+        self.construct(depth=2, interval_secs=60)
+        self.assertEqual(1, len(self.drain()))
+        for n in range(5):
+            self.create(f'bid{n}', 'BID', '9.00000000')
+        self.assertEqual([], self.drain())
+
+        # once the interval's up, the next update publishes the latest state, even if it's deep in the book
+        self.publisher._next_due_ns = 0
+        self.create('deep_bid', 'BID', '1.00000000')
+        snapshots = self.drain()
+        self.assertEqual(1, len(snapshots))
+        self.assertEqual((Decimal('9'), Decimal('3.5')), snapshots[0].bids[0])
+        self.assertEqual({'top_changes': 7, 'snapshots_published': 2, 'snapshots_dropped': 0},
+                         self.publisher.metrics())
+
+    def test_flush_publishes_held_back_snapshot(self):
+        self.construct(depth=2, interval_secs=60)
+        self.drain()
+        self.create('top_bid', 'BID', '9.00000000')
+        # nothing due and the book's gone quiet
+        self.publisher.flush()
+        self.assertEqual([], self.drain())
+
+        self.publisher._next_due_ns = 0
+        self.publisher.flush()
+        snapshots = self.drain()
+        self.assertEqual(1, len(snapshots))
+        self.assertEqual((Decimal('9'), Decimal('1.5')), snapshots[0].bids[0])
+        # nothing more to publish
+        self.publisher.flush(force=True)
+        self.assertEqual([], self.drain())
+
+        # at shutdown, whether or not the interval's up
+        self.delete('top_bid')
+        self.publisher.flush(force=True)
+        snapshots = self.drain()
+        self.assertEqual(1, len(snapshots))
+        self.assertEqual((Decimal('9'), Decimal('1')), snapshots[0].bids[0])
+
+    def test_full_queue_drops_without_blocking(self):
+        self.construct(depth=2, maxsize=1)
+        self.assertEqual(1, self.publisher.metrics()['snapshots_dropped'])
+        self.assertEqual(1, len(self.drain()))
+        # still pending, so the next update publishes even though it's deep in the book
+        self.create('deep_bid', 'BID', '1.00000000')
+        self.assertEqual(1, len(self.drain()))
+
+    def test_fixed_point_snapshot_round_trip(self):
+        self.construct(depth=3, fixed_point=True)
+        snapshot = self.drain()[-1]
+        values = json.loads(snapshot.to_json())
+        self.assertEqual([['9', '1'], ['8', '1'], ['7', '1']], values['bids'])
+        self.assertEqual([['11', '1'], ['12', '1'], ['13', '1']], values['asks'])
+        self.assertEqual(values, BookSnapshot.from_dict(values).to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from decimal import *
+
+from book_validator import BookValidator, CROSSED_BOOK, INDEX_MISMATCH, NON_POSITIVE_VOLUME, REGISTER_MISMATCH
+from tests.book_fixtures import BookListenerTestMixin
+
+
+class BookValidatorTest(BookListenerTestMixin, unittest.TestCase):
+    def construct(self, audit_interval_secs=None, fixed_point=False):
+        self.validator = self.construct_book(lambda book_state, _: BookValidator(book_state, audit_interval_secs),
+                                             fixed_point=fixed_point)
+
+    def test_valid_updates(self):
+        for fixed_point in (False, True):
+            with self.subTest(fixed_point=fixed_point):
+                self.construct(fixed_point=fixed_point)
+                self.create('new_bid', 'BID', '9.50000000')
+                self.delete('ask_order1')
+                self.assertEqual({}, self.validator.metrics()['violations'])
+                self.assertEqual(2, self.validator.levels_checked)
+                # the snapshot replaced whole sides, so was audited
+                self.assertEqual(2, self.validator.audits)
+                self.assertEqual({}, dict(self.validator.audit()))
+
+    def test_touched_level_checked(self):
+        self.construct()
+        # a level left in the book with no volume
+        self.book_state.book['BID']['9'] = Decimal(0)
+        self.book_state.level_listeners[-1]('BID', Decimal('9'))
+        self.create('deep_ask', 'ASK', '20.00000000')
+        self.assertEqual({NON_POSITIVE_VOLUME: 1}, self.validator.metrics()['violations'])
+
+        # and a level removed from the book but not the index
+        del self.book_state.book['ASK']['2E+1']
+        self.book_state.level_listeners[-1]('ASK', Decimal('2E+1'))
+        self.create('deep_ask2', 'ASK', '21.00000000')
+        self.assertEqual(1, self.validator.violations[INDEX_MISMATCH])
+
+    def test_crossed_book(self):
+        self.construct()
+        self.create('crossing_bid', 'BID', '12.00000000')
+        self.assertEqual({CROSSED_BOOK: 1}, self.validator.metrics()['violations'])
+
+    def test_audit_reconciles_register(self):
+        self.construct()
+        del self.book_state.book_by_order_register['ask_order2']
+        self.book_state.book_by_order_register['bid_order1'].volume = Decimal('2')
+        self.assertEqual({REGISTER_MISMATCH: 2}, dict(self.validator.audit()))
+
+    def test_periodic_audit(self):
+        self.construct(audit_interval_secs=3600)
+        audits = self.validator.audits
+        self.create('new_bid', 'BID', '9.50000000')
+        self.assertEqual(audits, self.validator.audits)
+        self.validator._next_audit_ns = 0
+        self.create('new_bid2', 'BID', '9.50000000')
+        self.assertEqual(audits + 1, self.validator.audits)
+
+
+if __name__ == '__main__':
+    unittest.main()
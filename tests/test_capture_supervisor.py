@@ -0,0 +1,99 @@
+import queue
+import threading
+import time
+import unittest
+
+from benchmarks.synthetic import generate_frames
+from capture_supervisor import CaptureSupervisor
+
+
+class StandInStream:
+    """Replaces start_ws: dispatches synthetic frames to the stream's callbacks then finishes"""
+    def __init__(self, frames_per_symbol):
+        self.frames_per_symbol = frames_per_symbol
+        self.urls = []
+
+    def __call__(self, url, order_book, callbacks, finished_event):
+        self.urls.append(url)
+        for n, frame in enumerate(self.frames_per_symbol[order_book.symbol]):
+            callbacks.on_frame(None, frame, 1673496305654000000 + n)
+        finished_event.set()
+
+
+class CaptureSupervisorTest(unittest.TestCase):
+    def test_streams_share_one_trade_queue(self):
+        frames = {'XBTZAR': generate_frames(300, depth=10, seed=1),
+                  'ETHZAR': generate_frames(300, depth=10, seed=2)}
+        trade_queue = queue.Queue()
+        stand_in = StandInStream(frames)
+        supervisor = CaptureSupervisor(['XBTZAR', 'ETHZAR'], trade_queue, start_stream=stand_in)
+        shutdown_event = threading.Event()
+        supervisor.run(shutdown_event)
+
+        self.assertTrue(shutdown_event.is_set())
+        self.assertEqual(['wss://ws.luno.com/api/1/stream/ETHZAR', 'wss://ws.luno.com/api/1/stream/XBTZAR'],
+                         sorted(stand_in.urls))
+        metrics = supervisor.metrics()
+        self.assertEqual(301, metrics['XBTZAR']['messages'])
+        self.assertEqual(301, metrics['ETHZAR']['sequence'])
+        self.assertFalse(metrics['XBTZAR']['running'])
+
+        trades = []
+        while not trade_queue.empty():
+            trades.append(trade_queue.get_nowait())
+        self.assertEqual(metrics['XBTZAR']['trades'] + metrics['ETHZAR']['trades'], len(trades))
+        self.assertEqual({'XBTZAR', 'ETHZAR'}, {trade.symbol for trade in trades})
+
+    def test_shutdown_waits_for_every_stream(self):
+        release = threading.Event()
+
+        def slow_stream(url, order_book, callbacks, finished_event):
+            if order_book.symbol == 'ETHZAR':
+                release.wait()
+            finished_event.set()
+
+        supervisor = CaptureSupervisor(['XBTZAR', 'ETHZAR'], queue.Queue(), start_stream=slow_stream)
+        shutdown_event = threading.Event()
+        runner = threading.Thread(target=supervisor.run, args=(shutdown_event,))
+        runner.start()
+        time.sleep(0.2)
+        self.assertFalse(shutdown_event.is_set())
+        release.set()
+        runner.join(timeout=5)
+        self.assertTrue(shutdown_event.is_set())
+
+    def test_quiet_book_snapshot_flushed(self):
+        frames = generate_frames(300, depth=10, seed=1)
+        applied, release = threading.Event(), threading.Event()
+
+        def quiet_stream(url, order_book, callbacks, finished_event):
+            for n, frame in enumerate(frames):
+                callbacks.on_frame(None, frame, 1673496305654000000 + n)
+            applied.set()
+            # then nothing more, as on a quiet symbol
+            release.wait()
+            finished_event.set()
+
+        book_queue = queue.Queue()
+        supervisor = CaptureSupervisor(['XBTZAR'], queue.Queue(), start_stream=quiet_stream, book_queue=book_queue,
+                                       book_interval_secs=0.5)
+        runner = threading.Thread(target=supervisor.run, args=(threading.Event(),))
+        runner.start()
+        try:
+            self.assertTrue(applied.wait(timeout=5))
+            # the last top of book change is held back by the interval, and goes out on the timer
+            deadline = time.monotonic() + 5
+            last = None
+            while time.monotonic() < deadline and (last is None or last.sequence != 301):
+                try:
+                    last = book_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.assertEqual(301, last.sequence)
+        finally:
+            release.set()
+            runner.join(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
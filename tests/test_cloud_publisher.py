@@ -0,0 +1,127 @@
+import datetime as dt
+import json
+import queue
+import threading
+import unittest
+from concurrent.futures import Future
+from decimal import *
+
+from gcp.cloud_publisher import GcpRePublisher
+from trade import Trade
+
+
+class StandInPublisherClient:
+    """Records publishes and resolves their futures when release() is called, or immediately with auto_resolve.
+    Publishes of fail_data fail, the first fail_times of them when it's given"""
+    def __init__(self, auto_resolve=True, fail_data=None, fail_times=None):
+        self.auto_resolve = auto_resolve
+        self.fail_data = fail_data
+        self.fail_times = fail_times
+        self.published = []
+        self.pending = []
+        self.resumed = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def topic_path(project_id, topic_id):
+        return f"projects/{project_id}/topics/{topic_id}"
+
+    def publish(self, topic, data, ordering_key="", **attrs):
+        future = Future()
+        with self.lock:
+            self.published.append(data)
+            self.pending.append((future, data))
+        if self.auto_resolve:
+            self.release()
+        return future
+
+    def release(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for future, data in pending:
+            if data == self.fail_data and (self.fail_times is None or self.fail_times > 0):
+                if self.fail_times is not None:
+                    self.fail_times -= 1
+                future.set_exception(RuntimeError("publish failed"))
+            else:
+                future.set_result(str(len(self.published)))
+
+    def resume_publish(self, topic, ordering_key):
+        self.resumed.append(ordering_key)
+
+
+def make_trade(n):
+    return Trade("XBTZAR", dt.datetime(2022, 1, 12, 4, 5, 5), dt.datetime(2022, 1, 12, 4, 5, 6),
+                 Decimal(n), Decimal("0.5"), Decimal(n) / 2)
+
+
+class GcpRePublisherTest(unittest.TestCase):
+    def run_consumer(self, publisher, trades):
+        trade_queue = queue.Queue()
+        for trade in trades:
+            trade_queue.put(trade)
+        shutdown_event = threading.Event()
+        shutdown_event.set()  # drain what's queued then exit
+        publisher.consume_and_republish(trade_queue, shutdown_event)
+
+    def test_publishes_everything_in_order(self):
+        client = StandInPublisherClient()
+        publisher = GcpRePublisher(publisher=client, max_batch=7)
+        self.run_consumer(publisher, [make_trade(n) for n in range(1, 51)])
+        self.assertEqual([str(n) for n in range(1, 51)], [json.loads(data)['price'] for data in client.published])
+        self.assertEqual(50, publisher.stats.published)
+        self.assertEqual(0, publisher.stats.in_flight)
+
+    def test_in_flight_is_bounded(self):
+        client = StandInPublisherClient(auto_resolve=False)
+        publisher = GcpRePublisher(publisher=client, max_in_flight=3)
+        consumer = threading.Thread(target=self.run_consumer, args=(publisher, [make_trade(n) for n in range(10)]))
+        consumer.start()
+        while consumer.is_alive():
+            consumer.join(timeout=0.05)
+            self.assertLessEqual(len(client.pending), 3)
+            client.release()
+        self.assertEqual(10, publisher.stats.published)
+        self.assertEqual(3, publisher.stats.max_in_flight)
+
+    def test_failed_publish_resumes_ordering_key(self):
+        failing = make_trade(2).to_json().encode("utf-8")
+        client = StandInPublisherClient(fail_data=failing)
+        publisher = GcpRePublisher(publisher=client, max_retries=0)
+        self.run_consumer(publisher, [make_trade(n) for n in range(1, 4)])
+        self.assertEqual(2, publisher.stats.published)
+        self.assertEqual(1, publisher.stats.failed)
+        self.assertEqual(["luno"], client.resumed)
+
+    def test_failed_publish_retried(self):
+        failing = make_trade(2).to_json().encode("utf-8")
+        client = StandInPublisherClient(fail_data=failing, fail_times=2)
+        publisher = GcpRePublisher(publisher=client, max_retries=3)
+        self.run_consumer(publisher, [make_trade(n) for n in range(1, 4)])
+        # published again after each failure, with the key resumed first
+        self.assertEqual([failing] * 3, [data for data in client.published if data == failing])
+        self.assertEqual(["luno", "luno"], client.resumed)
+        self.assertEqual(3, publisher.stats.published)
+        self.assertEqual(2, publisher.stats.retried)
+        self.assertEqual(0, publisher.stats.failed)
+        self.assertEqual(0, publisher.stats.in_flight)
+
+    def test_retries_bounded(self):
+        failing = make_trade(2).to_json().encode("utf-8")
+        client = StandInPublisherClient(auto_resolve=False, fail_data=failing)
+        publisher = GcpRePublisher(publisher=client, max_retries=2, max_in_flight=1)
+        consumer = threading.Thread(target=self.run_consumer, args=(publisher, [make_trade(n) for n in range(1, 4)]))
+        consumer.start()
+        while consumer.is_alive():
+            consumer.join(timeout=0.05)
+            client.release()
+        # the first attempt and two retries
+        self.assertEqual(3, len([data for data in client.published if data == failing]))
+        self.assertEqual(2, publisher.stats.published)
+        self.assertEqual(2, publisher.stats.retried)
+        self.assertEqual(1, publisher.stats.failed)
+        self.assertEqual(0, publisher.stats.in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
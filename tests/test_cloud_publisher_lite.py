@@ -0,0 +1,56 @@
+import json
+import queue
+import threading
+import unittest
+from concurrent.futures import Future
+
+from gcp.cloud_publisher_lite import GcpRePublisherLite
+from tests.test_cloud_publisher import make_trade
+
+
+class StandInLitePublisherClient:
+    def __init__(self):
+        self.published = []
+        self.entered = 0
+        self.exited = 0
+
+    def __enter__(self):
+        self.entered += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.exited += 1
+
+    def publish(self, topic, data, **attrs):
+        self.published.append(data)
+        future = Future()
+        future.set_result("message id")
+        return future
+
+
+class GcpRePublisherLiteTest(unittest.TestCase):
+    def test_one_client_for_all_messages(self):
+        client = StandInLitePublisherClient()
+        clients_made = []
+
+        def client_factory():
+            clients_made.append(client)
+            return client
+
+        publisher = GcpRePublisherLite(client_factory=client_factory, max_batch=4)
+        trade_queue = queue.Queue()
+        for n in range(1, 21):
+            trade_queue.put(make_trade(n))
+        shutdown_event = threading.Event()
+        shutdown_event.set()
+        publisher.consume_and_republish(trade_queue, shutdown_event)
+
+        self.assertEqual(1, len(clients_made))
+        self.assertEqual((1, 1), (client.entered, client.exited))
+        self.assertEqual([str(n) for n in range(1, 21)], [json.loads(data)['price'] for data in client.published])
+        self.assertEqual(20, publisher.stats.published)
+        self.assertEqual(0, publisher.stats.in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import json
+import unittest
+from decimal import *
+
+from decoders import available_decoders, get_decoder
+from order_book_state import OrderBookState
+from ws_handlers import WebsocketCallbackHandlers
+
+FRAME_INITIAL = json.dumps({'sequence': '100', 'timestamp': 1673496305654,
+                            'asks': [{'id': 'ask_order1', 'price': '1.00000000', 'volume': '0.01'}],
+                            'bids': [{'id': 'bid_order1', 'price': '0.80000000', 'volume': '0.01'}]})
+FRAME_CREATE = json.dumps({'sequence': '101', 'timestamp': 1673496305655,
+                           'create_update': {'order_id': 'bid_order2', 'type': 'BID', 'price': '0.90000000',
+                                             'volume': '1.50'}})
+FRAME_TRADE = json.dumps({'sequence': '102', 'timestamp': 1673496305656,
+                          'trade_updates': [{'base': '0.005', 'counter': '0.005', 'maker_order_id': 'ask_order1',
+                                             'taker_order_id': 'BXDSJ2B8VQHU7VG', 'order_id': 'ask_order1'}]})
+FRAME_DELETE = json.dumps({'sequence': '103', 'timestamp': 1673496305657,
+                           'delete_update': {'order_id': 'bid_order1'}})
+FRAME_EMPTY = json.dumps({'sequence': '104', 'timestamp': 1673496305658})
+
+
+class _NullSocket:
+    def close(self):
+        pass
+
+
+class DecodersTest(unittest.TestCase):
+    def test_decoders_agree(self):
+        for decoder in available_decoders():
+            with self.subTest(decoder=decoder.name):
+                msg = decoder.decode(FRAME_CREATE)
+                self.assertEqual(101, int(msg.sequence))
+                self.assertEqual(1673496305655, msg.timestamp)
+                self.assertEqual('bid_order2', msg.create_update.get('order_id'))
+                self.assertEqual('0.90000000', msg.create_update['price'])
+                self.assertIsNone(msg.trade_updates)
+
+                msg = decoder.decode(FRAME_INITIAL)
+                self.assertEqual('ask_order1', msg.asks[0]['id'])
+                self.assertIsNone(msg.delete_update)
+
+    def test_get_decoder(self):
+        self.assertEqual('json', get_decoder('json').name)
+        self.assertEqual(available_decoders()[0].name, get_decoder().name)
+        with self.assertRaises(ValueError):
+            get_decoder('no_such_decoder')
+
+    def test_dispatch_with_each_decoder(self):
+        for decoder in available_decoders():
+            with self.subTest(decoder=decoder.name):
+                book_state = OrderBookState(symbol="DummySymbol")
+                handlers = WebsocketCallbackHandlers(book_state, decoder=decoder)
+                for frame in (FRAME_INITIAL, FRAME_CREATE, FRAME_TRADE, FRAME_DELETE, FRAME_EMPTY):
+                    handlers.on_message(_NullSocket(), frame)
+                self.assertEqual(104, book_state.sequence_num)
+                self.assertEqual({'0.9': Decimal('1.5')}, book_state.book['BID'])
+                self.assertEqual({'1': Decimal('0.005')}, book_state.book['ASK'])
+
+
+if __name__ == '__main__':
+    unittest.main()
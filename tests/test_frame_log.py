@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+import unittest
+
+import frame_log
+from benchmarks.synthetic import generate_frames
+from frame_log import FrameLogWriter, FrameLogReader
+from order_book_state import OrderBookState
+from replay import replay
+from ws_handlers import WebsocketCallbackHandlers
+
+FRAMES = [(1673496305654000000, b'{"sequence": "1", "timestamp": 1673496305654}'),
+          (1673496305655000000, '{"sequence": "2", "timestamp": 1673496305655}'),
+          (1673496305656000000, b'')]
+
+
+class FrameLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'test.frames')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, frames, **kwargs):
+        with FrameLogWriter(self.path, **kwargs) as writer:
+            for received_ns, frame in frames:
+                writer.append(frame, received_ns)
+
+    def test_round_trip(self):
+        self.write(FRAMES, chunk_bytes=64)
+        expected = [(ns, frame if isinstance(frame, bytes) else frame.encode()) for ns, frame in FRAMES]
+        self.assertEqual(expected, list(FrameLogReader(self.path)))
+
+    @unittest.skipIf(frame_log.zstandard is None, "zstandard not installed")
+    def test_compressed_round_trip(self):
+        frames = [(ns, frame.encode()) for ns, frame in enumerate(generate_frames(500, depth=20))]
+        self.write(frames, compress=True, chunk_bytes=4096)
+        self.assertEqual(frames, list(FrameLogReader(self.path)))
+        self.assertLess(os.path.getsize(self.path), sum(len(frame) for _, frame in frames) / 2)
+
+    def test_truncated_tail_is_ignored(self):
+        self.write(FRAMES[:2], chunk_bytes=1)
+        with open(self.path, 'ab') as f:
+            f.write(b'\x10\x00\x00\x00\x10\x00\x00\x00partial')
+        with self.assertLogs(logger='frame_log', level='WARNING'):
+            self.assertEqual(2, len(list(FrameLogReader(self.path))))
+
+    def test_replay_matches_live_dispatch(self):
+        frames = [(1673496305654000000 + n, frame.encode()) for n, frame in enumerate(generate_frames(1000, depth=20))]
+        live_book = OrderBookState(symbol="XBTZAR")
+        live_handlers = WebsocketCallbackHandlers(live_book)
+        for received_ns, frame in frames:
+            live_handlers.on_frame(None, frame, received_ns)
+
+        self.write(frames)
+        replayed_book = OrderBookState(symbol="XBTZAR")
+        stats = replay(FrameLogReader(self.path), WebsocketCallbackHandlers(replayed_book))
+        self.assertEqual(len(frames), stats.frames)
+        self.assertEqual(live_book.book, replayed_book.book)
+        self.assertEqual(live_book.sequence_num, replayed_book.sequence_num)
+
+    def test_replay_at_speed(self):
+        frames = [(n * 10_000_000, frame.encode()) for n, frame in enumerate(generate_frames(10, depth=5))]
+        start = time.perf_counter()
+        replay(frames, WebsocketCallbackHandlers(OrderBookState(symbol="XBTZAR")), speed=2.0)
+        # 100ms of recording at 2x speed
+        self.assertGreaterEqual(time.perf_counter() - start, 0.045)
+
+
+if __name__ == '__main__':
+    unittest.main()
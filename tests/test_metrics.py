@@ -0,0 +1,100 @@
+import random
+import unittest
+import urllib.error
+import urllib.request
+
+from benchmarks.synthetic import generate_frames
+from metrics import Histogram, MetricsRegistry, MetricsServer, REGISTRY, MAX_TRACKABLE_NS
+from order_book_state import OrderBookState
+from replay import ReplaySocket
+from ws_handlers import WebsocketCallbackHandlers
+
+
+class HistogramTest(unittest.TestCase):
+    def test_percentiles_within_precision(self):
+        histogram = Histogram('test')
+        rng = random.Random(1)
+        values = sorted(rng.randint(1, 10 ** 9) for _ in range(10000))
+        for value in values:
+            histogram.record(value)
+        self.assertEqual(len(values), histogram.count)
+        self.assertEqual(sum(values), histogram.total)
+        for fraction in (0.5, 0.9, 0.99, 0.999):
+            expected = values[int(len(values) * fraction + 0.5) - 1]
+            self.assertAlmostEqual(expected, histogram.percentile(fraction), delta=expected / 64)
+        self.assertAlmostEqual(values[-1], histogram.max, delta=values[-1] / 64)
+
+    def test_small_values_exact(self):
+        histogram = Histogram('test', thread_safe=True)
+        for value in (0, 1, 2, 3, 127):
+            histogram.record(value)
+        self.assertEqual(2, histogram.percentile(0.5))
+        self.assertEqual(127, histogram.max)
+
+    def test_out_of_range_clamped(self):
+        histogram = Histogram('test')
+        histogram.record(-5)
+        histogram.record(MAX_TRACKABLE_NS * 2)
+        self.assertEqual(0, histogram.percentile(0.5))
+        self.assertEqual(MAX_TRACKABLE_NS, histogram.max)
+        histogram.reset()
+        self.assertEqual(0, histogram.count)
+        self.assertEqual(0, histogram.percentile(0.99))
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.decode = self.registry.histogram('decode', "Decoding a frame", symbol="XBTZAR")
+        for value in range(1000, 2000):
+            self.decode.record(value)
+
+    def test_get_or_create(self):
+        self.assertIs(self.decode, self.registry.histogram('decode', symbol="XBTZAR"))
+        self.assertIsNot(self.decode, self.registry.histogram('decode', symbol="ETHZAR"))
+
+    def test_prometheus_text(self):
+        self.registry.histogram('decode', symbol="ETHZAR").record(10)
+        lines = self.registry.prometheus_text().splitlines()
+        self.assertEqual(1, lines.count("# TYPE decode_seconds summary"))
+        self.assertIn('decode_seconds_count{symbol="XBTZAR"} 1000', lines)
+        self.assertIn('decode_seconds_count{symbol="ETHZAR"} 1', lines)
+        quantile = [line for line in lines if line.startswith('decode_seconds{symbol="XBTZAR",quantile="0.5"}')]
+        self.assertAlmostEqual(1.5e-6, float(quantile[0].split()[1]), delta=1.5e-6 / 64)
+
+    def test_summary_line(self):
+        self.registry.histogram('unused')
+        self.assertEqual("decode[XBTZAR] n=1000 p50=1.5us p99=2.0us max=2.0us", self.registry.summary_line())
+
+    def test_http_endpoint(self):
+        server = MetricsServer(self.registry, port=0).start()
+        try:
+            # localhost only by default
+            self.assertEqual("127.0.0.1", server.host)
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                self.assertEqual(200, response.status)
+                self.assertEqual(self.registry.prometheus_text(), response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
+        finally:
+            server.stop()
+
+
+class PipelineMetricsTest(unittest.TestCase):
+    def test_on_frame_records_stages(self):
+        frames = generate_frames(50, depth=20, seed=3)
+        handlers = WebsocketCallbackHandlers(OrderBookState(symbol="METRICS"))
+        wsocket = ReplaySocket()
+        for frame in frames:
+            handlers.on_frame(wsocket, frame, 1673496305654000000)
+        self.assertEqual(len(frames), handlers.decode_time.count)
+        self.assertEqual(len(frames), handlers.receive_latency.count)
+        self.assertEqual(1, handlers.book_update_time['snapshot'].count)
+        updates = sum(handlers.book_update_time[update_type].count for update_type in ('trade', 'create', 'delete'))
+        self.assertGreaterEqual(updates, len(frames) - 1)
+        self.assertIn('book_update_seconds_count{symbol="METRICS",type="snapshot"} 1',
+                      REGISTRY.prometheus_text().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from decimal import *
+
+from numerics import parse_scaled, FixedPointNumerics, DecimalNumerics, numerics_for_symbol
+
+
+class NumericsTest(unittest.TestCase):
+    def test_parse_scaled(self):
+        self.assertEqual(100000000, parse_scaled('1.00000000', 8))
+        self.assertEqual(125, parse_scaled('1.25', 2))
+        self.assertEqual(120, parse_scaled('1.2', 2))
+        self.assertEqual(5, parse_scaled('.05', 2))
+        self.assertEqual(-150, parse_scaled('-1.5', 2))
+        self.assertEqual(1200, parse_scaled('12', 2))
+        self.assertEqual(150, parse_scaled('1.50000000', 2))
+        self.assertEqual(150, parse_scaled('1.5E+0', 2))
+
+    def test_parse_scaled_rejects_lost_precision(self):
+        with self.assertRaises(ValueError):
+            parse_scaled('1.001', 2)
+        with self.assertRaises(ValueError):
+            parse_scaled('1E-3', 2)
+
+    def test_fixed_point_round_trip(self):
+        numerics = FixedPointNumerics(price_decimals=8, volume_decimals=8)
+        self.assertEqual(Decimal('0.8'), numerics.price_to_decimal(numerics.parse_price('0.80000000')))
+        self.assertEqual(Decimal('2.02'), numerics.volume_to_decimal(numerics.parse_volume('2.02')))
+        self.assertEqual(Decimal('499.82016'),
+                         numerics.counter_volume_to_decimal(numerics.parse_counter_volume('499.8201600000000000')))
+
+    def test_numerics_for_symbol(self):
+        self.assertIsInstance(numerics_for_symbol('XBTZAR'), DecimalNumerics)
+        self.assertIsInstance(numerics_for_symbol('XBTZAR', fixed_point=True), FixedPointNumerics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
+import queue
 import unittest
+from unittest import mock
 from decimal import *
 
-from order_book_state import OrderBookState
+from order_book_state import OrderBookState, BookLevel, OrderRecord, Side
 import datetime as dt
 
 MSG_ASKS_INITIAL_BASIC = [
@@ -45,8 +47,8 @@ class OrderBookStateTest(unittest.TestCase):
         self.tnow = dt.datetime.now()
         self.msg_time = self.tnow - dt.timedelta(seconds=5)
 
-    def construct_book(self, msg_bid, msg_ask):
-        book = OrderBookState(symbol="DummySymbol")
+    def construct_book(self, msg_bid, msg_ask, fixed_point=False):
+        book = OrderBookState(symbol="DummySymbol", fixed_point=fixed_point)
         book.on_initial(initial_msg=msg_bid, side_of_book='BID', msg_time=self.msg_time,
                         rec_time=self.tnow)
         book.on_initial(initial_msg=msg_ask, side_of_book='ASK', msg_time=self.msg_time,
@@ -68,6 +70,21 @@ class OrderBookStateTest(unittest.TestCase):
         self.assertEqual({'0.8': Decimal('0.01'), '0.7': Decimal('2.02')}, bid_side)
         self.assertEqual({'1': Decimal('0.01'), '1.25': Decimal('2.02')}, ask_side)
 
+    def test_order_register_records(self):
+        book_state = self.construct_book(MSG_BIDS_INITIAL_BASIC, MSG_ASKS_INITIAL_BASIC)
+        order = book_state.book_by_order_register.get('bid_order2')
+        self.assertIsInstance(order, OrderRecord)
+        self.assertEqual(Side.BID, order.side)
+        self.assertEqual(Decimal('0.7'), order.price)
+        self.assertEqual(Decimal('2.02'), order.volume)
+        self.assertEqual(int(self.msg_time.replace(tzinfo=dt.timezone.utc).timestamp()) * 1_000_000_000
+                         + self.msg_time.microsecond * 1000, order.exchange_timestamp)
+
+        footprint = book_state.memory_footprint()
+        self.assertEqual(4, footprint['resting_orders'])
+        self.assertEqual(4, footprint['price_levels'])
+        self.assertGreater(footprint['bytes_per_resting_order'], 0)
+
     def test_initial_price_levels_summed(self):
         book_state = self.construct_book(MSG_BIDS_INITIAL_SAME_LEVEL, MSG_ASKS_INITIAL_SAME_LEVEL)
         bid_side = book_state.book.get('BID')
@@ -142,6 +159,77 @@ class OrderBookStateTest(unittest.TestCase):
         self.assertEqual({'0.7': Decimal('2.02')}, bid_side)
         self.assertEqual({'1': Decimal('0.01'), '1.25': Decimal('2.02')}, ask_side)
 
+    def test_top_of_book_queries(self):
+        book_state = self.construct_book(MSG_BIDS_INITIAL_BASIC, MSG_ASKS_INITIAL_BASIC)
+        self.assertEqual(BookLevel(Decimal('0.8'), Decimal('0.01'), 'BID'), book_state.best_bid())
+        self.assertEqual(BookLevel(Decimal('1'), Decimal('0.01'), 'ASK'), book_state.best_ask())
+        self.assertEqual(Decimal('0.2'), book_state.spread())
+
+        book_state.on_create(create_msg=MSG_CREATE_BID, msg_time=self.msg_time, rec_time=self.tnow)
+        book_state.on_create(create_msg=MSG_CREATE_ASK, msg_time=self.msg_time, rec_time=self.tnow)
+        self.assertEqual([Decimal('0.9'), Decimal('0.8'), Decimal('0.7')],
+                         [level.price for level in book_state.top_n('BID', 5)])
+        self.assertEqual([Decimal('0.95'), Decimal('1')], [level.price for level in book_state.top_n('ASK', 2)])
+        self.assertEqual(Decimal('0.05'), book_state.spread())
+
+    def test_top_of_book_after_levels_removed(self):
+        book_state = self.construct_book(MSG_BIDS_INITIAL_BASIC, MSG_ASKS_INITIAL_BASIC)
+        book_state.on_delete(delete_msg=MSG_DELETE, msg_time=self.msg_time, rec_time=self.tnow)
+        book_state.on_trade(trade_msg=MSG_TRADE_ALL_MAKER, msg_time=self.msg_time, rec_time=self.tnow)
+        self.assertEqual(BookLevel(Decimal('0.7'), Decimal('2.02'), 'BID'), book_state.best_bid())
+        self.assertEqual(BookLevel(Decimal('1.25'), Decimal('2.02'), 'ASK'), book_state.best_ask())
+        self.assertEqual([Decimal('1.25')], [level.price for level in book_state.top_n('ASK', 10)])
+
+        book_state.on_delete(delete_msg={'order_id': 'ask_order2'}, msg_time=self.msg_time, rec_time=self.tnow)
+        self.assertIsNone(book_state.best_ask())
+        self.assertIsNone(book_state.spread())
+
+    def test_fixed_point_book(self):
+        trade_queue = queue.Queue()
+        book_state = OrderBookState(symbol="DummySymbol", trade_queue=trade_queue, fixed_point=True)
+        book_state.on_initial(initial_msg=MSG_BIDS_INITIAL_BASIC, side_of_book='BID', msg_time=self.msg_time,
+                              rec_time=self.tnow)
+        book_state.on_initial(initial_msg=MSG_ASKS_INITIAL_BASIC, side_of_book='ASK', msg_time=self.msg_time,
+                              rec_time=self.tnow)
+        book_state.on_create(create_msg=MSG_CREATE_BID2, msg_time=self.msg_time, rec_time=self.tnow)
+        self.assertEqual({80000000: 2000000, 70000000: 202000000}, book_state.book.get('BID'))
+        self.assertEqual({100000000: 1000000, 125000000: 202000000}, book_state.book.get('ASK'))
+        self.assertEqual(20000000, book_state.spread())
+
+        book_state.on_trade(trade_msg=MSG_TRADE_SOME, msg_time=self.msg_time, rec_time=self.tnow)
+        self.assertEqual({100000000: 888000, 125000000: 202000000}, book_state.book.get('ASK'))
+        trade = trade_queue.get_nowait()
+        self.assertEqual({'price': '1', 'volume': '0.00112', 'counter_volume': '499.82016'},
+                         {k: v for k, v in trade.to_dict().items() if k in ('price', 'volume', 'counter_volume')})
+
+        book_state.on_delete(delete_msg=MSG_DELETE2, msg_time=self.msg_time, rec_time=self.tnow)
+        self.assertEqual({80000000: 1000000, 70000000: 202000000}, book_state.book.get('BID'))
+
+    @mock.patch('order_book_state.MAX_BOOK_DEPTH', 2)
+    def test_initial_truncated_to_complete_levels(self):
+        # unsorted, with several orders at the last level kept on each side
+        bids = [{'id': 'bid_order1', 'price': '0.70000000', 'volume': '1.0'},
+                {'id': 'bid_order2', 'price': '0.90000000', 'volume': '1.0'},
+                {'id': 'bid_order3', 'price': '0.80000000', 'volume': '1.0'},
+                {'id': 'bid_order4', 'price': '0.80000000', 'volume': '0.5'}]
+        asks = [{'id': 'ask_order1', 'price': '1.10000000', 'volume': '1.0'},
+                {'id': 'ask_order2', 'price': '1.30000000', 'volume': '1.0'},
+                {'id': 'ask_order3', 'price': '1.20000000', 'volume': '1.0'},
+                {'id': 'ask_order4', 'price': '1.20000000', 'volume': '0.5'}]
+        for fixed_point in (False, True):
+            with self.subTest(fixed_point=fixed_point):
+                book_state = self.construct_book(bids, asks, fixed_point=fixed_point)
+                numerics = book_state.numerics
+                self.assertEqual([(Decimal('0.9'), Decimal('1')), (Decimal('0.8'), Decimal('1.5'))],
+                                 [(numerics.price_to_decimal(level.price), numerics.volume_to_decimal(level.quantity))
+                                  for level in book_state.top_n('BID', 5)])
+                self.assertEqual([(Decimal('1.1'), Decimal('1')), (Decimal('1.2'), Decimal('1.5'))],
+                                 [(numerics.price_to_decimal(level.price), numerics.volume_to_decimal(level.quantity))
+                                  for level in book_state.top_n('ASK', 5)])
+                # orders at the levels dropped aren't in the register either
+                self.assertEqual({'bid_order2', 'bid_order3', 'bid_order4', 'ask_order1', 'ask_order3', 'ask_order4'},
+                                 set(book_state.book_by_order_register))
+
     # def test_initial_msg_when_corrupt(self):
     #     pass
 
@@ -0,0 +1,109 @@
+import json
+import queue
+import time
+import unittest
+
+from benchmarks.synthetic import generate_frames
+from order_book_state import OrderBookState
+from replay import ReplaySocket
+from ws_handlers import WebsocketCallbackHandlers
+
+
+def offset_sequences(frames, offset):
+    shifted = []
+    for frame in frames:
+        msg = json.loads(frame)
+        msg['sequence'] = str(int(msg['sequence']) + offset)
+        shifted.append(json.dumps(msg))
+    return shifted
+
+
+def feed(handlers, frames, wsocket=None):
+    wsocket = wsocket or ReplaySocket()
+    for n, frame in enumerate(frames):
+        handlers.on_frame(wsocket, frame, 1673496305654000000 + n)
+    return wsocket
+
+
+def book_contents(book_state):
+    return ({side: dict(levels) for side, levels in book_state.book.items()},
+            set(book_state.book_by_order_register), book_state.sequence_num)
+
+
+class BookResyncTest(unittest.TestCase):
+    def setUp(self):
+        self.first = generate_frames(100, depth=20, seed=1)
+        # the stream carries on from a later sequence number after the reconnect
+        self.second = offset_sequences(generate_frames(100, depth=20, seed=2), 200)
+        expected_state = OrderBookState(symbol="XBTZAR")
+        feed(WebsocketCallbackHandlers(expected_state), self.second)
+        self.expected = book_contents(expected_state)
+
+    def test_reconnect_snapshot_replaces_book(self):
+        book_state = OrderBookState(symbol="XBTZAR")
+        handlers = WebsocketCallbackHandlers(book_state, background_resync=False)
+        feed(handlers, self.first + self.second)
+        self.assertEqual(self.expected, book_contents(book_state))
+        self.assertEqual(1, handlers.resync.resyncs)
+        self.assertFalse(handlers.resync.active)
+
+    def test_out_of_sequence_update_is_not_applied(self):
+        book_state = OrderBookState(symbol="XBTZAR")
+        handlers = WebsocketCallbackHandlers(book_state, background_resync=False)
+        feed(handlers, self.first)
+        before = book_contents(book_state)
+
+        wsocket = feed(handlers, [self.first[10]] + self.first[50:60])
+        self.assertEqual(1, wsocket.closed_count)
+        self.assertTrue(book_state.out_of_sequence_restart)
+        self.assertTrue(handlers.resync.active)
+        # the live book holds its last good state until the new snapshot is swapped in
+        self.assertEqual(before, book_contents(book_state))
+
+        feed(handlers, self.second)
+        self.assertEqual(self.expected, book_contents(book_state))
+        metrics = handlers.resync.metrics()
+        self.assertEqual(1, metrics['resyncs'])
+        self.assertEqual(201 - 101, metrics['last_missed'])
+        self.assertGreater(handlers.resync.last_gap_ns, 0)
+
+    def test_deltas_buffered_while_snapshot_loads(self):
+        trade_queue = queue.Queue()
+        book_state = OrderBookState(symbol="XBTZAR", trade_queue=trade_queue)
+        handlers = WebsocketCallbackHandlers(book_state)
+        feed(handlers, self.first)
+        trades_before = book_state.trade_processor.trades_processed
+
+        feed(handlers, self.second[:-1])
+        # the last frame goes to the live book if the resync has completed by then, or is buffered if not
+        feed(handlers, self.second[-1:])
+        self.wait_for_resync(handlers)
+        self.assertEqual(self.expected, book_contents(book_state))
+        # trades in the buffered deltas went out through the live book's trade processor
+        expected_trades = sum(len(json.loads(frame).get('trade_updates') or []) for frame in self.second)
+        self.assertEqual(trades_before + expected_trades, book_state.trade_processor.trades_processed)
+
+    def test_completes_without_another_frame(self):
+        book_state = OrderBookState(symbol="XBTZAR")
+        updates = []
+        book_state.update_listeners.append(lambda book, msg_time, rec_time: updates.append(book.sequence_num))
+        handlers = WebsocketCallbackHandlers(book_state)
+        feed(handlers, self.first)
+        updates.clear()
+
+        # the snapshot and deltas on the new connection, then nothing more
+        feed(handlers, self.second)
+        self.wait_for_resync(handlers)
+        self.assertEqual(self.expected, book_contents(book_state))
+        # the update listeners see the adopted book
+        self.assertEqual(self.expected[2], updates[-1])
+
+    def wait_for_resync(self, handlers, timeout=5):
+        deadline = time.monotonic() + timeout
+        while handlers.resync.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(handlers.resync.active)
+
+
+if __name__ == '__main__':
+    unittest.main()
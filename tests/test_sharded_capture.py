@@ -0,0 +1,103 @@
+import datetime as dt
+import queue
+import threading
+import time
+import unittest
+from decimal import *
+
+from benchmarks.synthetic import generate_frames
+from sharded_capture import ShardedCapture, shard_symbols, encode_trades, decode_trades
+from trade import Trade
+
+SEEDS = {'XBTZAR': 1, 'ETHZAR': 2, 'XRPZAR': 3}
+
+
+def synthetic_stream(url, order_book, callbacks, finished_event):
+    # stands in for start_ws in the worker processes, so must be importable at module level
+    for n, frame in enumerate(generate_frames(200, depth=10, seed=SEEDS[order_book.symbol])):
+        callbacks.on_frame(None, frame, 1673496305654000000 + n)
+    finished_event.set()
+
+
+class StubSocket:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def endless_stream(url, order_book, callbacks, finished_event):
+    # a connection that stays open, sending nothing more after its snapshot, until it's closed
+    callbacks.wsocket = StubSocket()
+    callbacks.on_frame(None, generate_frames(0, depth=10, seed=SEEDS[order_book.symbol])[0], 1673496305654000000)
+    callbacks.wsocket.closed.wait()
+    finished_event.set()
+
+
+class ShardedCaptureTest(unittest.TestCase):
+    def test_shard_symbols(self):
+        self.assertEqual([['A', 'C', 'E'], ['B', 'D']], shard_symbols(['A', 'B', 'C', 'D', 'E'], 2))
+        self.assertEqual([['A'], ['B']], shard_symbols(['A', 'B'], 4))
+
+    def test_trade_batch_round_trip(self):
+        trades = [Trade("XBTZAR", dt.datetime(2022, 1, 12, 4, 5, 5, n), dt.datetime(2022, 1, 12, 4, 5, 6),
+                        Decimal(446270 + n), Decimal("0.0011"), Decimal("490.897")) for n in range(5)]
+        self.assertEqual([trade.to_dict() for trade in trades],
+                         [trade.to_dict() for trade in decode_trades(encode_trades(trades))])
+
+    def test_workers_funnel_trades_to_one_queue(self):
+        trade_queue = queue.Queue()
+        capture = ShardedCapture(list(SEEDS), trade_queue, workers=2, start_stream=synthetic_stream)
+        shutdown_event = threading.Event()
+        capture.run(shutdown_event)
+        self.assertTrue(shutdown_event.is_set())
+
+        trades = []
+        while not trade_queue.empty():
+            trades.append(trade_queue.get_nowait())
+        report = capture.report()
+        self.assertEqual(len(trades), sum(report[worker]['trades_forwarded'] for worker in report))
+        self.assertEqual(set(SEEDS), {trade.symbol for trade in trades})
+        self.assertEqual({201}, {stream['messages'] for worker in report.values()
+                                 for stream in worker['streams'].values()})
+        self.assertFalse(any(worker['alive'] for worker in report.values()))
+
+    def test_stop_ends_every_worker(self):
+        book_queue = queue.Queue()
+        capture = ShardedCapture(list(SEEDS), queue.Queue(), workers=2, start_stream=endless_stream,
+                                 book_queue=book_queue, book_interval_secs=0)
+        shutdown_event = threading.Event()
+        runner = threading.Thread(target=capture.run, args=(shutdown_event,))
+        runner.start()
+        # every stream is connected once its snapshot has been forwarded
+        symbols = set()
+        while symbols != set(SEEDS):
+            symbols.add(book_queue.get(timeout=30).symbol)
+        started = time.monotonic()
+        capture.stop()
+        runner.join(timeout=30)
+        self.assertFalse(runner.is_alive())
+        self.assertLess(time.monotonic() - started, 10)  # closed by stop(), not the timeout
+        self.assertTrue(shutdown_event.is_set())
+        self.assertFalse(any(worker['alive'] for worker in capture.report().values()))
+
+    def test_workers_forward_book_snapshots(self):
+        book_queue = queue.Queue()
+        capture = ShardedCapture(list(SEEDS), queue.Queue(), workers=2, start_stream=synthetic_stream,
+                                 book_queue=book_queue, book_depth=5, book_interval_secs=0)
+        capture.run(threading.Event())
+
+        snapshots = []
+        while not book_queue.empty():
+            snapshots.append(book_queue.get_nowait())
+        self.assertEqual(set(SEEDS), {snapshot.symbol for snapshot in snapshots})
+        self.assertTrue(all(len(snapshot.bids) <= 5 and len(snapshot.asks) <= 5 for snapshot in snapshots))
+        self.assertEqual(0, capture.book_snapshots_dropped)
+        forwarded = sum(stream['snapshots_published'] for worker in capture.report().values()
+                        for stream in worker['streams'].values())
+        self.assertEqual(forwarded, len(snapshots))
+
+
+if __name__ == '__main__':
+    unittest.main()
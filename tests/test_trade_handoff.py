@@ -0,0 +1,157 @@
+import datetime as dt
+import json
+import queue
+import threading
+import unittest
+from decimal import *
+
+from gcp.cloud_publisher import GcpRePublisher
+from tests.test_cloud_publisher import StandInPublisherClient
+from trade import Trade, TradeProcessor
+from trade_handoff import (CoalescingHandoff, DropOldestHandoff, SpillToDiskHandoff, make_trade_handoff,
+                           SPILL_READ_BYTES)
+
+EXCHANGE_TIME = dt.datetime(2022, 1, 12, 4, 5, 5)
+
+
+def make_trade(n, symbol="XBTZAR", price=None):
+    exchange_dt = EXCHANGE_TIME + dt.timedelta(seconds=n)
+    return Trade(symbol, exchange_dt, exchange_dt + dt.timedelta(milliseconds=40),
+                 Decimal(price if price is not None else n), Decimal("0.5"), Decimal(n) / 2)
+
+
+def drain(handoff):
+    items = []
+    while True:
+        try:
+            items.append(handoff.get_nowait())
+        except queue.Empty:
+            return items
+
+
+class TradeHandoffTest(unittest.TestCase):
+    def test_drop_oldest(self):
+        handoff = DropOldestHandoff(maxsize=3)
+        for n in range(1, 6):
+            handoff.put(make_trade(n))
+        self.assertEqual(3, handoff.qsize())
+        self.assertEqual([Decimal(n) for n in (3, 4, 5)], [trade.price for trade in drain(handoff)])
+        self.assertEqual({'strategy': 'drop_oldest', 'stream': 'trades', 'depth': 0, 'max_depth': 3, 'puts': 5,
+                          'dropped': 2}, handoff.metrics())
+        self.assertTrue(handoff.empty())
+
+    def test_coalesce_same_price(self):
+        handoff = CoalescingHandoff(maxsize=2)
+        handoff.put(make_trade(1, "ETHZAR", price=7))
+        handoff.put(make_trade(2, price=100))
+        handoff.put(make_trade(3, price=100))
+        handoff.put(make_trade(4, price=100))
+        trades = drain(handoff)
+        self.assertEqual(["ETHZAR", "XBTZAR"], [trade.symbol for trade in trades])
+        merged = trades[1]
+        self.assertEqual(Decimal("1.5"), merged.volume)
+        self.assertEqual(Decimal(9) / 2, merged.counter_volume)
+        self.assertEqual(EXCHANGE_TIME + dt.timedelta(seconds=4), merged.exchange_timestamp)
+        self.assertEqual(2, handoff.coalesced)
+        self.assertEqual(0, handoff.dropped)
+
+    def test_coalesce_drops_oldest_when_price_differs(self):
+        handoff = CoalescingHandoff(maxsize=2)
+        for n in range(1, 4):
+            handoff.put(make_trade(n))
+        self.assertEqual([Decimal(2), Decimal(3)], [trade.price for trade in drain(handoff)])
+        self.assertEqual(1, handoff.dropped)
+        # the newest trade was taken, so a trade at its price can't be merged into it any more
+        handoff.put(make_trade(4, price=3))
+        handoff.put(make_trade(5, price=3))
+        self.assertEqual(2, handoff.qsize())
+        self.assertEqual(0, handoff.coalesced)
+
+    def test_spill_keeps_order(self):
+        handoff = SpillToDiskHandoff(maxsize=5)
+        trades = [make_trade(n) for n in range(1, 101)]
+        for trade in trades:
+            trade.queued_ns = int(trade.price)
+            handoff.put(trade)
+        self.assertEqual(100, handoff.qsize())
+        self.assertEqual(95, handoff.spilled)
+        # interleave more puts with the consumer catching up
+        taken = [handoff.get() for _ in range(50)]
+        for n in range(101, 121):
+            trade = make_trade(n)
+            trades.append(trade)
+            handoff.put(trade)
+        taken += drain(handoff)
+        self.assertEqual([trade.to_dict() for trade in trades], [trade.to_dict() for trade in taken])
+        self.assertEqual(list(range(1, 101)), [trade.queued_ns for trade in taken[:100]])
+        self.assertEqual(0, handoff.metrics()['spill_bytes'])
+        # back to memory once the spill file's drained
+        handoff.put(make_trade(121))
+        self.assertEqual(115, handoff.spilled)
+        handoff.close()
+
+    def test_spill_reads_in_chunks(self):
+        handoff = SpillToDiskHandoff(maxsize=1)
+        count = SPILL_READ_BYTES // 40 * 2
+        for n in range(count):
+            handoff.put(make_trade(n))
+        self.assertEqual(list(range(count)), [int(trade.price) for trade in drain(handoff)])
+        handoff.close()
+
+    def test_spill_while_consuming(self):
+        handoff = SpillToDiskHandoff(maxsize=10)
+        count = 5000
+        taken = []
+
+        def consume():
+            while len(taken) < count:
+                taken.append(handoff.get(timeout=5))
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for n in range(count):
+            handoff.put(make_trade(n))
+        consumer.join(timeout=30)
+        self.assertEqual(list(range(count)), [int(trade.price) for trade in taken])
+        self.assertGreater(handoff.spilled, 0)
+        self.assertEqual(0, handoff.metrics()['spill_bytes'])
+        handoff.close()
+
+    def test_streams_measured_separately(self):
+        trades = make_trade_handoff('drop_oldest', maxsize=2)
+        snapshots = make_trade_handoff('drop_oldest', maxsize=2, stream='book_snapshots')
+        self.assertIsNot(trades.put_time, snapshots.put_time)
+        self.assertEqual({'strategy': 'drop_oldest', 'stream': 'book_snapshots'}, snapshots.put_time.labels)
+
+    def test_get_times_out(self):
+        handoff = make_trade_handoff('drop_oldest', maxsize=2)
+        with self.assertRaises(queue.Empty):
+            handoff.get(timeout=0.01)
+        with self.assertRaises(ValueError):
+            make_trade_handoff('block')
+
+    def test_publisher_consumes_handoff(self):
+        handoff = make_trade_handoff('spill', maxsize=4)
+        for n in range(1, 21):
+            handoff.put(make_trade(n))
+        client = StandInPublisherClient()
+        shutdown_event = threading.Event()
+        shutdown_event.set()  # drain what's queued then exit
+        GcpRePublisher(publisher=client, max_batch=3).consume_and_republish(handoff, shutdown_event)
+        self.assertEqual([str(n) for n in range(1, 21)], [json.loads(data)['price'] for data in client.published])
+        handoff.close()
+
+
+class TradeProcessorTest(unittest.TestCase):
+    def test_full_queue_drops_rather_than_blocks(self):
+        processor = TradeProcessor(queue.Queue(maxsize=1))
+        for n in range(3):
+            order = make_trade(n)
+            processor.on_trade("XBTZAR", order, order.volume, order.counter_volume, EXCHANGE_TIME, EXCHANGE_TIME)
+        self.assertEqual(3, processor.trades_processed)
+        self.assertEqual(2, processor.trades_dropped)
+        self.assertIsNotNone(processor.trade_queue.get_nowait().queued_ns)
+
+
+if __name__ == '__main__':
+    unittest.main()
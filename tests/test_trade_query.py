@@ -0,0 +1,146 @@
+import datetime as dt
+import glob
+import os
+import tempfile
+import unittest
+from decimal import *
+
+import trade_query
+from trade_query import np
+from archive_sink import ArchiveSink
+from trade import Trade
+from trade_query import TradeQuery, INDEX_SUFFIX
+from utils.utils import datetime_to_epoch_ns
+
+START = dt.datetime(2023, 1, 12, 4)
+# (minutes after START, price, volume)
+TRADES = [(0, "100", "1"), (0.5, "102", "2"), (1, "101", "1"), (1.5, "99", "0.5"), (59, "98", "1"),
+          (61, "97", "3"), (125, "105", "0.25")]
+
+
+def make_trade(minutes, price, volume, symbol="XBTZAR"):
+    exchange_dt = START + dt.timedelta(minutes=minutes)
+    return Trade(symbol, exchange_dt, exchange_dt + dt.timedelta(milliseconds=40), Decimal(price), Decimal(volume),
+                 Decimal(price) * Decimal(volume))
+
+
+@unittest.skipIf(trade_query.np is None, "numpy and pyarrow not installed")
+class TradeQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        sink = ArchiveSink(self.tmp.name, compression=None)
+        for minutes, price, volume in TRADES:
+            sink.archive(make_trade(minutes, price, volume))
+        sink.archive(make_trade(30, "5000", "1", "ETHZAR"))
+        # a late trade, archived as a second part of the first hour
+        sink.archive(make_trade(2, "103", "1"))
+        sink.close()
+        self.query = TradeQuery(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_trades_in_range(self):
+        trades = self.query.trades("XBTZAR", START + dt.timedelta(minutes=1), START + dt.timedelta(minutes=61))
+        self.assertEqual([101, 99, 103, 98], trades.price.tolist())
+        self.assertEqual([1, 0.5, 1, 1], trades.volume.tolist())
+        self.assertEqual(datetime_to_epoch_ns(START + dt.timedelta(minutes=1)), trades.exchange_timestamp[0])
+        # the later hours were skipped using their index, without being read
+        self.assertEqual(2, self.query.files_skipped)
+        self.assertEqual(8, len(self.query.trades("XBTZAR")))
+        self.assertEqual(0, len(self.query.trades("XBTZAR", START - dt.timedelta(hours=1), START)))
+        self.assertEqual(0, len(self.query.trades("LTCZAR")))
+
+    def test_index_sidecars(self):
+        files = self.query.files("XBTZAR")
+        self.assertEqual(4, len(files))
+        # written by the sink as each file was closed
+        self.assertTrue(all(os.path.exists(path + INDEX_SUFFIX) for path in files))
+        index = self.query.file_index(files[0])
+        self.assertEqual({'rows': 5, 'min_exchange_ns': datetime_to_epoch_ns(START),
+                          'max_exchange_ns': datetime_to_epoch_ns(START + dt.timedelta(minutes=59))}, index)
+
+        # without them the index is worked out, and kept in memory rather than written into the archive
+        for path in glob.glob(os.path.join(self.tmp.name, '**', '*' + INDEX_SUFFIX), recursive=True):
+            os.remove(path)
+        query = TradeQuery(self.tmp.name)
+        self.assertEqual(index, query.file_index(files[0]))
+        self.assertEqual(4, len(query.trades("XBTZAR", START + dt.timedelta(minutes=1),
+                                             START + dt.timedelta(minutes=61))))
+        self.assertEqual([], glob.glob(os.path.join(self.tmp.name, '**', '*' + INDEX_SUFFIX), recursive=True))
+
+    def test_mixed_decimals(self):
+        # a later hour archived with more decimals than the rest
+        sink = ArchiveSink(self.tmp.name, compression=None, decimals=10, counter_volume_decimals=9)
+        sink.archive(make_trade(180, "106.0000000001", "1"))
+        sink.close()
+        trades = self.query.trades("XBTZAR")
+        self.assertEqual(9, len(trades))
+        self.assertEqual(106.0000000001, trades.price[-1])
+        (price, counter_volume), decimals = self.query._load("XBTZAR", None, None, ('price', 'counter_volume'))
+        self.assertEqual(({'price': 10, 'volume': 10, 'counter_volume': 9}, np.int64, np.int64),
+                         (decimals, price.dtype, counter_volume.dtype))
+        self.assertEqual(1000000000000, price[0])
+
+    def test_vwap(self):
+        expected = sum(Decimal(price) * Decimal(volume) for _, price, volume in TRADES[:4]) / \
+            sum(Decimal(volume) for _, _, volume in TRADES[:4])
+        self.assertAlmostEqual(float(expected), self.query.vwap("XBTZAR", START, START + dt.timedelta(minutes=2)))
+        self.assertIsNone(self.query.vwap("LTCZAR"))
+
+    def test_counter_volume_scale(self):
+        root = os.path.join(self.tmp.name, 'exact')
+        sink = ArchiveSink(root, compression=None, counter_volume_decimals=9)
+        for minutes, price, volume in TRADES[:4]:
+            sink.archive(make_trade(minutes, price, volume))
+        sink.close()
+        query = TradeQuery(root)
+        self.assertEqual(self.query.vwap("XBTZAR", START, START + dt.timedelta(minutes=2)),
+                         query.vwap("XBTZAR", START, START + dt.timedelta(minutes=2)))
+        self.assertEqual([100, 204, 101, 49.5], query.trades("XBTZAR").counter_volume.tolist())
+        self.assertEqual([304, 150.5], query.ohlcv("XBTZAR").counter_volume.tolist())
+
+    def test_sums_dont_wrap_around(self):
+        root = os.path.join(self.tmp.name, 'big')
+        sink = ArchiveSink(root, compression=None, counter_volume_decimals=9)
+        # ten counter volumes of 10^9, each fits an int64 at 9 places but their sum doesn't
+        for minutes in range(10):
+            sink.archive(make_trade(minutes, "1000000", "1000"))
+        sink.close()
+        query = TradeQuery(root)
+        self.assertEqual(1000000, query.vwap("XBTZAR"))
+        self.assertEqual([1e10], query.ohlcv("XBTZAR", interval=dt.timedelta(hours=1)).counter_volume.tolist())
+
+    def test_rescale_overflow_raises(self):
+        root = os.path.join(self.tmp.name, 'overflow')
+        sink = ArchiveSink(root, compression=None)
+        sink.archive(make_trade(0, "10000000000", "0.00000001"))
+        sink.close()
+        sink = ArchiveSink(root, compression=None, decimals=10)
+        sink.archive(make_trade(70, "100", "1"))
+        sink.close()
+        with self.assertRaises(ValueError):
+            TradeQuery(root).trades("XBTZAR")
+
+    def test_reads_only_needed_columns(self):
+        path = self.query.files("XBTZAR")[0]
+        table = self.query._read(path, ('exchange_timestamp', 'volume'))
+        self.assertEqual(['exchange_timestamp', 'volume'], table.column_names)
+        self.assertEqual(b'8', table.schema.metadata[b'decimals'])
+
+    def test_ohlcv(self):
+        bars = self.query.ohlcv("XBTZAR", START, START + dt.timedelta(hours=2), dt.timedelta(minutes=1))
+        self.assertEqual([0, 1, 2, 59, 61],
+                         [(start - datetime_to_epoch_ns(START)) // 60_000_000_000 for start in bars.start.tolist()])
+        first = bars.to_dicts()[0]
+        self.assertEqual({'open': 100, 'high': 102, 'low': 100, 'close': 102, 'volume': 3, 'trades': 2},
+                         {name: first[name] for name in ('open', 'high', 'low', 'close', 'volume', 'trades')})
+        self.assertAlmostEqual(304 / 3, first['vwap'])
+        hourly = self.query.ohlcv("XBTZAR", interval=dt.timedelta(hours=1))
+        self.assertEqual([6, 1, 1], hourly.trades.tolist())
+        self.assertEqual([98, 97, 105], hourly.close.tolist())
+        self.assertEqual(0, len(self.query.ohlcv("LTCZAR")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import datetime as dt
+import unittest
+from decimal import *
+
+from numerics import FixedPointNumerics
+from trade import Trade
+from trade_serializers import BinaryTradeSerializer, JsonTradeSerializer, serializer_for_encoding
+
+
+class TradeSerializersTest(unittest.TestCase):
+    def setUp(self):
+        self.tnow = dt.datetime(2022, 1, 12, 4, 5, 6, 123456, None)
+        self.msg_time = dt.datetime(2022, 1, 12, 4, 5, 5, 654321, None)
+        self.trade = Trade(symbol="XBTZAR", exchange_dt=self.msg_time, received_dt=self.tnow,
+                           price=Decimal("1.0001"), volume=Decimal("1.5"), counter_volume=Decimal("76000.0"))
+
+    def test_binary_round_trip_matches_dict(self):
+        serializer = BinaryTradeSerializer()
+        data = serializer.encode(self.trade)
+        self.assertEqual(self.trade.to_dict(), serializer.decode(data))
+        self.assertLess(len(data), len(JsonTradeSerializer.encode(self.trade)) / 3)
+
+    def test_binary_fixed_point_trade(self):
+        numerics = FixedPointNumerics(price_decimals=8, volume_decimals=8)
+        trade = Trade("XBTZAR", self.msg_time, self.tnow, numerics.parse_price('446270.00000000'),
+                      numerics.parse_volume('0.00112000'),
+                      numerics.parse_counter_volume('499.8224000000000000'), numerics)
+        self.assertEqual(trade.to_dict(), BinaryTradeSerializer().decode(BinaryTradeSerializer().encode(trade)))
+
+    def test_binary_large_counter_volume(self):
+        numerics = FixedPointNumerics(price_decimals=8, volume_decimals=8)
+        # 1.5 BTC at 446270 ZAR doesn't fit an int64 at 16 decimal places
+        trade = Trade("XBTZAR", self.msg_time, self.tnow, numerics.parse_price('446270'),
+                      numerics.parse_volume('1.5'), numerics.parse_counter_volume('669405'), numerics)
+        self.assertEqual('669405', BinaryTradeSerializer().decode(BinaryTradeSerializer().encode(trade))
+                         ['counter_volume'])
+
+    def test_serializer_for_encoding(self):
+        self.assertIsInstance(serializer_for_encoding(None), JsonTradeSerializer)
+        self.assertIsInstance(serializer_for_encoding('binary-v1'), BinaryTradeSerializer)
+        self.assertEqual(self.trade.to_dict(), serializer_for_encoding('json').decode(self.trade.to_json().encode()))
+        with self.assertRaises(ValueError):
+            serializer_for_encoding('protobuf')
+
+
+if __name__ == '__main__':
+    unittest.main()
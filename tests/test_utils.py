@@ -0,0 +1,49 @@
+import datetime as dt
+import logging
+import unittest
+
+import utils.utils
+from utils.utils import (LogLevelFlags, refresh_log_level_flags, datetime_to_epoch_ns, epoch_ns_to_datetime,
+                         setup_logging)
+
+
+class UtilsTest(unittest.TestCase):
+    def test_log_level_flags_refresh(self):
+        logger = logging.getLogger('test_utils.flags')
+        logger.setLevel(logging.INFO)
+        flags = LogLevelFlags(logger)
+        self.assertTrue(flags.info)
+        self.assertFalse(flags.debug)
+
+        logger.setLevel(logging.DEBUG)
+        self.assertFalse(flags.debug)  # cached until refreshed
+        refresh_log_level_flags()
+        self.assertTrue(flags.debug)
+        logger.setLevel(logging.NOTSET)
+
+    def test_setup_logging_leaves_root_unfiltered(self):
+        root = logging.getLogger()
+        handlers, level, handler_level = list(root.handlers), root.level, utils.utils._handler_level
+        try:
+            setup_logging(level=logging.INFO)
+            # third party loggers still reach the handlers, which filter by level
+            self.assertEqual(logging.NOTSET, root.level)
+            flags = LogLevelFlags(logging.getLogger('test_utils.handler_level'))
+            self.assertTrue(flags.info)
+            self.assertFalse(flags.debug)
+        finally:
+            for handler in root.handlers[len(handlers):]:
+                root.removeHandler(handler)
+            root.setLevel(level)
+            utils.utils._handler_level = handler_level
+            refresh_log_level_flags()
+
+    def test_epoch_ns_round_trip(self):
+        value = dt.datetime(2022, 1, 12, 4, 5, 5, 654321)
+        self.assertEqual(1641960305654321000, datetime_to_epoch_ns(value))
+        self.assertEqual(1641960305654321000, datetime_to_epoch_ns(value.replace(tzinfo=dt.timezone.utc)))
+        self.assertEqual(value, epoch_ns_to_datetime(datetime_to_epoch_ns(value)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,62 +1,81 @@
 import json
 import queue
+import time
 import datetime as dt
 from logging import getLogger
 from decimal import *
 
+from numerics import DecimalNumerics
+from utils.utils import LogLevelFlags
+
 log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
 
 
 class Trade:
+    __slots__ = ('symbol', 'exchange_timestamp', 'received_timestamp', 'price', 'volume', 'counter_volume',
+                 'numerics', 'queued_ns')
+
     def __init__(self,
                  symbol: str,
                  exchange_dt: dt.datetime,
                  received_dt: dt.datetime,
                  price: Decimal,
                  volume: Decimal,
-                 counter_volume: Decimal):
+                 counter_volume: Decimal,
+                 numerics=None):
+        # price, volume and counter_volume are scaled ints when numerics is a FixedPointNumerics
         self.symbol = symbol
         self.exchange_timestamp = exchange_dt
         self.received_timestamp = received_dt
         self.price = price
         self.volume = volume
         self.counter_volume = counter_volume
+        self.numerics = numerics or DecimalNumerics
+        # time.monotonic_ns() when put on a trade queue, so the consumer can time how long it waited
+        self.queued_ns = None
 
     def to_dict(self):
-        my_dict = {}
-        for key, value in self.__dict__.items():
-            if isinstance(value, (int, float, str, bool, list, tuple, dict, type(None))):
-                my_dict[key] = value
-            else:
-                # Handle unsupported types here. For example, datetime and decimals.
-                if isinstance(value, Decimal):
-                    my_dict[key] = str(value)
-                if isinstance(value, dt.datetime):
-                    my_dict[key] = value.isoformat()
-
-        # Serialize the dictionary to JSON format
-        return my_dict
+        # this is the output boundary, so fixed point values are turned back into Decimals here
+        return {'symbol': self.symbol,
+                'exchange_timestamp': self.exchange_timestamp.isoformat(),
+                'received_timestamp': self.received_timestamp.isoformat(),
+                'price': str(self.numerics.price_to_decimal(self.price)),
+                'volume': str(self.numerics.volume_to_decimal(self.volume)),
+                'counter_volume': str(self.numerics.counter_volume_to_decimal(self.counter_volume))}
 
     def to_json(self):
         return json.dumps(self.to_dict())
 
 
 class TradeProcessor:
-    def __init__(self, trade_queue: queue.Queue):
+    """Puts each trade on trade_queue without blocking, as this runs on the thread applying book updates. Pass a
+    trade_handoff.TradeHandoff to choose what happens when the consumer falls behind, a full queue.Queue drops
+    the trade. trade_queue can be None when only the trade_listeners, such as a bars.BarPublisher, want the trades"""
+    def __init__(self, trade_queue: queue.Queue, numerics=None):
         self.trade_queue = trade_queue
+        self.numerics = numerics or DecimalNumerics
         self.last_trade: Trade = None
+        self.trades_processed = 0
+        self.trades_dropped = 0
+        self.trade_listeners = []  # called with each Trade, on the thread applying book updates
 
-    def on_trade(self, symbol, order_record: dict, trade_base, trade_counter, exchange_dt, received_dt):
-        price = Decimal(order_record['price'])
-        trade = Trade(symbol, exchange_dt, received_dt, price, trade_base, trade_counter)
-        if self.trade_queue:
+    def on_trade(self, symbol, order_record, trade_base, trade_counter, exchange_dt, received_dt):
+        price = order_record.price
+        trade = Trade(symbol, exchange_dt, received_dt, price, trade_base, trade_counter, self.numerics)
+        self.trades_processed += 1
+        for listener in self.trade_listeners:
+            listener(trade)
+        if self.trade_queue is not None:
             try:
-                log.info(f"About to put trade. Trade queue size: {self.trade_queue.qsize()}")
-                self.trade_queue.put(trade, block=True, timeout=10)
-                log.info(f"Queued trade. Trade queue size: {self.trade_queue.qsize()}")
+                trade.queued_ns = time.monotonic_ns()
+                self.trade_queue.put_nowait(trade)
+                if log_flags.debug:
+                    log.debug(f"Queued trade. Trade queue size: {self.trade_queue.qsize()}")
                 self.last_trade = trade
-            except queue.Full as e:
-                log.exception(f"Queue ran out of space:", e)
+            except queue.Full:
+                self.trades_dropped += 1
+                log.error(f"Trade queue full, dropped {symbol} trade ({self.trades_dropped} dropped)")
 
 
 
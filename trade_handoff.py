@@ -0,0 +1,271 @@
+"""Handoffs between the threads applying book updates and the publisher consuming their trades. A put never blocks
+on the consumer, however far behind it is; what happens once maxsize trades are waiting depends on the strategy:
+
+- drop_oldest: the oldest waiting trade is dropped to make room
+- coalesce: the trade is merged into the newest waiting trade for its symbol when they're at the same price, summing
+  the volumes, otherwise the oldest waiting trade is dropped
+- spill: trades past maxsize are appended to a file on local disk, and read back in order once the consumer has
+  caught up with the ones in memory, so nothing is lost
+
+They have the queue.Queue methods GcpRePublisher uses, so can be passed anywhere a trade queue is. drop_oldest works
+for anything put on it, e.g. book snapshots; stream labels the handoff's metrics with what it carries
+"""
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from logging import getLogger
+
+from metrics import REGISTRY
+from trade_serializers import BinaryTradeSerializer
+
+log = getLogger(__name__)
+
+SPILL_RECORD_HEADER = struct.Struct('<qI')  # queued_ns (-1 when not set), encoded trade length
+SPILL_READ_BYTES = 256 * 1024
+
+
+class TradeHandoff:
+    strategy = None
+
+    def __init__(self, maxsize=1000, stream='trades'):
+        self.maxsize = maxsize
+        self.stream = stream
+        self.puts = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._items = deque()
+        self._not_empty = threading.Condition()
+        # the time a put holds up the thread putting, e.g. the one applying book updates
+        self.put_time = REGISTRY.histogram('handoff_put', "Handed off to the consumer", thread_safe=True,
+                                           strategy=self.strategy, stream=stream)
+
+    def put(self, item, block=True, timeout=None):
+        # block and timeout are accepted for queue.Queue compatibility, a put never blocks
+        start_ns = time.perf_counter_ns()
+        with self._not_empty:
+            self.puts += 1
+            self._put(item)
+            self._added()
+        self.put_time.record(time.perf_counter_ns() - start_ns)
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            self._wait(block, timeout)
+            return self._get()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        with self._not_empty:
+            return self._depth()
+
+    def empty(self) -> bool:
+        return not self.qsize()
+
+    def _added(self):
+        # with the lock held
+        depth = self._depth()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        self._not_empty.notify()
+
+    def _wait(self, block, timeout):
+        # with the lock held, until there's something to get
+        if not block:
+            if not self._depth():
+                raise queue.Empty
+        elif not self._not_empty.wait_for(self._depth, timeout):
+            raise queue.Empty
+
+    def _put(self, item):
+        if len(self._items) >= self.maxsize:
+            self._drop_oldest()
+        self._items.append(item)
+
+    def _drop_oldest(self):
+        self._get()
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            log.warning(f"Trade handoff full at {self.maxsize}, {self.dropped} trades dropped")
+
+    def _get(self):
+        return self._items.popleft()
+
+    def _depth(self) -> int:
+        return len(self._items)
+
+    def metrics(self) -> dict:
+        with self._not_empty:
+            return {'strategy': self.strategy,
+                    'stream': self.stream,
+                    'depth': self._depth(),
+                    'max_depth': self.max_depth,
+                    'puts': self.puts,
+                    'dropped': self.dropped}
+
+
+class DropOldestHandoff(TradeHandoff):
+    strategy = 'drop_oldest'
+
+
+class CoalescingHandoff(TradeHandoff):
+    """A trade is only merged once the handoff is full, so while the consumer keeps up every trade goes through as
+    it was. Merging keeps the later trade's timestamps"""
+    strategy = 'coalesce'
+
+    def __init__(self, maxsize=1000, stream='trades'):
+        super().__init__(maxsize, stream)
+        self.coalesced = 0
+        self._newest = {}  # symbol to the newest of its trades still waiting
+
+    def _put(self, trade):
+        if len(self._items) >= self.maxsize:
+            newest = self._newest.get(trade.symbol)
+            if newest is not None and newest.price == trade.price and newest.numerics is trade.numerics:
+                newest.volume += trade.volume
+                newest.counter_volume += trade.counter_volume
+                newest.exchange_timestamp = trade.exchange_timestamp
+                newest.received_timestamp = trade.received_timestamp
+                self.coalesced += 1
+                return
+            self._drop_oldest()
+        self._items.append(trade)
+        self._newest[trade.symbol] = trade
+
+    def _get(self):
+        trade = self._items.popleft()
+        if self._newest.get(trade.symbol) is trade:
+            del self._newest[trade.symbol]
+        return trade
+
+    def metrics(self) -> dict:
+        metrics = super().metrics()
+        metrics['coalesced'] = self.coalesced
+        return metrics
+
+
+class SpillToDiskHandoff(TradeHandoff):
+    """Spilled trades are written with BinaryTradeSerializer, so come back as Decimal trades whatever numerics they
+    were captured with, which publish the same. The spill file is a temporary file in spill_dir (the system
+    default when None), and is truncated when spilling starts again after it's been read to the end.
+
+    The file is only read and written outside the condition's lock, with positioned I/O, so a consumer reading back
+    spilled trades doesn't hold up a put, nor a put spilling a trade the consumer. Only the offsets and counters are
+    updated under the lock. Puts that may spill are serialised by their own lock, to keep the trades in order"""
+    strategy = 'spill'
+
+    def __init__(self, maxsize=1000, spill_dir=None, stream='trades'):
+        super().__init__(maxsize, stream)
+        self.spilled = 0
+        self.serializer = BinaryTradeSerializer()
+        self._spill_file = tempfile.TemporaryFile(prefix='trade-spill-', dir=spill_dir)
+        self._fd = self._spill_file.fileno()
+        # records in [_read_pos, _write_pos) are waiting to be read back
+        self._read_pos = self._write_pos = 0
+        self._spill_pending = 0
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+    def put(self, trade, block=True, timeout=None):
+        start_ns = time.perf_counter_ns()
+        with self._write_lock:
+            with self._not_empty:
+                self.puts += 1
+                # once spilling, everything goes to the file until it's drained, to keep the trades in order
+                spill = self._spill_pending or len(self._items) >= self.maxsize
+                if not spill:
+                    self._items.append(trade)
+                    self._added()
+                rewind = spill and not self._spill_pending
+                if rewind:
+                    # everything spilled has been read back, so start the file again
+                    self._read_pos = self._write_pos = 0
+                write_pos = self._write_pos
+            if spill:
+                self._spill(trade, write_pos, rewind)
+        self.put_time.record(time.perf_counter_ns() - start_ns)
+
+    def _spill(self, trade, write_pos, rewind):
+        # with the write lock held, the only writer of the file and _write_pos
+        data = self.serializer.encode(trade)
+        queued_ns = trade.queued_ns if trade.queued_ns is not None else -1
+        record = SPILL_RECORD_HEADER.pack(queued_ns, len(data)) + data
+        if rewind:
+            os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, record, write_pos)
+        with self._not_empty:
+            self._write_pos = write_pos + len(record)
+            self._spill_pending += 1
+            self.spilled += 1
+            spilled = self.spilled
+            self._added()
+        if spilled == 1 or spilled % 10000 == 0:
+            log.warning(f"Trade handoff full at {self.maxsize}, {spilled} trades spilled to disk")
+
+    def get(self, block=True, timeout=None):
+        with self._read_lock:
+            with self._not_empty:
+                self._wait(block, timeout)
+                if self._items:
+                    return self._items.popleft()
+                # only spilled trades are waiting. Nothing else moves _read_pos, and a put won't rewind the file
+                # while they're pending
+                read_pos, write_pos = self._read_pos, self._write_pos
+            trades, consumed = self._read_spilled(read_pos, write_pos)
+            with self._not_empty:
+                self._read_pos = read_pos + consumed
+                self._spill_pending -= len(trades)
+                # any trade put since is spilled, so is behind these
+                self._items.extend(trades)
+                return self._items.popleft()
+
+    def _read_spilled(self, read_pos, write_pos):
+        data = os.pread(self._fd, min(write_pos - read_pos, SPILL_READ_BYTES), read_pos)
+        trades = []
+        offset = 0
+        while offset + SPILL_RECORD_HEADER.size <= len(data):
+            queued_ns, length = SPILL_RECORD_HEADER.unpack_from(data, offset)
+            end = offset + SPILL_RECORD_HEADER.size + length
+            if end > len(data):
+                if not offset:
+                    # a single record bigger than the read, take all of it
+                    data += os.pread(self._fd, end - len(data), read_pos + len(data))
+                else:
+                    break
+            trade = self.serializer.decode_trade(data[offset + SPILL_RECORD_HEADER.size:end])
+            if queued_ns >= 0:
+                trade.queued_ns = queued_ns
+            trades.append(trade)
+            offset = end
+        return trades, offset
+
+    def _depth(self) -> int:
+        return len(self._items) + self._spill_pending
+
+    def close(self):
+        self._spill_file.close()
+
+    def metrics(self) -> dict:
+        metrics = super().metrics()
+        with self._not_empty:
+            metrics['spilled'] = self.spilled
+            metrics['spill_bytes'] = self._write_pos - self._read_pos
+        return metrics
+
+
+HANDOFF_STRATEGIES = {handoff.strategy: handoff for handoff in (DropOldestHandoff, CoalescingHandoff,
+                                                                  SpillToDiskHandoff)}
+
+
+def make_trade_handoff(strategy: str, maxsize=1000, stream='trades', **kwargs) -> TradeHandoff:
+    if strategy not in HANDOFF_STRATEGIES:
+        raise ValueError(f"Unknown trade handoff strategy {strategy}, known: {list(HANDOFF_STRATEGIES)}")
+    return HANDOFF_STRATEGIES[strategy](maxsize, stream=stream, **kwargs)
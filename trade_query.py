@@ -0,0 +1,218 @@
+"""Queries over the trades archived by archive_sink.ArchiveSink: the trades for a symbol in a time range, their VWAP,
+and OHLCV bars, computed with vectorised numpy over memory mapped Arrow IPC files.
+
+ArchiveSink writes each file a sidecar part-NNNN.arrow.index.json with its row count and min/max exchange timestamp
+as it's closed. For a file without one, e.g. from before the sidecars, the index is worked out on its first query and
+kept in memory, as the archive may be mounted read only. Files whose range doesn't overlap a query are skipped
+without being opened, and files wholly inside it are read without a filter.
+Uncompressed archives are read zero copy from the mapping, compressed ones are decompressed on read.
+
+Only the columns a query needs are read, and decompressed. Files written with different decimals are brought to the
+most decimals of any of them, as int64, raising ValueError if that would overflow. Sums are taken in float64, so
+can't wrap around, and aggregates are float64. Times are epoch nanoseconds or naive UTC datetimes, and ranges are
+[start, end)
+"""
+import datetime as dt
+import glob
+import json
+import os
+from logging import getLogger
+
+try:
+    import numpy as np
+    import pyarrow as pa
+except ImportError:
+    np = pa = None
+
+from archive_sink import INDEX_SUFFIX, INT64_MAX, TRADES
+from utils.utils import datetime_to_epoch_ns
+
+log = getLogger(__name__)
+
+TRADE_COLUMNS = ('exchange_timestamp', 'received_timestamp', 'price', 'volume', 'counter_volume')
+SCALED_COLUMNS = TRADE_COLUMNS[2:]
+
+
+def _epoch_ns(value) -> int:
+    if value is None or isinstance(value, int):
+        return value
+    return datetime_to_epoch_ns(value)
+
+
+def _file_decimals(metadata) -> dict:
+    decimals = int(metadata[b'decimals'])
+    # files from before counter volumes had their own scale have them at decimals
+    counter_volume_decimals = int(metadata.get(b'counter_volume_decimals', decimals))
+    return {'price': decimals, 'volume': decimals, 'counter_volume': counter_volume_decimals}
+
+
+def _rescaled(name, column, extra_decimals):
+    factor = 10 ** extra_decimals
+    # int64 would wrap around silently
+    if len(column) and max(int(column.max()), -int(column.min())) > INT64_MAX // factor:
+        raise ValueError(f"{name} values don't fit an int64 at {extra_decimals} more decimal places")
+    return column * factor
+
+
+def _column(table, name):
+    column = table.column(name)
+    if pa.types.is_timestamp(column.type):
+        column = column.cast(pa.int64())
+    return column.to_numpy()
+
+
+class TradeColumns:
+    """Trades as parallel numpy arrays in exchange timestamp order. Timestamps are int64 epoch nanoseconds, and
+    prices and volumes float64, unscaled"""
+    __slots__ = TRADE_COLUMNS
+
+    def __init__(self, exchange_timestamp, received_timestamp, price, volume, counter_volume):
+        self.exchange_timestamp = exchange_timestamp
+        self.received_timestamp = received_timestamp
+        self.price = price
+        self.volume = volume
+        self.counter_volume = counter_volume
+
+    def __len__(self):
+        return len(self.exchange_timestamp)
+
+
+class Bars:
+    """OHLCV bars as parallel numpy arrays, one entry per interval with at least one trade"""
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'counter_volume', 'vwap', 'trades')
+
+    def __init__(self, start, open_, high, low, close, volume, counter_volume, trades):
+        self.start = start
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.counter_volume = counter_volume
+        self.vwap = counter_volume / volume
+        self.trades = trades
+
+    def __len__(self):
+        return len(self.start)
+
+    def to_dicts(self):
+        return [{name: getattr(self, name)[n].item() for name in self.__slots__} for n in range(len(self))]
+
+
+class TradeQuery:
+    def __init__(self, root):
+        if np is None:
+            raise ValueError("numpy and pyarrow must be installed to query the archive")
+        self.root = root
+        self.files_read = 0
+        self.files_skipped = 0
+        self._indexes = {}  # path to its index, whether read from the sidecar or worked out
+
+    def files(self, symbol):
+        return sorted(glob.glob(os.path.join(self.root, TRADES, f"symbol={symbol}", "date=*", "hour=*", "*.arrow")))
+
+    def file_index(self, path) -> dict:
+        index = self._indexes.get(path)
+        if index is None:
+            index = self._indexes[path] = self._load_index(path)
+        return index
+
+    def _load_index(self, path) -> dict:
+        try:
+            with open(path + INDEX_SUFFIX) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        timestamps = _column(self._read(path, ('exchange_timestamp',)), 'exchange_timestamp')
+        return {'rows': len(timestamps),
+                'min_exchange_ns': int(timestamps.min()) if len(timestamps) else None,
+                'max_exchange_ns': int(timestamps.max()) if len(timestamps) else None}
+
+    @staticmethod
+    def _read(path, names):
+        """The named columns of the file at path, the others aren't read or decompressed"""
+        # the mapping stays open for as long as the table's buffers reference it
+        source = pa.memory_map(path)
+        schema = pa.ipc.open_file(source).schema
+        options = pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(name) for name in names])
+        return pa.ipc.open_file(source, options=options).read_all().replace_schema_metadata(schema.metadata)
+
+    def trades(self, symbol, start=None, end=None) -> TradeColumns:
+        columns, decimals = self._load(symbol, start, end, TRADE_COLUMNS)
+        return TradeColumns(columns[0], columns[1], *(column * 10.0 ** -decimals[name]
+                                                      for name, column in zip(SCALED_COLUMNS, columns[2:])))
+
+    def vwap(self, symbol, start=None, end=None) -> float:
+        """None when there are no trades in the range"""
+        (volume, counter_volume), decimals = self._load(symbol, start, end, ('volume', 'counter_volume'))
+        volume = volume.sum(dtype=np.float64)
+        if not volume:
+            return None
+        return float(counter_volume.sum(dtype=np.float64) / volume) * \
+            10.0 ** (decimals['volume'] - decimals['counter_volume'])
+
+    def ohlcv(self, symbol, start=None, end=None, interval=dt.timedelta(minutes=1)) -> Bars:
+        """Bars are aligned to multiples of interval since the epoch"""
+        interval_ns = int(interval.total_seconds() * 1e9) if isinstance(interval, dt.timedelta) else interval
+        (timestamps, price, volume, counter_volume), decimals = self._load(
+            symbol, start, end, ('exchange_timestamp', 'price', 'volume', 'counter_volume'))
+        if not len(timestamps):
+            empty = np.empty(0)
+            return Bars(timestamps, empty, empty, empty, empty, empty, empty, timestamps)
+        buckets = timestamps // interval_ns
+        # trades are in time order, so each bar is a contiguous run
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)]
+        # aggregate the scaled integers, only the bars are scaled
+        price_scale, volume_scale = 10.0 ** -decimals['price'], 10.0 ** -decimals['volume']
+        return Bars(buckets[starts] * interval_ns, price[starts] * price_scale,
+                    np.maximum.reduceat(price, starts) * price_scale, np.minimum.reduceat(price, starts) * price_scale,
+                    price[ends - 1] * price_scale, np.add.reduceat(volume.astype(np.float64), starts) * volume_scale,
+                    np.add.reduceat(counter_volume.astype(np.float64), starts) * 10.0 ** -decimals['counter_volume'],
+                    ends - starts)
+
+    def _load(self, symbol, start, end, names):
+        """The named columns of the symbol's trades in [start, end) in time order, prices and volumes still as
+        scaled integers, with the number of decimals each of them is scaled by"""
+        start_ns, end_ns = _epoch_ns(start), _epoch_ns(end)
+        # the timestamps are needed to filter and order, whether or not they were asked for
+        loaded = ('exchange_timestamp',) + tuple(name for name in names if name != 'exchange_timestamp')
+        parts = []
+        for path in self.files(symbol):
+            index = self.file_index(path)
+            if not index['rows'] or (start_ns is not None and index['max_exchange_ns'] < start_ns) \
+                    or (end_ns is not None and index['min_exchange_ns'] >= end_ns):
+                self.files_skipped += 1
+                continue
+            table = self._read(path, loaded)
+            self.files_read += 1
+            file_decimals = _file_decimals(table.schema.metadata)
+            columns = [_column(table, name) for name in loaded]
+            timestamps = columns[0]
+            if (start_ns is not None and index['min_exchange_ns'] < start_ns) \
+                    or (end_ns is not None and index['max_exchange_ns'] >= end_ns):
+                mask = np.ones(len(timestamps), dtype=bool)
+                if start_ns is not None:
+                    mask &= timestamps >= start_ns
+                if end_ns is not None:
+                    mask &= timestamps < end_ns
+                columns = [column[mask] for column in columns]
+            parts.append((columns, file_decimals))
+
+        if not parts:
+            columns = [np.empty(0, dtype=np.int64)] * len(loaded)
+            decimals = {name: 0 for name in SCALED_COLUMNS}
+        else:
+            # scaling up to the most decimals is an exact integer multiply, scaling down would lose places
+            decimals = {name: max(file_decimals[name] for _, file_decimals in parts) for name in SCALED_COLUMNS}
+            parts = [[column if name not in decimals or file_decimals[name] == decimals[name] else
+                      _rescaled(name, column, decimals[name] - file_decimals[name])
+                      for name, column in zip(loaded, columns)]
+                     for columns, file_decimals in parts]
+            columns = [np.concatenate(column_parts) for column_parts in zip(*parts)]
+            timestamps = columns[0]
+            if (timestamps[1:] < timestamps[:-1]).any():
+                # late trades are archived as a later part of their hour
+                order = np.argsort(timestamps, kind='stable')
+                columns = [column[order] for column in columns]
+        return [columns[loaded.index(name)] for name in names], decimals
@@ -0,0 +1,103 @@
+"""Wire formats for trade.Trade. Publishers tag each message with the serializer's encoding as a message attribute,
+and subscribers use it to pick the matching decoder. Both decoders return the same dict as Trade.to_dict()
+"""
+import json
+import struct
+from decimal import *
+
+from trade import Trade
+from utils.utils import datetime_to_epoch_ns, epoch_ns_to_datetime
+
+ENCODING_ATTRIBUTE = "encoding"
+_INT64_MAX = 2 ** 63 - 1
+
+
+class JsonTradeSerializer:
+    encoding = "json"
+
+    @staticmethod
+    def encode(trade) -> bytes:
+        return trade.to_json().encode("utf-8")
+
+    @staticmethod
+    def decode(data: bytes) -> dict:
+        return json.loads(data)
+
+
+class BinaryTradeSerializer:
+    """Fixed struct layout, little endian: version, exchange and received timestamps as epoch nanoseconds, then
+    price, volume and counter volume each as an int64 mantissa and int8 decimal exponent, then the symbol as a
+    length prefixed UTF-8 string"""
+    encoding = "binary-v1"
+    VERSION = 1
+    LAYOUT = struct.Struct('<BqqqbqbqbB')
+
+    def encode(self, trade) -> bytes:
+        numerics = trade.numerics
+        if numerics.fixed_point:
+            # normalized, as Trade.to_dict() does for fixed point trades
+            price = _compact(*_strip_zeros(trade.price, -numerics.price_decimals))
+            volume = _compact(*_strip_zeros(trade.volume, -numerics.volume_decimals))
+            counter_volume = _compact(*_strip_zeros(trade.counter_volume, -numerics.counter_volume_decimals))
+        else:
+            price = _mantissa_exponent(trade.price)
+            volume = _mantissa_exponent(trade.volume)
+            counter_volume = _mantissa_exponent(trade.counter_volume)
+        symbol = trade.symbol.encode("utf-8")
+        return self.LAYOUT.pack(self.VERSION,
+                                datetime_to_epoch_ns(trade.exchange_timestamp),
+                                datetime_to_epoch_ns(trade.received_timestamp),
+                                *price, *volume, *counter_volume, len(symbol)) + symbol
+
+    def decode(self, data: bytes) -> dict:
+        return self.decode_trade(data).to_dict()
+
+    def decode_trade(self, data: bytes) -> Trade:
+        (version, exchange_ns, received_ns, price, price_exponent, volume, volume_exponent, counter_volume,
+         counter_volume_exponent, symbol_length) = self.LAYOUT.unpack_from(data)
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported binary trade version {version}")
+        symbol = bytes(data[self.LAYOUT.size:self.LAYOUT.size + symbol_length]).decode("utf-8")
+        return Trade(symbol, epoch_ns_to_datetime(exchange_ns), epoch_ns_to_datetime(received_ns),
+                     Decimal(price).scaleb(price_exponent), Decimal(volume).scaleb(volume_exponent),
+                     Decimal(counter_volume).scaleb(counter_volume_exponent))
+
+
+def _mantissa_exponent(value: Decimal):
+    text = str(value)
+    if 'E' in text:
+        exponent = value.as_tuple().exponent
+        return _compact(int(value.scaleb(-exponent)), exponent)
+    # splitting the string is quicker than going through as_tuple() digits
+    whole, _, fraction = text.partition('.')
+    return _compact(int(whole + fraction), -len(fraction))
+
+
+def _strip_zeros(mantissa: int, exponent: int):
+    if mantissa == 0:
+        return 0, 0
+    while mantissa % 10 == 0:
+        mantissa //= 10
+        exponent += 1
+    return mantissa, exponent
+
+
+def _compact(mantissa: int, exponent: int):
+    # drop trailing zeros only when needed to fit the mantissa in an int64
+    while abs(mantissa) > _INT64_MAX and mantissa % 10 == 0:
+        mantissa //= 10
+        exponent += 1
+    if abs(mantissa) > _INT64_MAX or not -128 <= exponent <= 127:
+        raise ValueError(f"{mantissa}E{exponent} can't be represented in the binary trade format")
+    return mantissa, exponent
+
+
+SERIALIZERS = {serializer.encoding: serializer for serializer in (JsonTradeSerializer(), BinaryTradeSerializer())}
+
+
+def serializer_for_encoding(encoding: str = None):
+    # messages published before the encoding attribute was added are JSON
+    try:
+        return SERIALIZERS[encoding or JsonTradeSerializer.encoding]
+    except KeyError:
+        raise ValueError(f"Unknown trade encoding {encoding}, known: {list(SERIALIZERS)}")
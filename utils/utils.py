@@ -1,5 +1,9 @@
+import datetime as dt
 import logging
+import logging.handlers
+import queue
 import sys
+import weakref
 
 
 class LessThanFilter(logging.Filter):
@@ -12,18 +16,49 @@ class LessThanFilter(logging.Filter):
         return 1 if record.levelno < self.max_level else 0
 
 
-def setup_logging():
+# the lowest level any handler installed by setup_logging emits, records below it are dropped by every handler
+_handler_level = logging.NOTSET
+
+
+class LogLevelFlags:
+    """Cached logger.isEnabledFor() results, also gated by the setup_logging handler level, so hot paths can skip
+    building log messages the handlers would drop with a plain attribute check. Call refresh_log_level_flags() after
+    changing logging config"""
+    _all_flags = weakref.WeakSet()
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self.refresh()
+        LogLevelFlags._all_flags.add(self)
+
+    def refresh(self):
+        self.debug = logging.DEBUG >= _handler_level and self.logger.isEnabledFor(logging.DEBUG)
+        self.info = logging.INFO >= _handler_level and self.logger.isEnabledFor(logging.INFO)
+
+
+def refresh_log_level_flags():
+    for flags in list(LogLevelFlags._all_flags):
+        flags.refresh()
+
+
+def setup_logging(level=logging.INFO, use_queue=False):
+    """Log level and above to stdout, warnings and above to stderr. With use_queue, records are handed to a
+    QueueListener thread which does the stdout/stderr I/O; the listener is returned and should be stopped
+    at shutdown"""
+    global _handler_level
     root = logging.getLogger()
     root.setLevel(logging.NOTSET)
+    # the handlers do the filtering, and the flags skip building what they'd drop
+    _handler_level = level
 
     handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.INFO)
+    handler.setLevel(level)
     handler.addFilter(LessThanFilter(logging.WARNING))
     # formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     formatter = logging.Formatter(fmt='%(asctime)s.%(msecs)03d:%(filename)s:%(lineno)s:[%(levelname)s] - %(message)s',
                                   datefmt="%Y-%m-%d %H:%M:%S")
     handler.setFormatter(formatter)
-    root.addHandler(handler)
+    stdout_handler = handler
 
     handler = logging.StreamHandler(sys.stderr)
     handler.setLevel(logging.WARNING)
@@ -32,4 +67,32 @@ def setup_logging():
         datefmt="%Y-%m-%d %H:%M:%S")
 
     handler.setFormatter(formatter_red)
-    root.addHandler(handler)
+    stderr_handler = handler
+
+    listener = None
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, stdout_handler, stderr_handler,
+                                                  respect_handler_level=True)
+        listener.start()
+    else:
+        root.addHandler(stdout_handler)
+        root.addHandler(stderr_handler)
+
+    refresh_log_level_flags()
+    return listener
+
+
+_EPOCH = dt.datetime(1970, 1, 1)
+_EPOCH_UTC = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def datetime_to_epoch_ns(value: dt.datetime) -> int:
+    # naive datetimes are taken to be UTC, as produced by utcnow() / utcfromtimestamp()
+    delta = value - (_EPOCH if value.tzinfo is None else _EPOCH_UTC)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def epoch_ns_to_datetime(value: int) -> dt.datetime:
+    return _EPOCH + dt.timedelta(microseconds=value // 1000)
@@ -1,84 +1,149 @@
 import datetime as dt
 import json
+import time
 import websocket
 from logging import getLogger
 from websocket import ABNF
 
-import secret_consts
+from decoders import get_decoder
+from book_validator import BookValidator, DEFAULT_AUDIT_INTERVAL_SECS
+from metrics import REGISTRY
 from order_book_state import OrderBookState
+from resync import BookResync
+from utils.utils import LogLevelFlags, epoch_ns_to_datetime
 
 log = getLogger(__name__)
+log_flags = LogLevelFlags(log)
+
+BOOK_UPDATE_TYPES = ('snapshot', 'trade', 'create', 'delete')
 
 
 class WebsocketCallbackHandlers:
-    def __init__(self, order_book_state: OrderBookState):
+    def __init__(self, order_book_state: OrderBookState, decoder=None, recorder=None, background_resync=True,
+                 audit_interval_secs=DEFAULT_AUDIT_INTERVAL_SECS):
         self.order_book_state = order_book_state
+        self.decoder = decoder or get_decoder()
+        # optional FrameLogWriter which every raw frame is appended to, for later replay
+        self.recorder = recorder
+        self.messages_received = 0
+        self.wsocket = None  # the live connection, set by start_ws so it can be closed from another thread
+        self.resync = BookResync(order_book_state, self.dispatch, background=background_resync)
+        # checks the levels each update touches, and audits the whole book every audit_interval_secs
+        self.validator = BookValidator(order_book_state, audit_interval_secs)
+        symbol = order_book_state.symbol
+        self.receive_latency = REGISTRY.histogram('exchange_to_receive', "Exchange timestamp to frame received",
+                                                  symbol=symbol)
+        self.decode_time = REGISTRY.histogram('decode', "Decoding a frame", symbol=symbol)
+        self.book_update_time = {update_type: REGISTRY.histogram('book_update', "Applying an update to the book",
+                                                                 symbol=symbol, type=update_type)
+                                 for update_type in BOOK_UPDATE_TYPES}
 
     def on_message(self, wsocket: websocket.WebSocketApp, message):
+        received_ns = time.time_ns()  # do this early as possible
+        if self.recorder:
+            try:
+                self.recorder.append(message, received_ns)
+            except Exception as e:
+                log.exception(e)
+        self.on_frame(wsocket, message, received_ns)
+
+    def on_frame(self, wsocket, message, received_ns: int):
+        # processes a frame received at received_ns (epoch nanoseconds), either live or from a replay
+        self.messages_received += 1
         try:
             # extract timestamp
-            now_datetime = dt.datetime.utcnow()  # do this early as possible
-            msg_data = json.loads(message)
-            ts = msg_data.get('timestamp')
+            now_datetime = epoch_ns_to_datetime(received_ns)
+            decode_start_ns = time.perf_counter_ns()
+            msg_data = self.decoder.decode(message)
+            self.decode_time.record(time.perf_counter_ns() - decode_start_ns)
+            ts = msg_data.timestamp
+            # the exchange only gives wall clock milliseconds, so this is the one stage not timed on a monotonic clock
+            latency_ns = received_ns - ts * 1_000_000
+            self.receive_latency.record(latency_ns)
             msg_datetime = dt.datetime.utcfromtimestamp(ts / 1000)
-            latency = now_datetime - msg_datetime
-            log.debug(f"Message latency: {latency} ({msg_datetime=}, {now_datetime=})")
-
-            # process sequence number
-            sequence_no = int(msg_data.get('sequence'))
-            if sequence_no > self.order_book_state.sequence_num:
-                # good sequence, save it
-                self.order_book_state.sequence_num = sequence_no
-            else:
-                # bad sequence, re-init
-
-                # TODO: According to Luno API doc, if an update is received out-of-sequence (for example update sequence
-                #  n+2 or n-1 received after update sequence n), the client cannot continue and must reinitialise the
-                #  subscription and state. This branch is untested as yet
-                log.error(f"Bad sequence number detected. "
-                          f"Had seq: {self.order_book_state.sequence_num}, but received: {sequence_no}")
-                self.order_book_state.sequence_num = 0
-                self.order_book_state.out_of_sequence_restart = True
-                wsocket.close()
-
-            # log.debug(f"On message json: {msg_data}")  # print the received message
-            asks_initial = msg_data.get("asks")
-            bids_initial = msg_data.get("bids")
-            trade_update = msg_data.get("trade_updates")
-            create_update = msg_data.get("create_update")
-            delete_update = msg_data.get("delete_update")
-            status_update = msg_data.get("status_update")
+            if log_flags.debug:
+                log.debug(f"Message latency: {latency_ns / 1e6:.3f}ms ({msg_datetime=}, {now_datetime=})")
+
+            with self.order_book_state.lock:
+                # deltas are buffered behind the fresh snapshot until it's loaded into the shadow book
+                if self.resync.active and self.resync.on_frame(msg_data, msg_datetime, now_datetime):
+                    return
+                if (msg_data.asks or msg_data.bids) and self.order_book_state.sequence_num > 0:
+                    # a snapshot on a reconnect, build it alongside the book we already have rather than on top of it
+                    self.resync.begin(self.order_book_state.sequence_num)
+                    self.resync.on_frame(msg_data, msg_datetime, now_datetime)
+                    return
+
+                # process sequence number
+                sequence_no = int(msg_data.sequence)
+                if sequence_no > self.order_book_state.sequence_num:
+                    # good sequence, save it
+                    self.order_book_state.sequence_num = sequence_no
+                else:
+                    # bad sequence. According to the Luno API doc, if an update is received out-of-sequence (for example
+                    # update sequence n+2 or n-1 received after update sequence n), the client cannot continue and must
+                    # reinitialise the subscription and state. The update isn't applied, and the book is resynchronised
+                    # from the snapshot on the new connection
+                    log.error(f"Bad sequence number detected. "
+                              f"Had seq: {self.order_book_state.sequence_num}, but received: {sequence_no}")
+                    self.resync.begin(self.order_book_state.sequence_num)
+                    self.order_book_state.out_of_sequence_restart = True
+                    wsocket.close()
+                    return
+
+                self.dispatch(self.order_book_state, msg_data, msg_datetime, now_datetime)
+
+        except Exception as e:
+            log.exception(e)
+
+    def dispatch(self, book_state: OrderBookState, msg_data, msg_datetime, now_datetime):
+        # applies a decoded, in sequence, frame to book_state - the live book, or a shadow book during a resync
+        # log.debug(f"On message json: {msg_data}")  # print the received message
+        asks_initial = msg_data.asks
+        bids_initial = msg_data.bids
+        trade_update = msg_data.trade_updates
+        create_update = msg_data.create_update
+        delete_update = msg_data.delete_update
+        status_update = msg_data.status_update
+        book_update_time = self.book_update_time
+        if asks_initial or bids_initial:
+            start_ns = time.perf_counter_ns()
             if asks_initial:
                 log.info(f"Received initial asks. Depth of book: {len(asks_initial)} asks in total")
-                self.order_book_state.on_initial(asks_initial, 'ASK', msg_datetime, now_datetime)
+                book_state.on_initial(asks_initial, 'ASK', msg_datetime, now_datetime)
             if bids_initial:
                 log.info(f"Received initial bids. Depth of book: {len(bids_initial)} bids in total")
-                self.order_book_state.on_initial(bids_initial, 'BID', msg_datetime, now_datetime)
-            if trade_update:
+                book_state.on_initial(bids_initial, 'BID', msg_datetime, now_datetime)
+            book_update_time['snapshot'].record(time.perf_counter_ns() - start_ns)
+        if trade_update:
+            if log_flags.debug:
                 log.debug(f"Received trade update")
                 log.debug(f"{trade_update}: {msg_datetime=}")
-                self.order_book_state.on_trade(trade_update, msg_datetime, now_datetime)
-                # self.trade_processor.on_trade(trade_update, msg_datetime, now_datetime)
-            if create_update:
+            start_ns = time.perf_counter_ns()
+            book_state.on_trade(trade_update, msg_datetime, now_datetime)
+            book_update_time['trade'].record(time.perf_counter_ns() - start_ns)
+            # self.trade_processor.on_trade(trade_update, msg_datetime, now_datetime)
+        if create_update:
+            if log_flags.debug:
                 log.debug(f"Received create update")
                 log.debug(f"{create_update}: {msg_datetime=}")
-                self.order_book_state.on_create(create_update, msg_datetime, now_datetime)
-            if delete_update:
+            start_ns = time.perf_counter_ns()
+            book_state.on_create(create_update, msg_datetime, now_datetime)
+            book_update_time['create'].record(time.perf_counter_ns() - start_ns)
+        if delete_update:
+            if log_flags.debug:
                 log.debug(f"Received delete update")
                 log.debug(f"{delete_update}: {msg_datetime=}")
-                self.order_book_state.on_delete(delete_update, msg_datetime, now_datetime)
-            if status_update:
-                log.warning(f"Received status update")
-                log.warning(f"{status_update}: {msg_datetime=}")
-
-            if not asks_initial and not bids_initial and not trade_update and not create_update and not delete_update \
-                    and not status_update:
-                log.debug(f"Received null message - json: {msg_data}")  # print the received message
+            start_ns = time.perf_counter_ns()
+            book_state.on_delete(delete_update, msg_datetime, now_datetime)
+            book_update_time['delete'].record(time.perf_counter_ns() - start_ns)
+        if status_update:
+            log.warning(f"Received status update")
+            log.warning(f"{status_update}: {msg_datetime=}")
 
-            self.order_book_state.validate_structures()
-
-        except Exception as e:
-            log.exception(e)
+        if log_flags.debug and not asks_initial and not bids_initial and not trade_update and not create_update \
+                and not delete_update and not status_update:
+            log.debug(f"Received null message - {msg_data}")  # print the received message
 
     @staticmethod
     def on_error(wsocket: websocket.WebSocketApp, error_exception):
@@ -95,42 +160,52 @@ class WebsocketCallbackHandlers:
     @staticmethod
     def on_open(wsocket: websocket.WebSocketApp):
         log.info("Connection established, sending credentials")
-        creds_dict = {"api_key_id": secret_consts.LUNO_KEY_ID, "api_key_secret": secret_consts.LUNO_SECRET}
-        json_data = json.dumps(creds_dict, ensure_ascii=False)
         # send a message to the WebSocket server
-        wsocket.send(json_data, opcode=ABNF.OPCODE_TEXT)
+        wsocket.send(credentials_message(), opcode=ABNF.OPCODE_TEXT)
+
+
+def credentials_message() -> str:
+    # only needed to authenticate a live connection, so replays and benchmarks can run without it
+    import secret_consts
+    creds_dict = {"api_key_id": secret_consts.LUNO_KEY_ID, "api_key_secret": secret_consts.LUNO_SECRET}
+    return json.dumps(creds_dict, ensure_ascii=False)
 
 
 def start_ws(url, order_book, callbacks, shutdown_evt):
     # creates a WebSocket connection and registers the event handlers
     websocket.enableTrace(False)  # enable debugging output
 
-    ws = websocket.WebSocketApp(url,
-                                on_message=callbacks.on_message,
-                                on_error=callbacks.on_error,
-                                on_close=callbacks.on_close,
-                                on_open=callbacks.on_open)
-    # start the WebSocket connection and run it in a separate thread
-    shutdown_with_error = False
-    # noinspection PyBroadException
-    try:
-        shutdown_with_error = ws.run_forever()
-    except Exception:
-        # catch is broad, as the only way run_forever unblocks is when an exception is thrown from one of the
-        # n_* handlers, and we don't know what that will be
-        pass
-
-    if shutdown_with_error:
-        log.error(f"Websocket shutdown ungracefully")
-        log.info("About to set event")
-        shutdown_evt.set()
-    else:
+    # reconnect in a loop rather than recursively, so a long session with many restarts doesn't grow the stack
+    while True:
+        ws = websocket.WebSocketApp(url,
+                                    on_message=callbacks.on_message,
+                                    on_error=callbacks.on_error,
+                                    on_close=callbacks.on_close,
+                                    on_open=callbacks.on_open)
+        callbacks.wsocket = ws
+        # start the WebSocket connection and run it in a separate thread
+        shutdown_with_error = False
+        # noinspection PyBroadException
+        try:
+            shutdown_with_error = ws.run_forever()
+        except Exception:
+            # catch is broad, as the only way run_forever unblocks is when an exception is thrown from one of the
+            # n_* handlers, and we don't know what that will be
+            pass
+
+        if shutdown_with_error:
+            log.error(f"Websocket shutdown ungracefully")
+            log.info("About to set event")
+            shutdown_evt.set()
+            return
+
         log.info("Websocket shutdown")
         if order_book.out_of_sequence_restart:
             log.info("Out of sequence restart needed")
             order_book.out_of_sequence_restart = False
-            start_ws(url, order_book, callbacks, shutdown_evt)
-        else:
-            log.info("About to set event")
-            shutdown_evt.set()
-            log.info("Good Bye!")
+            continue
+
+        log.info("About to set event")
+        shutdown_evt.set()
+        log.info("Good Bye!")
+        return